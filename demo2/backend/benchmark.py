@@ -0,0 +1,264 @@
+"""
+ColorQC - Analiz fonksiyonları için mikro kıyaslama (benchmark) paketi
+
+Her analiz fonksiyonu create_simulated_image ile üretilen deterministik karelerde
+(720p, 1080p, 4K) çalıştırılır; çağrı başına gecikme yüzdelikleri ve tracemalloc ile
+bellek tepe değeri raporlanır. Sonuçlar referans (baseline) olarak kaydedilebilir ve
+sonraki çalıştırmalar eşik değerini aşan gerilemeler için karşılaştırılır.
+
+Kullanım:
+    python benchmark.py                                  # tüm fonksiyonlar, tüm çözünürlükler
+    python benchmark.py --resolutions 720p,1080p --repeat 10
+    python benchmark.py --save-baseline                  # referansı kaydet
+    python benchmark.py --compare --threshold 0.15       # referansa göre gerileme kontrolü
+    python benchmark.py --check                          # referans uygulamalara göre doğruluk kontrolü
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+import color_qc as qc
+
+RESOLUTIONS = {
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "4k": (3840, 2160)
+}
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "baseline.json")
+PRODUCT_CODE = "AYG-STR-001"
+
+def make_frame(resolution, seed=42):
+    """Deterministik simülasyon karesi - aynı tohum her zaman aynı kareyi üretir"""
+    width, height = RESOLUTIONS[resolution]
+    np.random.seed(seed)
+    frame = qc.create_simulated_image(PRODUCT_CODE, qc.AYGUN_PRODUCTS[PRODUCT_CODE]["expected_color"])
+    if frame.shape[1] != width or frame.shape[0] != height:
+        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_LINEAR)
+    return frame
+
+def frame_cases(frame):
+    """Kare boyutuna bağlı fonksiyonlar: ad -> argümansız çağrılabilir.
+
+    Her çağrıya ham kare verilir; FrameContext önbelleği çağrılar arasında paylaşılmaz,
+    böylece ölçülen süre soğuk (ilk kez hesaplanan) maliyettir.
+    """
+    color_code = qc.AYGUN_PRODUCTS[PRODUCT_CODE]["expected_color"]
+    defects = qc.detect_surface_defects(frame)
+    return {
+        "calculate_gloss": lambda: qc.calculate_gloss(frame),
+        "analyze_color_region": lambda: qc.analyze_color_region(frame, color_code),
+        "analyze_surface_quality": lambda: qc.analyze_surface_quality(frame),
+        "analyze_color_consistency": lambda: qc.analyze_color_consistency(frame, color_code),
+        "detect_surface_defects": lambda: qc.detect_surface_defects(frame),
+        "calculate_advanced_parameters": lambda: qc.calculate_advanced_parameters(frame, defects, 1.5),
+        "generate_color_heatmap": lambda: qc.generate_color_heatmap(frame, color_code),
+        "generate_gloss_map": lambda: qc.generate_gloss_map(frame),
+        "generate_defect_heatmap": lambda: qc.generate_defect_heatmap(frame, defects),
+        "draw_defects_on_image": lambda: qc.draw_defects_on_image(frame, defects, "GECTI", "Benchmark"),
+        "encode_jpeg": lambda: qc.encode_jpeg(frame),
+        "run_analysis": lambda: qc.run_analysis(frame, PRODUCT_CODE, include_images=False)
+    }
+
+def scalar_cases():
+    """Kare boyutundan bağımsız (tek piksel / tek renk) fonksiyonlar"""
+    lab1 = qc.AYGUN_COLOR_STANDARDS["MAVI"]["lab_reference"]
+    lab2 = {"L": lab1["L"] + 1.2, "a": lab1["a"] - 0.8, "b": lab1["b"] + 2.1}
+    return {
+        "rgb_to_lab": lambda: qc.rgb_to_lab([30, 80, 160]),
+        "calculate_delta_e_2000": lambda: qc.calculate_delta_e_2000(lab1, lab2)
+    }
+
+def reference_gloss_field(gray, window, stride):
+    """compute_gloss_field'in döngü karşılığı (özgün generate_gloss_map algoritması)"""
+    h, w = gray.shape
+    dense = np.zeros((h, w), dtype=np.float32)
+    for y in range(0, h - window, stride):
+        for x in range(0, w - window, stride):
+            block = gray[y:y + window, x:x + window]
+            high_vals = np.sum(block > 200) / (window * window)
+            dense[y:y + window, x:x + window] = min(100, (high_vals * 100 + np.std(block) / 2.55) / 2)
+    return dense
+
+def correctness_checks():
+    """Hızlandırılmış fonksiyonların referans uygulamalara göre en büyük hatası: ad -> (hata, sınır)"""
+    frame = cv2.resize(make_frame("720p"), (320, 240), interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    checks = {}
+    # stride > window: pencereler arası boşluklar 0 kalmalı
+    for window, stride in ((32, 16), (16, 16), (20, 7), (16, 32), (8, 20)):
+        fast = qc.compute_gloss_field(gray, window, stride)["map"]
+        error = float(np.abs(fast - reference_gloss_field(gray, window, stride)).max())
+        checks[f"compute_gloss_field(window={window}, stride={stride})"] = (error, 0.01)
+    
+    # ΔE tablosu: rastgele renkler + referans çevresi, kesin motora göre 0-10 ΔE (ısı haritası) aralığında
+    rng = np.random.RandomState(0)
+    lut = qc.DeltaELookupCache()
+    for code, standard in qc.AYGUN_COLOR_STANDARDS.items():
+        ref_lab = standard["lab_reference"]
+        ref_bgr = np.array(qc.lab_to_rgb_array(np.array([[ref_lab["L"], ref_lab["a"], ref_lab["b"]]]))[0][::-1])
+        near = np.clip(ref_bgr + rng.randint(-24, 25, (200000, 3)), 0, 255)
+        bgr = np.concatenate([rng.randint(0, 256, (200000, 3)), near]).astype(np.uint8)
+        exact = qc.delta_e_2000_array(qc.rgb_to_lab_array(bgr[:, ::-1].astype(np.float32)), ref_lab)
+        approx = lut.delta_e_map(bgr[None], code)[0]
+        shown = exact <= 10
+        checks[f"DeltaELookupCache({code}, {lut.bits} bit)"] = (float(np.abs(approx - exact)[shown].max()), 1.0)
+    return checks
+
+def run_checks():
+    """Doğruluk kontrollerini yazdır; sınırı aşan varsa False"""
+    ok = True
+    for name, (error, limit) in correctness_checks().items():
+        passed = error <= limit
+        ok = ok and passed
+        print(f"{name:<56} maks. hata {error:>10.4f}  sınır {limit:<8} {'OK' if passed else 'HATA'}")
+    return ok
+
+def measure(fn, repeat, warmup):
+    """Çağrı başına gecikme yüzdelikleri (ms) ve tek çağrının bellek tepe değeri (KiB)"""
+    for _ in range(warmup):
+        fn()
+
+    timings = np.empty(repeat, dtype=np.float64)
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings[i] = (time.perf_counter() - start) * 1000
+
+    # tracemalloc süreyi bozduğu için bellek ayrı bir çağrıda ölçülür
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "calls": repeat,
+        "min_ms": round(float(timings.min()), 4),
+        "mean_ms": round(float(timings.mean()), 4),
+        "p50_ms": round(float(np.percentile(timings, 50)), 4),
+        "p90_ms": round(float(np.percentile(timings, 90)), 4),
+        "p99_ms": round(float(np.percentile(timings, 99)), 4),
+        "peak_kib": round(peak / 1024, 1)
+    }
+
+def run_suite(resolutions, repeat, warmup, only=None):
+    """Tüm kıyaslamaları çalıştır: "fonksiyon@çözünürlük" -> ölçüm"""
+    # Tek işçi: aşamalar sıralı çalışır, ölçümler iş parçacığı zamanlamasından etkilenmez
+    qc.analysis_executor = qc.AnalysisExecutor(1, 0, 1)
+    results = {}
+
+    def run(name, key, fn, calls):
+        if only and name not in only:
+            return
+        results[key] = measure(fn, calls, warmup)
+        print(format_row(key, results[key]), flush=True)
+
+    for name, fn in scalar_cases().items():
+        # Skaler fonksiyonlar mikrosaniye mertebesinde; daha fazla çağrı ile ölçülür
+        run(name, f"{name}@scalar", fn, repeat * 100)
+
+    for resolution in resolutions:
+        frame = make_frame(resolution)
+        for name, fn in frame_cases(frame).items():
+            run(name, f"{name}@{resolution}", fn, repeat)
+    return results
+
+def format_row(key, result):
+    return (f"{key:<42} p50 {result['p50_ms']:>10.3f} ms  p90 {result['p90_ms']:>10.3f} ms  "
+            f"p99 {result['p99_ms']:>10.3f} ms  peak {result['peak_kib']:>10.1f} KiB")
+
+def environment_info():
+    return {
+        "created": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+def save_baseline(path, results, args):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"environment": environment_info(), "repeat": args.repeat, "results": results},
+                  f, ensure_ascii=False, indent=2)
+
+def compare(results, baseline, threshold, min_delta_ms=0.05):
+    """Referansa göre gerilemeler: p50 gecikme veya bellek tepe değeri eşik oranından fazla artmışsa"""
+    regressions = []
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        # Çok kısa sürelerde ölçüm gürültüsü oranı büyütür; mutlak fark da aranır
+        if (current["p50_ms"] > previous["p50_ms"] * (1 + threshold)
+                and current["p50_ms"] - previous["p50_ms"] > min_delta_ms):
+            regressions.append((key, "p50_ms", previous["p50_ms"], current["p50_ms"]))
+        if previous["peak_kib"] > 0 and current["peak_kib"] > previous["peak_kib"] * (1 + threshold):
+            regressions.append((key, "peak_kib", previous["peak_kib"], current["peak_kib"]))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ColorQC analiz fonksiyonları mikro kıyaslaması")
+    parser.add_argument("--resolutions", default="720p,1080p,4k",
+                        help="Virgülle ayrılmış çözünürlükler: " + ", ".join(RESOLUTIONS))
+    parser.add_argument("--repeat", type=int, default=20, help="Fonksiyon başına ölçülen çağrı sayısı")
+    parser.add_argument("--warmup", type=int, default=2, help="Ölçüm öncesi ısınma çağrısı sayısı")
+    parser.add_argument("--only", default=None, help="Yalnızca bu fonksiyonlar (virgülle ayrılmış)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Referans dosyası yolu")
+    parser.add_argument("--save-baseline", action="store_true", help="Sonuçları referans olarak kaydet")
+    parser.add_argument("--compare", action="store_true", help="Referansa göre gerileme kontrolü yap")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Gerileme eşiği (0.15 = %%15)")
+    parser.add_argument("--output", default=None, help="Sonuçları JSON olarak bu dosyaya yaz")
+    parser.add_argument("--check", action="store_true",
+                        help="Yalnızca referans uygulamalara göre doğruluk kontrolü yap (hata varsa çıkış kodu 1)")
+    args = parser.parse_args(argv)
+    
+    if args.check:
+        return 0 if run_checks() else 1
+
+    resolutions = [r.strip().lower() for r in args.resolutions.split(",") if r.strip()]
+    unknown = [r for r in resolutions if r not in RESOLUTIONS]
+    if unknown:
+        parser.error(f"Bilinmeyen çözünürlük: {', '.join(unknown)}")
+    only = {name.strip() for name in args.only.split(",")} if args.only else None
+
+    results = run_suite(resolutions, max(1, args.repeat), max(0, args.warmup), only)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"environment": environment_info(), "results": results}, f, ensure_ascii=False, indent=2)
+
+    status = 0
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"Referans bulunamadı: {args.baseline}", file=sys.stderr)
+            return 2
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["results"], args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} gerileme (eşik %{args.threshold * 100:.0f}):")
+            for key, metric, before, after in regressions:
+                print(f"  {key:<42} {metric:<8} {before:>10} -> {after:>10} ({(after / before - 1) * 100:+.1f}%)")
+            status = 1
+        else:
+            print(f"\nGerileme yok (eşik %{args.threshold * 100:.0f}, referans: {baseline['environment']['created']})")
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results, args)
+        print(f"Referans kaydedildi: {args.baseline}")
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,19 +6,38 @@ Problem 2: Yüzey Parlaklığı ve Eloksal Renk Uyumsuzluğu
 Takım: OpusAI5
 """
 
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, Response
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Deque
 from datetime import datetime, timedelta
 import numpy as np
 import cv2
 import threading
+import itertools
+from collections import OrderedDict, deque, namedtuple
 import time
-import base64
+import asyncio
+import json
+import multiprocessing
+import os
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import hashlib
+import uuid
+import atexit
+import queue
+import sqlite3
+import tarfile
+import zipfile
 import colorsys
+import functools
 import math
+import bisect
+import zlib
+import struct
 
 app = FastAPI(
     title="ColorQC API - Aygün Cerrahi Aletler",
@@ -35,12 +54,8 @@ app.add_middleware(
 )
 
 # Global değişkenler
-camera = None
-camera_lock = threading.Lock()
-measurement_history: List[dict] = []
-is_analyzing = False
-uploaded_frame = None  # Yüklenen görsel için
-uploaded_color_code = "MAVI"  # Yüklenen görselin renk kodu
+measurement_history: Deque[dict] = deque(maxlen=100)  # En yeni önce
+uploaded_image_versions = itertools.count(1)  # CameraStation.upload sürümleri
 
 # Aygün Cerrahi Aletler - Eloksal Renk Standartları
 AYGUN_COLOR_STANDARDS = {
@@ -101,6 +116,7 @@ AYGUN_COLOR_STANDARDS = {
 }
 
 # Aygün Ürün Kataloğu
+# İsteğe bağlı "roi": {"x", "y", "w", "h"} (0-1 oranları) - analiz aşamaları yalnızca bu bölgeyi işler
 AYGUN_PRODUCTS = {
     "AYG-STR-001": {
         "name": "Sterilizasyon Konteyneri Kapağı",
@@ -172,69 +188,377 @@ class ColorAnalysisResult(BaseModel):
     processing_time_ms: float
     recommendation: str
 
+# ==================== RENK FARKI MOTORU ====================
+# Tüm kare / Lab dizileri üzerinde vektörel çalışan renk dönüşümü ve ΔE hesapları.
+# Skaler rgb_to_lab ve calculate_delta_e_2000 fonksiyonları bu motorun ince sarmalayıcılarıdır.
+
+# sRGB (D65) -> XYZ dönüşüm matrisi (satırlar X, Y, Z; sütunlar R, G, B)
+_RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041]
+], dtype=np.float32)
+
+# D65 referans beyazı
+_D65_WHITE = np.array([95.047, 100.0, 108.883], dtype=np.float32)
+
+# 8-bit kanal değerleri için doğrusallaştırılmış sRGB tablosu (0-100 ölçeğinde)
+_SRGB_LINEAR_LUT = np.array([
+    ((v / 255.0 + 0.055) / 1.055) ** 2.4 if v / 255.0 > 0.04045 else (v / 255.0) / 12.92
+    for v in range(256)
+], dtype=np.float32) * 100
+
+def _srgb_to_linear(rgb):
+    """sRGB kanal değerlerini (0-255) doğrusal ışık değerine (0-100) çevir"""
+    if rgb.dtype == np.uint8:
+        return _SRGB_LINEAR_LUT[rgb]
+    c = rgb.astype(np.float32) / 255.0
+    return np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92).astype(np.float32) * 100
+
+def _xyz_to_lab(xyz):
+    """XYZ dizisini (..., 3) CIE L*a*b* dizisine çevir"""
+    t = xyz / _D65_WHITE
+    f = np.where(t > 0.008856, np.cbrt(t), 7.787 * t + (16 / 116)).astype(np.float32)
+    lab = np.empty_like(f)
+    lab[..., 0] = 116 * f[..., 1] - 16
+    lab[..., 1] = 500 * (f[..., 0] - f[..., 1])
+    lab[..., 2] = 200 * (f[..., 1] - f[..., 2])
+    return lab
+
+def rgb_to_lab_array(rgb):
+    """RGB dizisini (..., 3) float32 CIE L*a*b* dizisine çevir"""
+    rgb = np.asarray(rgb)
+    return _xyz_to_lab(_srgb_to_linear(rgb) @ _RGB_TO_XYZ.T)
+
+def bgr_to_lab_array(image):
+    """OpenCV BGR karesini (H, W, 3) float32 CIE L*a*b* dizisine çevir"""
+    image = np.asarray(image)
+    # Kanalları kopyalamak yerine matris sütunlarını BGR sırasına çevir
+    return _xyz_to_lab(_srgb_to_linear(image) @ _RGB_TO_XYZ[:, ::-1].T)
+
+# XYZ -> sRGB (ters dönüşüm, sentetik kare üretimi için)
+_XYZ_TO_RGB = np.linalg.inv(_RGB_TO_XYZ.astype(np.float64)).astype(np.float32)
+
+def lab_to_rgb_array(lab):
+    """CIE L*a*b* dizisini (..., 3) sRGB (0-255, float32) dizisine çevir - rgb_to_lab_array'in tersi"""
+    lab = np.asarray(lab, dtype=np.float32)
+    fy = (lab[..., 0] + 16) / 116
+    f = np.stack([fy + lab[..., 1] / 500, fy, fy - lab[..., 2] / 200], axis=-1)
+    t = np.where(f > 0.206893, f ** 3, (f - 16 / 116) / 7.787)
+    linear = np.clip((t * _D65_WHITE) @ _XYZ_TO_RGB.T / 100, 0, 1)
+    srgb = np.where(linear > 0.0031308, 1.055 * linear ** (1 / 2.4) - 0.055, 12.92 * linear)
+    return (srgb * 255).astype(np.float32)
+
+def lab_to_array(lab):
+    """{"L", "a", "b"} sözlüğünü veya Lab dizisini float32 diziye çevir"""
+    if isinstance(lab, dict):
+        return np.array([lab["L"], lab["a"], lab["b"]], dtype=np.float32)
+    return np.asarray(lab, dtype=np.float32)
+
+def delta_e_76_array(lab1, lab2):
+    """CIE76 ΔE - Lab uzayında Öklid mesafesi (float32 dizi)"""
+    lab1, lab2 = lab_to_array(lab1), lab_to_array(lab2)
+    return np.sqrt(np.sum((lab2 - lab1) ** 2, axis=-1)).astype(np.float32)
+
+def delta_e_94_array(lab1, lab2):
+    """CIE94 ΔE (grafik sanatlar ağırlıkları) - lab1 referans renk kabul edilir"""
+    lab1, lab2 = lab_to_array(lab1), lab_to_array(lab2)
+    L1, a1, b1 = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+    L2, a2, b2 = lab2[..., 0], lab2[..., 1], lab2[..., 2]
+
+    C1 = np.sqrt(a1 ** 2 + b1 ** 2)
+    C2 = np.sqrt(a2 ** 2 + b2 ** 2)
+    dL = L1 - L2
+    dC = C1 - C2
+    dH_sq = np.maximum(0, (a1 - a2) ** 2 + (b1 - b2) ** 2 - dC ** 2)
+
+    SC = 1 + 0.045 * C1
+    SH = 1 + 0.015 * C1
+
+    return np.sqrt(dL ** 2 + (dC / SC) ** 2 + dH_sq / SH ** 2).astype(np.float32)
+
+def delta_e_2000_array(lab1, lab2):
+    """Tam CIEDE2000 ΔE (G terimi, ton dönüşü ve RT dahil) - float32 dizi"""
+    lab1, lab2 = lab_to_array(lab1), lab_to_array(lab2)
+    L1, a1, b1 = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+    L2, a2, b2 = lab2[..., 0], lab2[..., 1], lab2[..., 2]
+
+    # a* ekseni düzeltmesi (G terimi)
+    C_bar = (np.sqrt(a1 ** 2 + b1 ** 2) + np.sqrt(a2 ** 2 + b2 ** 2)) / 2
+    C_bar7 = C_bar ** 7
+    G = 0.5 * (1 - np.sqrt(C_bar7 / (C_bar7 + np.float32(25.0 ** 7))))
+    a1p = (1 + G) * a1
+    a2p = (1 + G) * a2
+
+    C1p = np.sqrt(a1p ** 2 + b1 ** 2)
+    C2p = np.sqrt(a2p ** 2 + b2 ** 2)
+    h1p = np.degrees(np.arctan2(b1, a1p)) % 360
+    h2p = np.degrees(np.arctan2(b2, a2p)) % 360
+    chroma_zero = (C1p * C2p) == 0
+
+    # Farklar
+    dLp = L2 - L1
+    dCp = C2p - C1p
+    dhp = h2p - h1p
+    dhp = np.where(dhp > 180, dhp - 360, np.where(dhp < -180, dhp + 360, dhp))
+    dhp = np.where(chroma_zero, 0, dhp)
+    dHp = 2 * np.sqrt(C1p * C2p) * np.sin(np.radians(dhp) / 2)
+
+    # Ortalamalar
+    Lp_bar = (L1 + L2) / 2
+    Cp_bar = (C1p + C2p) / 2
+    hp_sum = h1p + h2p
+    hp_bar = np.where(
+        np.abs(h1p - h2p) <= 180, hp_sum / 2,
+        np.where(hp_sum < 360, (hp_sum + 360) / 2, (hp_sum - 360) / 2)
+    )
+    hp_bar = np.where(chroma_zero, hp_sum, hp_bar)
+
+    # Ağırlık fonksiyonları
+    T = (1 - 0.17 * np.cos(np.radians(hp_bar - 30))
+         + 0.24 * np.cos(np.radians(2 * hp_bar))
+         + 0.32 * np.cos(np.radians(3 * hp_bar + 6))
+         - 0.20 * np.cos(np.radians(4 * hp_bar - 63)))
+    d_theta = 30 * np.exp(-((hp_bar - 275) / 25) ** 2)
+    Cp_bar7 = Cp_bar ** 7
+    RC = 2 * np.sqrt(Cp_bar7 / (Cp_bar7 + np.float32(25.0 ** 7)))
+    SL = 1 + (0.015 * (Lp_bar - 50) ** 2) / np.sqrt(20 + (Lp_bar - 50) ** 2)
+    SC = 1 + 0.045 * Cp_bar
+    SH = 1 + 0.015 * Cp_bar * T
+    RT = -np.sin(np.radians(2 * d_theta)) * RC
+
+    dL_term = dLp / SL
+    dC_term = dCp / SC
+    dH_term = dHp / SH
+
+    delta_e = np.sqrt(np.maximum(0, dL_term ** 2 + dC_term ** 2 + dH_term ** 2 + RT * dC_term * dH_term))
+    return delta_e.astype(np.float32)
+
+# Desteklenen ΔE yöntemleri
+DELTA_E_METHODS = {
+    "76": delta_e_76_array,
+    "94": delta_e_94_array,
+    "2000": delta_e_2000_array
+}
+
+def calculate_delta_e_array(lab1, lab2, method="2000"):
+    """İki Lab dizisi (veya sözlüğü) arasında seçilen yöntemle ΔE hesapla"""
+    if method not in DELTA_E_METHODS:
+        raise ValueError(f"Bilinmeyen Delta E yöntemi: {method}")
+    return DELTA_E_METHODS[method](lab1, lab2)
+
+def frame_delta_e(image, ref_lab, method="2000"):
+    """BGR karesinin her pikseli için referans renge göre ΔE haritası (H, W) döndür"""
+    if method == "2000":
+        # CIEDE2000 simetriktir; tanımdaki sıralama (ölçülen, referans) korunur
+        return delta_e_2000_array(bgr_to_lab_array(image), ref_lab)
+    # CIE94'te referans renk ilk argümandır
+    return calculate_delta_e_array(lab_to_array(ref_lab), bgr_to_lab_array(image), method)
+
 def rgb_to_lab(rgb):
     """RGB'den CIE L*a*b* renk uzayına dönüşüm"""
-    r, g, b = [x / 255.0 for x in rgb]
-    
-    # RGB -> XYZ
-    r = ((r + 0.055) / 1.055) ** 2.4 if r > 0.04045 else r / 12.92
-    g = ((g + 0.055) / 1.055) ** 2.4 if g > 0.04045 else g / 12.92
-    b = ((b + 0.055) / 1.055) ** 2.4 if b > 0.04045 else b / 12.92
-    
-    r, g, b = r * 100, g * 100, b * 100
-    
-    x = r * 0.4124564 + g * 0.3575761 + b * 0.1804375
-    y = r * 0.2126729 + g * 0.7151522 + b * 0.0721750
-    z = r * 0.0193339 + g * 0.1191920 + b * 0.9503041
-    
-    # XYZ -> Lab (D65 referans beyaz)
-    x, y, z = x / 95.047, y / 100.0, z / 108.883
-    
-    x = x ** (1/3) if x > 0.008856 else (7.787 * x) + (16/116)
-    y = y ** (1/3) if y > 0.008856 else (7.787 * y) + (16/116)
-    z = z ** (1/3) if z > 0.008856 else (7.787 * z) + (16/116)
-    
-    L = (116 * y) - 16
-    a = 500 * (x - y)
-    b_val = 200 * (y - z)
-    
+    L, a, b_val = (float(v) for v in rgb_to_lab_array(np.asarray(rgb, dtype=np.float32)))
     return {"L": round(L, 2), "a": round(a, 2), "b": round(b_val, 2)}
 
 def calculate_delta_e_2000(lab1, lab2):
     """CIEDE2000 Delta E hesaplama - Endüstri standardı renk farkı ölçümü"""
-    L1, a1, b1 = lab1["L"], lab1["a"], lab1["b"]
-    L2, a2, b2 = lab2["L"], lab2["a"], lab2["b"]
-    
-    # Basitleştirilmiş CIEDE2000 formülü
-    dL = L2 - L1
-    da = a2 - a1
-    db = b2 - b1
-    
-    C1 = math.sqrt(a1**2 + b1**2)
-    C2 = math.sqrt(a2**2 + b2**2)
-    dC = C2 - C1
-    
-    dH_sq = da**2 + db**2 - dC**2
-    dH = math.sqrt(max(0, dH_sq))
-    
-    # Ağırlık faktörleri
-    SL = 1
-    SC = 1 + 0.045 * (C1 + C2) / 2
-    SH = 1 + 0.015 * (C1 + C2) / 2
+    return round(float(delta_e_2000_array(lab1, lab2)), 2)
+
+# ==================== BLOK İSTATİSTİK MOTORU ====================
+# Bölge/grid analizleri için tek geçişte blok başına ortalama, std ve ΔE hesabı.
+
+def block_grid_shape(height, width, block_size):
+    """Grid boyutu (satır, sütun) - son yarım blok dahil edilmez"""
+    rows = len(range(0, height - block_size, block_size))
+    cols = len(range(0, width - block_size, block_size))
+    return rows, cols
+
+def compute_block_stats(image, block_size, ref_lab=None):
+    """Görüntüyü kare bloklara bölüp blok başına ortalama, std ve (isteğe bağlı) ΔE hesapla"""
+    h, w = image.shape[:2]
+    rows, cols = block_grid_shape(h, w, block_size)
+    stats = {"block_size": block_size, "rows": rows, "cols": cols}
     
-    delta_e = math.sqrt((dL/SL)**2 + (dC/SC)**2 + (dH/SH)**2)
+    if rows == 0 or cols == 0:
+        empty = np.zeros((rows, cols) + image.shape[2:])
+        stats.update({"mean": empty, "std": empty.copy()})
+    else:
+        # İntegral görüntüler ile her blok toplamı 4 okuma ile bulunur
+        crop = np.ascontiguousarray(image[:rows * block_size, :cols * block_size])
+        sums, sq_sums = cv2.integral2(crop, sdepth=cv2.CV_64F)
+        ys = np.arange(rows + 1) * block_size
+        xs = np.arange(cols + 1) * block_size
+        n = block_size * block_size
+        
+        def block_sum(integral):
+            corners = integral[np.ix_(ys, xs)]
+            return corners[1:, 1:] - corners[:-1, 1:] - corners[1:, :-1] + corners[:-1, :-1]
+        
+        mean = block_sum(sums) / n
+        var = np.maximum(0, block_sum(sq_sums) / n - mean ** 2)
+        stats.update({"mean": mean, "std": np.sqrt(var)})
     
-    return round(delta_e, 2)
+    stats["delta_e"] = block_delta_e(stats, ref_lab) if ref_lab is not None else None
+    return stats
+
+def block_delta_e(stats, ref_lab):
+    """BGR blok ortalamalarının referans renge göre ΔE2000 grid'i (satır, sütun)"""
+    return delta_e_2000_array(bgr_to_lab_array(stats["mean"]), ref_lab)
+
+# ==================== KARE BAĞLAMI ====================
+# Bir analiz isteğinde aynı kareden türetilen düzlemler (gri, bulanık, Sobel, Laplacian, Lab,
+# histogram, maskeler, blok istatistikleri) yalnızca bir kez ve ihtiyaç olduğunda hesaplanır.
+
+class FrameContext:
+    """Tek bir kare için türetilmiş düzlemleri tembel hesaplayıp saklayan analiz bağlamı"""
+
+    def __init__(self, image):
+        self.image = image
+        self._cache = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def of(cls, image):
+        """Görüntüyü bağlama çevir (zaten bağlamsa aynısını döndür)"""
+        return image if isinstance(image, cls) else cls(image)
+
+    def memo(self, key, compute):
+        """Anahtar için değeri bir kez hesapla; eşzamanlı aşamalar aynı sonucu paylaşır"""
+        if key in self._cache:
+            return self._cache[key]
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._cache:
+                self._cache[key] = compute()
+        return self._cache[key]
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    @property
+    def gray(self):
+        return self.memo("gray", lambda: cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+                         if self.image.ndim == 3 else self.image)
+
+    @property
+    def blurred(self):
+        """Gürültü azaltılmış gri düzlem (5x5 Gaussian)"""
+        return self.memo("blurred", lambda: cv2.GaussianBlur(self.gray, (5, 5), 0))
+
+    @property
+    def sobel_x(self):
+        return self.memo("sobel_x", lambda: cv2.Sobel(self.gray, cv2.CV_64F, 1, 0, ksize=3))
+
+    @property
+    def sobel_y(self):
+        return self.memo("sobel_y", lambda: cv2.Sobel(self.gray, cv2.CV_64F, 0, 1, ksize=3))
+
+    @property
+    def gradient_magnitude(self):
+        return self.memo("gradient_magnitude", lambda: cv2.magnitude(self.sobel_x, self.sobel_y))
+
+    @property
+    def laplacian(self):
+        return self.memo("laplacian", lambda: cv2.Laplacian(self.gray, cv2.CV_64F))
+
+    @property
+    def lab(self):
+        """Tam kare float32 CIE L*a*b* düzlemi"""
+        return self.memo("lab", lambda: bgr_to_lab_array(self.image))
+
+    @property
+    def hist(self):
+        """Gri düzlem 256 kutulu histogram"""
+        return self.memo("hist", lambda: cv2.calcHist([self.gray], [0], None, [256], [0, 256]))
+
+    @property
+    def highlight_mask(self):
+        """Parlak (yansıma) piksel maskesi: gri > 200"""
+        return self.memo("highlight_mask", lambda: self.gray > 200)
+
+    def block_stats(self, block_size, plane="bgr"):
+        """Blok istatistikleri (bkz. compute_block_stats) - "bgr" veya "gray" düzlemi için"""
+        source = self.gray if plane == "gray" else self.image
+        return self.memo(("block_stats", block_size, plane), lambda: compute_block_stats(source, block_size))
+
+    def gloss_grid(self, window=32, stride=16):
+        """Pencere başına yerel parlaklık grid'i (bkz. compute_gloss_grid)"""
+        return self.memo(("gloss_grid", window, stride), lambda: compute_gloss_grid(self.gray, window, stride))
+
+    def gloss_field(self, window=32, stride=16):
+        """Yerel parlaklık alanı - grid + tam çözünürlük harita (bkz. compute_gloss_field)"""
+        return self.memo(("gloss_field", window, stride),
+                         lambda: compute_gloss_field(self.gray, window, stride, self.gloss_grid(window, stride)))
+
+    def pyramid_level(self, level):
+        """Piramit seviyesi bağlamı (her seviye yarı boyut) - seviyeler bir kez üretilir"""
+        if level <= 0:
+            return self
+        return self.memo(("pyramid", level),
+                         lambda: FrameContext(cv2.pyrDown(self.pyramid_level(level - 1).image)))
+
+    def crop(self, rect):
+        """(x, y, w, h) bölgesinin bağlamı - kopyasız görünüm"""
+        x, y, w, h = rect
+        return self.memo(("crop", rect), lambda: FrameContext(self.image[y:y + h, x:x + w]))
+
+    def retain(self, *kinds):
+        """Yalnızca verilen türdeki ara sonuçları (ör. "gloss_grid": tüm pencere/adım çiftleri) taşıyan
+        hafif kopya - büyük düzlemler bırakılır"""
+        ctx = FrameContext(self.image)
+        ctx._cache = {key: value for key, value in self._cache.items()
+                      if (key[0] if isinstance(key, tuple) else key) in kinds}
+        return ctx
+
+# ==================== GÖRÜNTÜ PİRAMİDİ VE ROI ====================
+# "pyramid" modunda her aşama yapılandırılmış piramit seviyesinde çalışır (0 = tam çözünürlük,
+# her seviye kenar başına yarı boyut). ROI verilirse tüm analiz aşamaları yalnızca bu bölgeyi
+# işler; kusur ve bölge koordinatları tam kare piksellerine geri eşlenir.
+# ROI kare boyutundan bağımsız olarak oransal verilir: {"x", "y", "w", "h"} (0-1).
+
+ANALYSIS_MODES = {
+    "full": {"color": 0, "consistency": 0, "gloss": 0, "surface": 0, "advanced": 0, "defects": 0},
+    "pyramid": {"color": 2, "consistency": 1, "gloss": 1, "surface": 0, "advanced": 0, "defects": 0}
+}
+ANALYSIS_MODE = os.environ.get("COLORQC_ANALYSIS_MODE", "full")
+
+def parse_roi(value):
+    """roi= parametresi: "x,y,w,h" oranları (0-1) -> dict; boşsa None"""
+    if value is None or not value.strip():
+        return None
+    try:
+        x, y, w, h = (float(v) for v in value.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ROI biçimi: x,y,w,h (0-1 arası oranlar)")
+    if not (0 <= x < 1 and 0 <= y < 1 and 0 < w <= 1 - x + 1e-9 and 0 < h <= 1 - y + 1e-9):
+        raise HTTPException(status_code=400, detail="ROI kare sınırları dışında")
+    return {"x": x, "y": y, "w": w, "h": h}
+
+def roi_rect(roi, shape):
+    """Oransal ROI'yi kare içinde kırpılmış piksel dikdörtgenine çevir: (x, y, w, h)"""
+    height, width = shape[:2]
+    x = min(width - 1, int(round(roi["x"] * width)))
+    y = min(height - 1, int(round(roi["y"] * height)))
+    w = max(1, min(width - x, int(round(roi["w"] * width))))
+    h = max(1, min(height - y, int(round(roi["h"] * height))))
+    return x, y, w, h
 
 def calculate_gloss(image):
     """Görüntüden parlaklık değeri hesaplama (0-100 GU)"""
     if image is None:
         return 50.0
     
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if len(image.shape) == 3 else image
+    ctx = FrameContext.of(image)
+    return ctx.memo("gloss", lambda: _calculate_gloss(ctx))
+
+def _calculate_gloss(ctx):
+    gray = ctx.gray
     
     # Histogram analizi ile parlaklık tahmini
-    hist = cv2.calcHist([gray], [0], None, [256], [0, 256])
+    hist = ctx.hist
     
     # Yüksek değerlerdeki piksel yoğunluğu = parlaklık
     high_values = np.sum(hist[200:256])
@@ -261,10 +585,10 @@ def analyze_surface_quality(image):
             "quality_grade": "A"
         }
     
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if len(image.shape) == 3 else image
+    ctx = FrameContext.of(image)
     
     # 1. Parlaklık Sınıflandırması (Gloss Classification)
-    gloss = calculate_gloss(image)
+    gloss = calculate_gloss(ctx)
     if gloss >= 80:
         gloss_class = "YÜKSEK PARLAKLIK"
     elif gloss >= 60:
@@ -275,14 +599,8 @@ def analyze_surface_quality(image):
         gloss_class = "MAT"
     
     # 2. Yüzey Pürüzlülüğü (Ra - Ortalama Pürüzlülük)
-    # Laplacian varyansı ile yüzey dokusu analizi
-    laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-    roughness_variance = np.var(laplacian)
-    
     # Sobel gradyanları ile yüzey analizi
-    sobelx = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-    sobely = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-    gradient_magnitude = np.sqrt(sobelx**2 + sobely**2)
+    gradient_magnitude = ctx.gradient_magnitude
     
     # Ra değeri tahmini (mikrometre)
     roughness_ra = np.std(gradient_magnitude) / 100
@@ -302,16 +620,9 @@ def analyze_surface_quality(image):
     
     # 3. Yüzey Homojenliği (Uniformity Score)
     # Görüntüyü bloklara böl ve her bloğun standart sapmasını hesapla
-    h, w = gray.shape
-    block_size = 32
-    block_stds = []
-    
-    for i in range(0, h - block_size, block_size):
-        for j in range(0, w - block_size, block_size):
-            block = gray[i:i+block_size, j:j+block_size]
-            block_stds.append(np.std(block))
+    block_stds = ctx.block_stats(32, plane="gray")["std"]
     
-    if block_stds:
+    if block_stds.size:
         uniformity_score = 100 - min(100, np.std(block_stds) * 2)
     else:
         uniformity_score = 80
@@ -348,8 +659,12 @@ def analyze_surface_quality(image):
         "quality_grade": quality_grade
     }
 
-def analyze_color_consistency(image, color_code):
-    """Problem 2: Eloksal renk uyumsuzluğu analizi"""
+def analyze_color_consistency(image, color_code, scale=1, origin=(0, 0)):
+    """Problem 2: Eloksal renk uyumsuzluğu analizi
+
+    scale/origin: görüntü bir piramit seviyesi veya ROI ise bölge boyutu ve koordinatları
+    tam kare piksellerine göre ayarlanır.
+    """
     if image is None or color_code not in AYGUN_COLOR_STANDARDS:
         return {
             "color_consistency": 85,
@@ -362,34 +677,25 @@ def analyze_color_consistency(image, color_code):
     ref_lab = reference["lab_reference"]
     
     # Görüntüyü bölgelere ayır ve her bölgedeki renk farkını hesapla
-    h, w = image.shape[:2]
     zone_size = 50
-    zones = []
-    inconsistent_count = 0
+    block_stats = FrameContext.of(image).block_stats(max(1, int(round(zone_size / scale))))
+    zone_delta_e = np.round(block_delta_e(block_stats, ref_lab).astype(np.float64), 2)
+    inconsistent_mask = zone_delta_e > 3.0
+    inconsistent_count = int(np.count_nonzero(inconsistent_mask))
     
-    for i in range(0, h - zone_size, zone_size):
-        for j in range(0, w - zone_size, zone_size):
-            region = image[i:i+zone_size, j:j+zone_size]
-            mean_color = np.mean(region, axis=(0, 1)).astype(int)
-            
-            # BGR to RGB
-            rgb = [int(mean_color[2]), int(mean_color[1]), int(mean_color[0])]
-            measured_lab = rgb_to_lab(rgb)
-            delta_e = calculate_delta_e_2000(measured_lab, ref_lab)
-            
-            zone_status = "OK" if delta_e <= 3.0 else "UYUMSUZ"
-            if zone_status == "UYUMSUZ":
-                inconsistent_count += 1
-            
-            zones.append({
-                "x": j, "y": i,
-                "delta_e": delta_e,
-                "status": zone_status
-            })
-    
-    total_zones = len(zones) if zones else 1
+    total_zones = zone_delta_e.size if zone_delta_e.size else 1
     consistency = round((1 - inconsistent_count / total_zones) * 100, 1)
     
+    # İlk 20 bölgenin detayı (geriye dönük uyumluluk)
+    zones = [
+        {
+            "x": int(origin[0] + j * zone_size), "y": int(origin[1] + i * zone_size),
+            "delta_e": float(zone_delta_e[i, j]),
+            "status": "UYUMSUZ" if inconsistent_mask[i, j] else "OK"
+        }
+        for i, j in zip(*np.unravel_index(np.arange(min(20, zone_delta_e.size)), zone_delta_e.shape))
+    ]
+    
     # Öneri oluştur
     if consistency >= 95:
         recommendation = "Mükemmel renk tutarlılığı. Ürün standartlara uygun."
@@ -404,7 +710,14 @@ def analyze_color_consistency(image, color_code):
         "color_consistency": consistency,
         "total_zones": total_zones,
         "inconsistent_zones": inconsistent_count,
-        "zones": zones[:20],  # İlk 20 bölge
+        "zones": zones,  # İlk 20 bölge
+        # Tüm bölgeler: satır-sütun sıralı ΔE grid'i
+        "zone_grid": {
+            "zone_size": zone_size,
+            "rows": int(zone_delta_e.shape[0]),
+            "cols": int(zone_delta_e.shape[1]),
+            "delta_e": zone_delta_e.tolist()
+        },
         "recommendation": recommendation
     }
 
@@ -420,33 +733,25 @@ def calculate_advanced_parameters(image, defects, delta_e):
             "criticality": "Class IIa"
         }
     
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if len(image.shape) == 3 else image
+    ctx = FrameContext.of(image)
+    gray = ctx.gray
     
     # 1. Renk Homojenliği (Color Uniformity) - ISO 7724-2
     # Yüzeyi grid'lere böl ve her grid'de Delta E hesapla
-    h, w = image.shape[:2]
     grid_size = 50
-    delta_e_values = []
-    
-    for i in range(0, h - grid_size, grid_size):
-        for j in range(0, w - grid_size, grid_size):
-            region = image[i:i+grid_size, j:j+grid_size]
-            mean_color = np.mean(region, axis=(0, 1))
-            std_color = np.std(region, axis=(0, 1))
-            delta_e_values.append(np.mean(std_color))
+    delta_e_values = ctx.block_stats(grid_size)["std"].mean(axis=-1)
     
-    color_uniformity = np.std(delta_e_values) if delta_e_values else 0.5
+    color_uniformity = np.std(delta_e_values) if delta_e_values.size else 0.5
     color_uniformity = round(min(2.0, color_uniformity), 2)  # σΔE değeri
     
     # 2. Yüzey Dokusu (Surface Texture Ra) - ISO 4287
     # Laplacian ile yüzey pürüzlülüğü tahmini
-    laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-    texture_roughness = np.std(laplacian) / 10  # µm cinsinden tahmin
+    texture_roughness = np.std(ctx.laplacian) / 10  # µm cinsinden tahmin
     texture_roughness = round(min(1.0, max(0.1, texture_roughness)), 2)
     
     # 3. Metamerizm İndeksi - ASTM D4086
     # RGB kanalları arası varyans (farklı ışık kaynaklarında renk değişimi)
-    b, g, r = cv2.split(image)
+    b, g, r = cv2.split(ctx.image)
     channel_std = [np.std(b), np.std(g), np.std(r)]
     metamerism = np.std(channel_std) / 50  # Normalize
     metamerism = round(min(1.0, metamerism), 2)
@@ -489,17 +794,19 @@ def calculate_advanced_parameters(image, defects, delta_e):
         "criticality_color": crit_color
     }
 
-def detect_surface_defects(image):
-    """Yüzey kusurlarını tespit et (simülasyon + gerçek görüntü analizi)"""
+def detect_surface_defects(image, scale=1, origin=(0, 0)):
+    """Yüzey kusurlarını tespit et (simülasyon + gerçek görüntü analizi)
+
+    scale/origin: görüntü bir piramit seviyesi veya ROI ise boyut eşikleri ölçeklenir,
+    konum ve alanlar tam kare piksellerine çevrilir.
+    """
     defects = []
     
     if image is None:
         return defects
     
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if len(image.shape) == 3 else image
-    
     # Gaussian blur ile gürültü azaltma
-    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    blurred = FrameContext.of(image).blurred
     
     # Adaptif eşikleme ile kusur tespiti
     thresh = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
@@ -510,9 +817,10 @@ def detect_surface_defects(image):
     
     # Küçük konturları kusur olarak işaretle
     for contour in contours:
-        area = cv2.contourArea(contour)
+        area = cv2.contourArea(contour) * scale * scale
         if 100 < area < 5000:  # Kusur boyut aralığı
-            x, y, w, h = cv2.boundingRect(contour)
+            x, y, w, h = (int(v * scale) for v in cv2.boundingRect(contour))
+            x, y = x + origin[0], y + origin[1]
             
             # Kusur tipini belirle (basit sınıflandırma)
             aspect_ratio = w / h if h > 0 else 1
@@ -535,34 +843,132 @@ def detect_surface_defects(image):
     
     return defects[:5]  # En fazla 5 kusur
 
+# ==================== ΔE LOOKUP TABLOLARI ====================
+# Her renk standardı için nicemlenmiş (quantized) RGB -> ΔE2000 tablosu.
+# Tablolar ilk kullanımda oluşturulur, belirli süre kullanılmayanlar bellekten atılır.
+# Tablolar yalnızca görselleştirme içindir; muayene kararı kesin ΔE2000 motoruyla verilir.
+# 7 bit nicemlemede 0-10 ΔE aralığındaki hata en fazla ~0,8 ΔE'dir (bkz. benchmark.py --check).
+
+class DeltaELookupCache:
+    """Renk standardı başına tembel oluşturulan, kullanılmadığında atılan RGB -> ΔE tabloları"""
+
+    def __init__(self, bits=7, ttl_seconds=300, max_entries=len(AYGUN_COLOR_STANDARDS)):
+        self.bits = bits  # Kanal başına nicemleme biti (7 bit = 128 seviye, ~2,1 M giriş, tablo başına ~14 MB)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._tables = {}  # color_code -> {"delta_e", "colored", "ref", "last_used"}
+        self._building = {}  # color_code -> Future - aynı tablo için eşzamanlı istekler tek oluşturmayı bekler
+        self._sweeper = None
+        self._lock = threading.Lock()
+
+    def _build(self, ref_lab):
+        """Tüm nicemlenmiş RGB değerleri için ΔE ve renklendirilmiş ısı haritası tablosu oluştur"""
+        levels = 1 << self.bits
+        step = 1 << (8 - self.bits)
+        # Her seviyenin kutu merkezi kullanılır
+        values = np.arange(levels, dtype=np.float32) * step + step / 2
+        b, g, r = np.meshgrid(values, values, values, indexing="ij")
+        rgb = np.stack([r.ravel(), g.ravel(), b.ravel()], axis=-1)
+        delta_e = delta_e_2000_array(rgb_to_lab_array(rgb), ref_lab)
+
+        # Isı haritası renkleri: 0-10 ΔE aralığı JET renk skalasına eşlenir
+        normalized = (np.clip(delta_e, 0, 10) / 10 * 255).astype(np.uint8)
+        colored = cv2.applyColorMap(normalized.reshape(-1, 1), cv2.COLORMAP_JET).reshape(-1, 3)
+        return delta_e, colored
+
+    def _evict(self, now):
+        """Süresi dolan ve kapasite dışında kalan tabloları at"""
+        expired = [k for k, v in self._tables.items() if now - v["last_used"] > self.ttl_seconds]
+        for key in expired:
+            del self._tables[key]
+        while len(self._tables) > self.max_entries:
+            oldest = min(self._tables, key=lambda k: self._tables[k]["last_used"])
+            del self._tables[oldest]
+
+    def _sweep(self):
+        """Süresi dolan tabloları arka planda at; tablo kalmayınca iş parçacığı biter"""
+        while True:
+            time.sleep(max(1.0, self.ttl_seconds / 4))
+            with self._lock:
+                self._evict(time.time())
+                if not self._tables:
+                    self._sweeper = None
+                    return
+
+    def get(self, color_code):
+        """Renk kodu için tabloyu döndür (gerekirse oluştur)"""
+        ref_lab = AYGUN_COLOR_STANDARDS[color_code]["lab_reference"]
+        ref = (ref_lab["L"], ref_lab["a"], ref_lab["b"])
+        with self._lock:
+            entry = self._tables.get(color_code)
+            if entry is not None and entry["ref"] == ref:
+                entry["last_used"] = time.time()
+                return entry
+            future = self._building.get(color_code)
+            if future is not None:
+                owner = False
+            else:
+                owner = True
+                future = self._building[color_code] = Future()
+        if not owner:
+            return future.result()
+        
+        # Oluşturma (~0,5 sn) kilit dışında: diğer standartların okumaları beklemez
+        try:
+            delta_e, colored = self._build(ref_lab)
+        except Exception as exc:
+            with self._lock:
+                del self._building[color_code]
+            future.set_exception(exc)
+            raise
+        entry = {"delta_e": delta_e, "colored": colored, "ref": ref, "last_used": time.time()}
+        with self._lock:
+            self._tables[color_code] = entry
+            del self._building[color_code]
+            self._evict(entry["last_used"])
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._sweep, name="colorqc-lut-sweeper", daemon=True)
+                self._sweeper.start()
+        future.set_result(entry)
+        return entry
+
+    def index(self, image):
+        """BGR karesi için tablo indekslerini (H, W) hesapla"""
+        shift = 8 - self.bits
+        idx = (image[..., 0] >> shift).astype(np.int32) << (2 * self.bits)
+        idx |= (image[..., 1] >> shift).astype(np.int32) << self.bits
+        idx |= (image[..., 2] >> shift).astype(np.int32)
+        return idx
+
+    def delta_e_map(self, image, color_code):
+        """Tam çözünürlükte ΔE2000 haritası (tablo üzerinden, nicemleme hassasiyetinde - karar için kullanılmaz)"""
+        return self.get(color_code)["delta_e"][self.index(image)]
+
+    def colored_map(self, image, color_code):
+        """Tam çözünürlükte renklendirilmiş ΔE ısı haritası (BGR)"""
+        return self.get(color_code)["colored"][self.index(image)]
+
+    def stats(self):
+        """Önbellekteki tabloların durumu"""
+        with self._lock:
+            return {
+                "bits": self.bits,
+                "tables": sorted(self._tables.keys()),
+                "memory_bytes": sum(v["delta_e"].nbytes + v["colored"].nbytes for v in self._tables.values())
+            }
+
+delta_e_lut_cache = DeltaELookupCache()
+
 def generate_color_heatmap(image, color_code):
     """Renk sapma haritası oluştur - Delta E değerlerini görselleştir"""
     if image is None:
         return None
     
-    ref_lab = AYGUN_COLOR_STANDARDS[color_code]["lab_reference"]
+    image = FrameContext.of(image).image
     h, w = image.shape[:2]
     
-    # Her piksel için Delta E hesapla
-    heatmap = np.zeros((h, w), dtype=np.float32)
-    
-    # Performans için görüntüyü küçült
-    scale = 4
-    small = cv2.resize(image, (w // scale, h // scale))
-    small_h, small_w = small.shape[:2]
-    
-    for y in range(small_h):
-        for x in range(small_w):
-            pixel_bgr = small[y, x]
-            pixel_rgb = [int(pixel_bgr[2]), int(pixel_bgr[1]), int(pixel_bgr[0])]
-            pixel_lab = rgb_to_lab(pixel_rgb)
-            delta_e = calculate_delta_e_2000(pixel_lab, ref_lab)
-            heatmap[y * scale:(y + 1) * scale, x * scale:(x + 1) * scale] = delta_e
-    
-    # Normalize ve renklendirme
-    heatmap = np.clip(heatmap, 0, 10)  # Max 10 Delta E
-    heatmap_normalized = (heatmap / 10 * 255).astype(np.uint8)
-    heatmap_colored = cv2.applyColorMap(heatmap_normalized, cv2.COLORMAP_JET)
+    # Tam çözünürlükte tek tablo okuması ile renklendirilmiş Delta E haritası (Max 10 Delta E)
+    heatmap_colored = delta_e_lut_cache.colored_map(image, color_code)
     
     # Orijinal görüntü ile blend
     alpha = 0.6
@@ -574,16 +980,17 @@ def generate_color_heatmap(image, color_code):
     scale_x = w - 60
     scale_y = 50
     
-    # Gradient bar
-    for i in range(scale_height):
-        color_val = int(255 * (1 - i / scale_height))
-        color = cv2.applyColorMap(np.array([[color_val]], dtype=np.uint8), cv2.COLORMAP_JET)[0][0]
-        cv2.rectangle(blended, (scale_x, scale_y + i), (scale_x + scale_width, scale_y + i + 1), 
-                     color.tolist(), -1)
-    
-    # Skala etiketleri
+    # Skala arka planı
     cv2.rectangle(blended, (scale_x - 5, scale_y - 25), (scale_x + scale_width + 40, scale_y + scale_height + 25), 
                  (255, 255, 255), -1)
+    
+    # Gradient bar (üstte 10, altta 0)
+    if scale_height > 0 and scale_x >= 0:
+        gradient = (255 * (1 - np.arange(scale_height) / scale_height)).astype(np.uint8).reshape(-1, 1)
+        gradient_colored = cv2.applyColorMap(gradient, cv2.COLORMAP_JET)
+        blended[scale_y:scale_y + scale_height, scale_x:scale_x + scale_width + 1] = gradient_colored
+    
+    # Skala etiketleri
     cv2.putText(blended, "Delta E", (scale_x - 5, scale_y - 8), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
     cv2.putText(blended, "0", (scale_x + scale_width + 5, scale_y + scale_height), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 0), 1)
     cv2.putText(blended, "5", (scale_x + scale_width + 5, scale_y + scale_height // 2), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 0), 1)
@@ -591,26 +998,81 @@ def generate_color_heatmap(image, color_code):
     
     return blended
 
-def generate_gloss_map(image):
+def compute_gloss_grid(gray, window=32, stride=16):
+    """Kayan pencerelerle yerel parlaklık grid'i (0-100 GU) - bölge istatistikleri için yeterli, harita üretmez"""
+    h, w = gray.shape[:2]
+    ys = np.arange(0, max(0, h - window), stride)
+    xs = np.arange(0, max(0, w - window), stride)
+    field = {"window": window, "stride": stride, "origins_y": ys, "origins_x": xs}
+    
+    if ys.size == 0 or xs.size == 0:
+        field["grid"] = np.zeros((ys.size, xs.size), dtype=np.float32)
+        return field
+    
+    # Parlak piksel maskesi ve yoğunluk kareleri için integral görüntüler
+    sums, sq_sums = cv2.integral2(gray, sdepth=cv2.CV_64F)
+    highlights = cv2.integral((gray > 200).astype(np.uint8), sdepth=cv2.CV_32S)
+    n = window * window
+    
+    def window_sum(integral):
+        y0, x0 = ys[:, None], xs[None, :]
+        return (integral[y0 + window, x0 + window] - integral[y0, x0 + window]
+                - integral[y0 + window, x0] + integral[y0, x0])
+    
+    mean = window_sum(sums) / n
+    std = np.sqrt(np.maximum(0, window_sum(sq_sums) / n - mean ** 2))
+    high_vals = window_sum(highlights) / n
+    field["grid"] = np.minimum(100, (high_vals * 100 + std / 2.55) / 2).astype(np.float32)
+    return field
+
+def compute_gloss_field(gray, window=32, stride=16, grid_field=None):
+    """Kayan pencerelerle yerel parlaklık alanı (0-100 GU) - pencere grid'i ve tam çözünürlük harita"""
+    h, w = gray.shape[:2]
+    field = dict(grid_field or compute_gloss_grid(gray, window, stride))
+    ys, xs, grid = field["origins_y"], field["origins_x"], field["grid"]
+    if ys.size == 0 or xs.size == 0:
+        field["map"] = np.zeros((h, w), dtype=np.float32)
+        return field
+    
+    # Her piksel, onu kapsayan son pencerenin değerini alır (pencereler sırayla üst üste yazılır).
+    # Başlangıcı pikselden önceki son pencere onu kapsamıyorsa (stride > window boşlukları, kenarlar) 0 kalır.
+    py, px = np.arange(h), np.arange(w)
+    iy = np.minimum(py // stride, ys.size - 1)
+    ix = np.minimum(px // stride, xs.size - 1)
+    dense = grid[iy[:, None], ix[None, :]]
+    dense[py - ys[iy] >= window, :] = 0
+    dense[:, px - xs[ix] >= window] = 0
+    
+    field["map"] = dense
+    return field
+
+def summarize_gloss_field(field):
+    """Parlaklık alanı grid'inden bölgesel istatistikler"""
+    grid = field["grid"]
+    summary = {"zones": int(grid.size), "window": field["window"], "stride": field["stride"]}
+    if grid.size == 0:
+        summary.update({"mean": 0.0, "std": 0.0, "min": 0.0, "max": 0.0, "p10": 0.0, "p90": 0.0})
+        return summary
+    p10, p90 = np.percentile(grid, [10, 90])
+    return {
+        **summary,
+        "mean": round(float(grid.mean()), 1),
+        "std": round(float(grid.std()), 1),
+        "min": round(float(grid.min()), 1),
+        "max": round(float(grid.max()), 1),
+        "p10": round(float(p10), 1),
+        "p90": round(float(p90), 1)
+    }
+
+def generate_gloss_map(image, window=32, stride=16):
     """Parlaklık haritası oluştur"""
     if image is None:
         return None
     
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    h, w = gray.shape
-    
-    # Yerel parlaklık hesaplama (blok bazlı)
-    block_size = 32
-    gloss_map = np.zeros_like(gray, dtype=np.float32)
-    
-    for y in range(0, h - block_size, block_size // 2):
-        for x in range(0, w - block_size, block_size // 2):
-            block = gray[y:y + block_size, x:x + block_size]
-            # Yüksek değerli piksellerin oranı
-            high_vals = np.sum(block > 200) / (block_size * block_size)
-            std = np.std(block)
-            gloss = min(100, (high_vals * 100 + std / 2.55) / 2)
-            gloss_map[y:y + block_size, x:x + block_size] = gloss
+    # Yerel parlaklık hesaplama (kayan pencere)
+    ctx = FrameContext.of(image)
+    image = ctx.image
+    gloss_map = ctx.gloss_field(window, stride)["map"]
     
     # Normalize ve renklendirme
     gloss_normalized = (gloss_map / 100 * 255).astype(np.uint8)
@@ -622,28 +1084,67 @@ def generate_gloss_map(image):
     
     return blended
 
-def generate_defect_heatmap(image, defects):
-    """Kusur yoğunluk haritası oluştur"""
-    if image is None:
-        return None
-    
-    h, w = image.shape[:2]
+# Kusur ciddiyetine göre ısı haritası ağırlıkları
+DEFECT_SEVERITY_WEIGHTS = {"critical": 3, "major": 2, "minor": 1}
+
+@functools.lru_cache(maxsize=256)
+def _defect_kernel(radius):
+    """Verilen yarıçap için (2r x 2r) kesik Gaussian kusur çekirdeği - merkez (r, r)"""
+    offsets = np.arange(-radius, radius, dtype=np.float32)
+    dist_sq = offsets[:, None] ** 2 + offsets[None, :] ** 2
+    kernel = np.exp(-dist_sq / (2 * (radius / 2) ** 2))
+    kernel[dist_sq >= radius ** 2] = 0
+    kernel.setflags(write=False)
+    return kernel
+
+def render_defect_density(shape, defects):
+    """Tüm kusurların ağırlıklı Gaussian yoğunluk haritasını (H, W) float32 olarak oluştur"""
+    h, w = shape[:2]
     heatmap = np.zeros((h, w), dtype=np.float32)
     
-    # Her kusur için Gaussian blob ekle
+    # Kusurları yarıçapa göre grupla: (merkez_x, merkez_y, ağırlık)
+    groups = {}
     for defect in defects:
         loc = defect["location"]
-        cx, cy = loc["x"] + loc["w"] // 2, loc["y"] + loc["h"] // 2
         radius = max(loc["w"], loc["h"]) * 2
+        if radius <= 0:
+            continue
+        weight = DEFECT_SEVERITY_WEIGHTS.get(defect["severity"], 1)
+        groups.setdefault(radius, []).append((loc["x"] + loc["w"] // 2, loc["y"] + loc["h"] // 2, weight))
+    
+    for radius, blobs in groups.items():
+        kernel = _defect_kernel(radius)
+        
+        if len(blobs) * kernel.size > h * w:
+            # Çok sayıda kusur: ağırlıklı dürtü haritasını tek seferde çekirdekle filtrele
+            impulses = np.zeros((h, w), dtype=np.float32)
+            cx, cy, weight = (np.array(v) for v in zip(*blobs))
+            inside = (cx >= 0) & (cx < w) & (cy >= 0) & (cy < h)
+            np.add.at(impulses, (cy[inside], cx[inside]), weight[inside].astype(np.float32))
+            heatmap += cv2.filter2D(impulses, -1, cv2.flip(kernel, -1), anchor=(radius - 1, radius - 1),
+                                    borderType=cv2.BORDER_CONSTANT)
+            continue
         
-        # Gaussian blob
-        for y in range(max(0, cy - radius), min(h, cy + radius)):
-            for x in range(max(0, cx - radius), min(w, cx + radius)):
-                dist = np.sqrt((x - cx) ** 2 + (y - cy) ** 2)
-                if dist < radius:
-                    intensity = np.exp(-dist ** 2 / (2 * (radius / 2) ** 2))
-                    severity_mult = 3 if defect["severity"] == "critical" else 2 if defect["severity"] == "major" else 1
-                    heatmap[y, x] += intensity * severity_mult
+        # Az sayıda kusur: önbellekteki çekirdeği doğrudan ilgili bölgeye ekle
+        for cx, cy, weight in blobs:
+            y0, y1 = max(0, cy - radius), min(h, cy + radius)
+            x0, x1 = max(0, cx - radius), min(w, cx + radius)
+            if y0 >= y1 or x0 >= x1:
+                continue
+            ky, kx = y0 - (cy - radius), x0 - (cx - radius)
+            heatmap[y0:y1, x0:x1] += kernel[ky:ky + (y1 - y0), kx:kx + (x1 - x0)] * weight
+    
+    return heatmap
+
+def generate_defect_heatmap(image, defects):
+    """Kusur yoğunluk haritası oluştur"""
+    if image is None:
+        return None
+    
+    image = FrameContext.of(image).image
+    
+    # Tüm kusurlar için ağırlıklı Gaussian blob'lar
+    heatmap = render_defect_density(image.shape, defects)
     
     # Normalize
     if heatmap.max() > 0:
@@ -659,8 +1160,9 @@ def generate_defect_heatmap(image, defects):
     
     return blended
 
-def create_simulated_image(product_code, color_code):
-    """Kamera yoksa simülasyon görüntüsü oluştur"""
+def create_simulated_image(product_code, color_code, rng=None):
+    """Kamera yoksa simülasyon görüntüsü oluştur - rng verilirse (RandomState) tekrarlanabilir"""
+    rng = np.random if rng is None else rng
     # 1280x720 boş görüntü
     img = np.ones((720, 1280, 3), dtype=np.uint8) * 200
     
@@ -668,37 +1170,223 @@ def create_simulated_image(product_code, color_code):
     color_rgb = AYGUN_COLOR_STANDARDS[color_code]["rgb_reference"]
     # Hafif varyasyon ekle
     color_bgr = [
-        int(color_rgb[2] + np.random.randint(-20, 20)),
-        int(color_rgb[1] + np.random.randint(-20, 20)),
-        int(color_rgb[0] + np.random.randint(-20, 20))
+        int(color_rgb[2] + rng.randint(-20, 20)),
+        int(color_rgb[1] + rng.randint(-20, 20)),
+        int(color_rgb[0] + rng.randint(-20, 20))
     ]
     
     # Merkez bölge (ürün yüzeyi)
     cv2.rectangle(img, (200, 150), (1080, 570), color_bgr, -1)
     
     # Rastgele kusurlar ekle (simülasyon için)
-    num_defects = np.random.randint(0, 4)
+    num_defects = rng.randint(0, 4)
     for _ in range(num_defects):
-        x = np.random.randint(250, 1000)
-        y = np.random.randint(200, 500)
-        w = np.random.randint(20, 80)
-        h = np.random.randint(20, 80)
+        x = rng.randint(250, 1000)
+        y = rng.randint(200, 500)
+        w = rng.randint(20, 80)
+        h = rng.randint(20, 80)
         # Kusur rengi (daha koyu)
         defect_color = [max(0, c - 50) for c in color_bgr]
         cv2.rectangle(img, (x, y), (x + w, y + h), defect_color, -1)
     
     # Gürültü ekle
-    noise = np.random.randint(-15, 15, img.shape, dtype=np.int16)
+    noise = rng.randint(-15, 15, img.shape, dtype=np.int16)
     img = np.clip(img.astype(np.int16) + noise, 0, 255).astype(np.uint8)
     
     return img
 
+# ==================== SENTETİK KARE KAYNAĞI ====================
+# Yük testleri ve tekrarlanabilir doğruluk ölçümleri için tohumlu (seeded) simülasyon.
+# Ürün başına kare havuzu ilk kullanımda bir kez üretilir; kareler salt-okunur olarak kopyasız
+# sunulur. Her karenin üretim parametreleri (ΔE sapması, parlaklık seviyesi, kusurlar)
+# ölçüm doğrusu (ground truth) olarak kareyle birlikte saklanır.
+
+SYNTHETIC_SEED = int(os.environ.get("COLORQC_SIM_SEED", "0"))
+SYNTHETIC_POOL_SIZE = int(os.environ.get("COLORQC_SIM_POOL", "8"))
+SYNTHETIC_DEFECT_TYPES = ("CIZIK", "LEKE", "DALGA")
+
+SyntheticFrame = namedtuple("SyntheticFrame", ["frame", "truth"])
+
+def shifted_lab(reference_lab, target_delta_e, direction):
+    """Referanstan verilen yönde ΔE2000 değeri target_delta_e olan Lab rengi (ikiye bölme ile)"""
+    reference = lab_to_array(reference_lab).astype(np.float64)
+    direction = np.asarray(direction, dtype=np.float64)
+    direction = direction / (np.linalg.norm(direction) or 1.0)
+    if target_delta_e <= 0:
+        return reference
+    delta = lambda t: float(delta_e_2000_array(reference, reference + t * direction))
+    low, high = 0.0, 1.0
+    while delta(high) < target_delta_e and high < 256:
+        high *= 2
+    for _ in range(40):
+        mid = (low + high) / 2
+        if delta(mid) < target_delta_e:
+            low = mid
+        else:
+            high = mid
+    return reference + high * direction
+
+def render_synthetic_frame(product_code, rng, delta_e=0.0, gloss_level=0.0, defects=(),
+                           width=1280, height=720, noise=15):
+    """Verilen parametrelerle sentetik kare ve ölçüm doğrusu üret.
+
+    Ürün yüzeyi analiz merkez bölgesini (h//6, w//6 kenar payı) tamamen kaplar; parlak yansıma
+    bandı yalnızca merkez bölge dışındaki yüzey kenarına çizilir, böylece renk ölçümünü etkilemez.
+    gloss_level (0-1) bu bandın kalınlığıdır. defects: [{"type", "x", "y"}] (kusur merkezleri).
+    """
+    color_code = AYGUN_PRODUCTS[product_code]["expected_color"]
+    reference_lab = AYGUN_COLOR_STANDARDS[color_code]["lab_reference"]
+    
+    # Hedef ΔE için rastgele yönde kaydırılmış renk; gamut dışına taşan yönler (kırpma ΔE'yi bozar)
+    # en fazla 8 denemede değiştirilir. 8-bit nicemlemeden sonraki gerçek ΔE kaydedilir.
+    best = None
+    for _ in range(8):
+        lab = shifted_lab(reference_lab, delta_e, rng.normal(size=3))
+        rgb = np.clip(np.rint(lab_to_rgb_array(lab)), 0, 255).astype(np.uint8)
+        surface_lab = rgb_to_lab([int(v) for v in rgb])
+        error = abs(calculate_delta_e_2000(surface_lab, reference_lab) - delta_e)
+        if best is None or error < best[0]:
+            best = (error, rgb, surface_lab)
+        if error <= 0.15:
+            break
+    _, rgb, surface_lab = best
+    surface_bgr = rgb[::-1]
+    
+    img = np.full((height, width, 3), 200, dtype=np.uint8)
+    x0, y0, x1, y1 = width // 8, height // 8, width - width // 8, height - height // 8
+    img[y0:y1, x0:x1] = surface_bgr
+    
+    # Parlak yansıma bandı (yüzey kenarı, merkez bölge dışında)
+    band_y = int(round(gloss_level * (height // 6 - y0)))
+    band_x = int(round(gloss_level * (width // 6 - x0)))
+    if band_y > 0 and band_x > 0:
+        highlight = (245, 245, 245)
+        img[y0:y0 + band_y, x0:x1] = highlight
+        img[y1 - band_y:y1, x0:x1] = highlight
+        img[y0:y1, x0:x0 + band_x] = highlight
+        img[y0:y1, x1 - band_x:x1] = highlight
+    
+    # Kusurlar: tipine göre boyutlandırılmış, yüzey renginden koyu şekiller
+    defect_color = tuple(max(0, int(c) - 50) for c in surface_bgr)
+    defect_truth = []
+    for defect in defects:
+        cx, cy = int(defect["x"]), int(defect["y"])
+        if defect["type"] == "CIZIK":
+            w, h = int(rng.randint(60, 120)), int(rng.randint(3, 6))
+            cv2.rectangle(img, (cx - w // 2, cy - h // 2), (cx + w // 2, cy + h // 2), defect_color, -1)
+        elif defect["type"] == "LEKE":
+            r = int(rng.randint(7, 11))
+            w = h = 2 * r
+            cv2.circle(img, (cx, cy), r, defect_color, -1)
+        else:  # DALGA
+            w, h = 2 * int(rng.randint(25, 35)), 2 * int(rng.randint(15, 20))
+            cv2.ellipse(img, (cx, cy), (w // 2, h // 2), 0, 0, 360, defect_color, -1)
+        defect_truth.append({"type": defect["type"], "name": DEFECT_TYPES[defect["type"]]["name"],
+                             "location": {"x": cx - w // 2, "y": cy - h // 2, "w": w, "h": h}})
+    
+    if noise:
+        img = np.clip(img.astype(np.int16) + rng.randint(-noise, noise + 1, img.shape).astype(np.int16),
+                      0, 255).astype(np.uint8)
+    
+    truth = {
+        "product_code": product_code,
+        "target_delta_e": round(float(delta_e), 2),
+        "delta_e": calculate_delta_e_2000(surface_lab, reference_lab),
+        "surface_lab": surface_lab,
+        "gloss_level": round(float(gloss_level), 3),
+        "gloss_value": calculate_gloss(img),
+        "defects": defect_truth
+    }
+    return img, truth
+
+class SyntheticFrameSource:
+    """Tohumlu, ürün başına önceden üretilmiş ve kopyasız sunulan sentetik kare havuzu"""
+
+    def __init__(self, seed=SYNTHETIC_SEED, pool_size=SYNTHETIC_POOL_SIZE, width=1280, height=720):
+        self.seed = seed
+        self.pool_size = max(1, pool_size)
+        self.width = width
+        self.height = height
+        self._pools = {}
+        self._cursors = {}
+        self._product_cycle = itertools.cycle(sorted(AYGUN_PRODUCTS))
+        self._lock = threading.Lock()
+        self._build_locks = {code: threading.Lock() for code in AYGUN_PRODUCTS}
+
+    def rng(self, product_code, index):
+        """Kare başına bağımsız üreteç - her kare havuz boyutu ve üretim sırasından bağımsız tekrarlanabilir"""
+        return np.random.RandomState((self.seed * 1000003 + zlib.crc32(product_code.encode()) * 131 + index) % 2 ** 32)
+
+    def scenario(self, product_code, rng):
+        """Kare parametreleri: tolerans çevresinde ΔE sapması, parlaklık seviyesi, 0-3 kusur"""
+        product = AYGUN_PRODUCTS[product_code]
+        tolerance = get_tolerance(product, AYGUN_COLOR_STANDARDS[product["expected_color"]])
+        w, h = self.width, self.height
+        defects = [
+            {"type": SYNTHETIC_DEFECT_TYPES[rng.randint(len(SYNTHETIC_DEFECT_TYPES))],
+             "x": int(rng.randint(w // 4, 3 * w // 4)), "y": int(rng.randint(h // 4, 3 * h // 4))}
+            for _ in range(rng.randint(0, 4))
+        ]
+        return {"delta_e": float(rng.uniform(0, 2 * tolerance)), "gloss_level": float(rng.uniform(0, 1)),
+                "defects": defects}
+
+    def pool(self, product_code):
+        """Ürünün kare havuzu (ilk çağrıda üretilir)"""
+        frames = self._pools.get(product_code)
+        if frames is not None:
+            return frames
+        with self._build_locks[product_code]:
+            if product_code not in self._pools:
+                frames = []
+                for index in range(self.pool_size):
+                    rng = self.rng(product_code, index)
+                    img, truth = render_synthetic_frame(product_code, rng, width=self.width, height=self.height,
+                                                        **self.scenario(product_code, rng))
+                    img.flags.writeable = False  # Paylaşılan kare: tüketiciler kopyalamadan yazamaz
+                    frames.append(SyntheticFrame(img, {**truth, "pool_index": index, "seed": self.seed}))
+                self._pools[product_code] = frames
+            return self._pools[product_code]
+
+    def next_index(self, product_code):
+        """Ürün imlecini ilerlet ve sıradaki havuz indeksini döndür (havuz üretilmez)"""
+        with self._lock:
+            index = self._cursors.get(product_code, 0)
+            self._cursors[product_code] = index + 1
+        return index % self.pool_size
+
+    def frame_at(self, product_code, index):
+        """Havuzdaki belirli kare - tohum aynı olduğundan her süreçte aynı karedir"""
+        frames = self.pool(product_code)
+        return frames[index % len(frames)]
+
+    def next_frame(self, product_code):
+        """Ürün havuzundan sıradaki kare (döngüsel, kopyasız)"""
+        return self.frame_at(product_code, self.next_index(product_code))
+
+    def next_any(self):
+        """Ürünler arasında sırayla dolaşarak sıradaki kare"""
+        with self._lock:
+            product_code = next(self._product_cycle)
+        return self.next_frame(product_code)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "seed": self.seed,
+                "pool_size": self.pool_size,
+                "resolution": [self.width, self.height],
+                "products_ready": sorted(self._pools),
+                "memory_bytes": sum(f.frame.nbytes for frames in self._pools.values() for f in frames)
+            }
+
+synthetic_frames = SyntheticFrameSource()
+
 def draw_defects_on_image(image, defects, color_status, product_name):
     """Kusurları görüntü üzerine çiz - sadece kusur kutuları"""
     if image is None:
         return None
     
-    annotated = image.copy()
+    annotated = FrameContext.of(image).image.copy()
     
     # Sadece kusurları işaretle
     for i, defect in enumerate(defects):
@@ -728,16 +1416,17 @@ def draw_defects_on_image(image, defects, color_status, product_name):
     
     return annotated
 
-def analyze_color_region(image, color_code):
-    """Görüntüdeki ana renk bölgesini analiz et"""
+def analyze_color_region(image, color_code, center_crop=True):
+    """Görüntüdeki ana renk bölgesini analiz et - ROI verilmişse center_crop=False ile tamamı"""
     if image is None:
         # Görüntü yoksa referans değerleri döndür (ideal durum)
         ref = AYGUN_COLOR_STANDARDS[color_code]["lab_reference"]
         return {"L": ref["L"], "a": ref["a"], "b": ref["b"]}
     
     # Görüntünün merkez bölgesini al (daha geniş alan)
+    image = FrameContext.of(image).image
     h, w = image.shape[:2]
-    margin_h, margin_w = h // 6, w // 6
+    margin_h, margin_w = (h // 6, w // 6) if center_crop else (0, 0)
     center_region = image[margin_h:h-margin_h, margin_w:w-margin_w]
     
     # Ortalama renk hesapla
@@ -746,56 +1435,366 @@ def analyze_color_region(image, color_code):
     
     return rgb_to_lab(rgb)
 
-def init_camera():
-    """Kamerayı başlat"""
-    global camera
-    with camera_lock:
-        if camera is None or not camera.isOpened():
-            camera = cv2.VideoCapture(0)
-            camera.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-            camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-            camera.set(cv2.CAP_PROP_FPS, 30)
-            time.sleep(0.5)
-    return camera is not None and camera.isOpened()
-
-def release_camera():
-    """Kamerayı serbest bırak"""
-    global camera
-    with camera_lock:
-        if camera is not None:
-            camera.release()
-            camera = None
-
-def get_frame():
-    """Kameradan kare al"""
-    global camera
-    with camera_lock:
-        if camera is None or not camera.isOpened():
-            return None
-        ret, frame = camera.read()
-        return frame if ret else None
+# ==================== KAMERA YAKALAMA ====================
+# Her kamera için tek bir arka plan iş parçacığı kareleri okuyup küçük bir halka tampona yazar.
+# Tüketiciler (video akışı, ısı haritası, analiz) cihaza dokunmadan en son kareyi okur
+# veya bir sonraki kareyi bekler; yakalama hızı izleyici sayısından bağımsızdır.
+
+FramePacket = namedtuple("FramePacket", ["seq", "timestamp", "frame"])
+
+def open_video_device(index=0, width=1280, height=720, fps=30):
+    """OpenCV kamera cihazını aç ve çözünürlük/FPS ayarla"""
+    device = cv2.VideoCapture(index)
+    device.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    device.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    device.set(cv2.CAP_PROP_FPS, fps)
+    return device
+
+class CameraCapture:
+    """Arka plan yakalama iş parçacığı + sıra numaralı, zaman damgalı son-kare halka tamponu"""
+
+    def __init__(self, open_source, buffer_size=4, max_failures=30):
+        self.open_source = open_source  # read()/isOpened()/release() sağlayan kaynak döndürür
+        self.buffer_size = buffer_size
+        self.max_failures = max_failures
+        self._source = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._cond = threading.Condition()
+        self._buffer = deque(maxlen=buffer_size)
+        self._seq = 0
+        self._lock = threading.Lock()  # start/stop işlemleri için
+        self.dropped_reads = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, first_frame_timeout=1.0):
+        """Kaynağı aç ve yakalama iş parçacığını başlat; kaynak açılırsa True"""
+        with self._lock:
+            if self.running:
+                return True
+            source = self.open_source()
+            if source is None or not source.isOpened():
+                if source is not None:
+                    source.release()
+                return False
+            self._source = source
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="colorqc-capture", daemon=True)
+            self._thread.start()
+        # İlk kare gelene kadar kısa süre bekle
+        self.wait_for_frame(timeout=first_frame_timeout)
+        return self.running
+
+    def stop(self):
+        """Yakalamayı durdur ve kaynağı serbest bırak"""
+        with self._lock:
+            thread = self._thread
+            self._stop.set()
+            if thread is not None:
+                thread.join(timeout=2.0)
+            self._thread = None
+            with self._cond:
+                self._buffer.clear()
+                self._cond.notify_all()
+
+    def _run(self):
+        source = self._source
+        failures = 0
+        try:
+            while not self._stop.is_set():
+                ret, frame = source.read()
+                if not ret or frame is None:
+                    failures += 1
+                    self.dropped_reads += 1
+                    if failures >= self.max_failures:
+                        break  # Kaynak kayboldu
+                    time.sleep(0.01)
+                    continue
+                failures = 0
+                frame.setflags(write=False)  # Tampondaki kareler paylaşılır, değiştirilemez
+                with self._cond:
+                    self._seq += 1
+                    self._buffer.append(FramePacket(self._seq, time.time(), frame))
+                    self._cond.notify_all()
+        finally:
+            source.release()
+            with self._cond:
+                self._cond.notify_all()
+
+    def latest(self):
+        """En son kare paketi (yakalama çalışmıyorsa None)"""
+        with self._cond:
+            if not self.running or not self._buffer:
+                return None
+            return self._buffer[-1]
+
+    def wait_for_frame(self, after_seq=0, timeout=1.0):
+        """Sıra numarası after_seq'ten büyük ilk kareyi bekle (zaman aşımında None)"""
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                if self._buffer and self._buffer[-1].seq > after_seq:
+                    return self._buffer[-1]
+                remaining = deadline - time.time()
+                if remaining <= 0 or (self._thread is not None and not self._thread.is_alive()):
+                    return None
+                self._cond.wait(remaining)
+
+    def stats(self):
+        """Yakalama durumu ve tampondaki karelerden ölçülen FPS"""
+        with self._cond:
+            packets = list(self._buffer)
+        fps = 0.0
+        if len(packets) >= 2 and packets[-1].timestamp > packets[0].timestamp:
+            fps = (len(packets) - 1) / (packets[-1].timestamp - packets[0].timestamp)
+        return {
+            "running": self.running,
+            "last_seq": packets[-1].seq if packets else 0,
+            "capture_fps": round(fps, 1),
+            "dropped_reads": self.dropped_reads
+        }
+
+# ==================== KAYIT VE TEKRAR OYNATMA ====================
+# Hat görüntüleri ham kare dosyasına (.cqcrec) kaydedilir ve kamera arayüzü (read/isOpened/release)
+# üzerinden orijinal hızda, hızlandırılmış veya azami hızda tekrar oynatılır. Dosya düzeni:
+#   64 baytlık başlık | kare_sayısı x (yükseklik x genişlik x kanal) uint8 kare | float64 zaman damgaları
+# Kareler np.memmap ile kopyasız okunur; kamerası olmayan makinelerde tekrarlanabilir ölçüm sağlar.
+
+RECORDING_DIR = os.environ.get("COLORQC_RECORDING_DIR",
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings"))
+RECORDING_EXTENSION = ".cqcrec"
+RECORDING_MAGIC = b"CQCREC01"
+RECORDING_HEADER = struct.Struct("<8sIIIQQ")  # magic, genişlik, yükseklik, kanal, kare sayısı, indeks ofseti
+RECORDING_HEADER_SIZE = 64
+RECORDING_NOMINAL_FPS = 30.0
+
+def is_safe_name(name):
+    """Dosya/kimlik adı olarak güvenli mi: yalnızca harf, rakam, - ve _"""
+    return bool(name) and all(c.isalnum() or c in "-_" for c in name)
+
+def recording_path(name):
+    """Kayıt adını kayıt dizinindeki dosya yoluna çevir"""
+    if not is_safe_name(name):
+        raise HTTPException(status_code=400, detail="Geçersiz kayıt adı")
+    return os.path.join(RECORDING_DIR, name + RECORDING_EXTENSION)
+
+class FrameRecorder:
+    """Kareleri sırayla ham kare dosyasına yazar; close() zaman damgası indeksini ekler"""
+
+    def __init__(self, path, width, height, channels=3):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.timestamps = []
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "wb")
+        self._write_header(0, 0)
+        self._file.seek(RECORDING_HEADER_SIZE)
+
+    def _write_header(self, frame_count, index_offset):
+        header = RECORDING_HEADER.pack(RECORDING_MAGIC, self.width, self.height, self.channels,
+                                       frame_count, index_offset)
+        self._file.seek(0)
+        self._file.write(header.ljust(RECORDING_HEADER_SIZE, b"\0"))
+
+    def write(self, frame, timestamp):
+        if frame.shape != (self.height, self.width, self.channels) or frame.dtype != np.uint8:
+            raise ValueError(f"Kare boyutu kayıtla uyumsuz: {frame.shape}")
+        self._file.write(np.ascontiguousarray(frame).data)
+        self.timestamps.append(timestamp)
+
+    def close(self):
+        """İndeksi yaz ve başlığı tamamla (kapatılmamış dosya okunurken kurtarılır)"""
+        if self._file.closed:
+            return
+        index_offset = self._file.tell()
+        self._file.write(np.asarray(self.timestamps, dtype=np.float64).tobytes())
+        self._write_header(len(self.timestamps), index_offset)
+        self._file.close()
 
-def generate_video_stream():
-    """Video stream generator - kamera yoksa simülasyon"""
-    global is_analyzing
+class FrameRecording:
+    """Kayıt dosyasını bellek eşlemeli (memmap) aç: frames (N, H, W, C) ve timestamps (N,)"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            magic, width, height, channels, frame_count, index_offset = RECORDING_HEADER.unpack(
+                f.read(RECORDING_HEADER.size))
+        if magic != RECORDING_MAGIC:
+            raise ValueError(f"Kayıt dosyası değil: {path}")
+        self.width, self.height, self.channels = width, height, channels
+        frame_bytes = width * height * channels
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+        if frame_count == 0:
+            # Tamamlanmamış kayıt (ör. süreç çöktü): tam kareler kurtarılır, nominal FPS varsayılır
+            frame_count = (data.size - RECORDING_HEADER_SIZE) // frame_bytes if frame_bytes else 0
+            self.timestamps = np.arange(frame_count, dtype=np.float64) / RECORDING_NOMINAL_FPS
+        else:
+            self.timestamps = np.frombuffer(data[index_offset:index_offset + 8 * frame_count].tobytes(),
+                                            dtype=np.float64)
+        self.frames = data[RECORDING_HEADER_SIZE:RECORDING_HEADER_SIZE + frame_count * frame_bytes].reshape(
+            frame_count, height, width, channels)
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def duration(self):
+        return float(self.timestamps[-1] - self.timestamps[0]) if len(self.timestamps) > 1 else 0.0
+
+    def info(self):
+        return {
+            "name": os.path.basename(self.path)[:-len(RECORDING_EXTENSION)],
+            "frames": len(self),
+            "width": self.width,
+            "height": self.height,
+            "duration_s": round(self.duration, 3),
+            "fps": round((len(self) - 1) / self.duration, 1) if self.duration > 0 else None,
+            "size_bytes": os.path.getsize(self.path)
+        }
+
+class ReplayCapture:
+    """Kaydı cv2.VideoCapture arayüzüyle oynatır. speed: 1 = orijinal hız, 2 = iki kat, 0 = azami hız"""
+
+    def __init__(self, path, speed=1.0, loop=True):
+        self.recording = FrameRecording(path)
+        self.speed = speed
+        self.loop = loop
+        self.index = 0
+        self.loops = 0
+        self._start = None
+
+    def isOpened(self):
+        return self.recording is not None and len(self.recording) > 0
+
+    def read(self):
+        recording = self.recording
+        if recording is None:
+            return False, None
+        if self.index >= len(recording):
+            if not self.loop:
+                return False, None
+            self.index = 0
+            self.loops += 1
+            self._start = None
+        if self.speed > 0:
+            # Karenin kayıttaki zamanına göre bekle (kayıt başına göre, hız çarpanıyla)
+            offset = (recording.timestamps[self.index] - recording.timestamps[0]) / self.speed
+            if self._start is None:
+                self._start = time.perf_counter() - offset
+            delay = self._start + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        frame = recording.frames[self.index]  # memmap görünümü - kopyasız
+        self.index += 1
+        return True, frame
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.recording.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.recording.height)
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(len(self.recording))
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.index)
+        return 0.0
+
+    def release(self):
+        self.recording = None
+
+class CameraRecorder:
+    """Çalışan kameradan yeni kareleri arka planda kayıt dosyasına yazar"""
+
+    def __init__(self, capture, path, max_frames=900):
+        self.capture = capture
+        self.path = path
+        self.max_frames = max_frames
+        self.frames = 0
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="colorqc-recorder", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+    def _run(self):
+        recorder = None
+        last_seq = 0
+        try:
+            while not self._stop.is_set() and self.frames < self.max_frames:
+                packet = self.capture.wait_for_frame(last_seq, timeout=0.5)
+                if packet is None:
+                    if not self.capture.running:
+                        break
+                    continue
+                last_seq = packet.seq
+                if recorder is None:
+                    h, w = packet.frame.shape[:2]
+                    recorder = FrameRecorder(self.path, w, h)
+                recorder.write(packet.frame, packet.timestamp)
+                self.frames += 1
+        except Exception as exc:
+            self.error = str(exc)
+        finally:
+            if recorder is not None:
+                recorder.close()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=5.0)
+        return self.stats()
+
+    def stats(self):
+        return {"path": self.path, "frames": self.frames, "running": self.running, "error": self.error}
+
+def list_recordings():
+    """Kayıt dizinindeki kayıtların özet bilgileri"""
+    if not os.path.isdir(RECORDING_DIR):
+        return []
+    recordings = []
+    for entry in sorted(os.scandir(RECORDING_DIR), key=lambda e: e.name):
+        if entry.name.endswith(RECORDING_EXTENSION):
+            try:
+                recordings.append(FrameRecording(entry.path).info())
+            except (ValueError, OSError, struct.error):
+                continue
+    return recordings
+
+def generate_video_frames(station):
+    """İstasyonun canlı video kareleri (JPEG baytları) - kamera yoksa simülasyon"""
     last_sim_time = 0
     sim_frame = None
     
     # Kamerayı dene
-    camera_available = init_camera()
+    capture = station.capture
+    camera_available = capture.start()
+    last_seq = 0
     
     while True:
-        frame = get_frame()
+        # Yakalama iş parçacığından bir sonraki kareyi bekle (cihaza doğrudan erişim yok)
+        frame = None
+        packet = capture.wait_for_frame(last_seq, timeout=0.5) if capture.running else None
+        if packet is not None:
+            last_seq = packet.seq
+            frame = packet.frame.copy()
         
         # Kamera yoksa simülasyon görüntüsü göster
         if frame is None:
             current_time = time.time()
             # Her 2 saniyede bir yeni simülasyon görüntüsü
             if sim_frame is None or (current_time - last_sim_time) > 2:
-                # Rastgele ürün seç
-                product_code = np.random.choice(list(AYGUN_PRODUCTS.keys()))
-                color_code = AYGUN_PRODUCTS[product_code]["expected_color"]
-                sim_frame = create_simulated_image(product_code, color_code)
+                # Sentetik havuzdan sıradaki ürün karesi (üzerine yazı çizileceği için kopyalanır)
+                sim_frame = synthetic_frames.next_any().frame.copy()
                 
                 # "SIMULASYON MODU" yazısı ekle
                 h, w = sim_frame.shape[:2]
@@ -810,8 +1809,8 @@ def generate_video_stream():
             time.sleep(0.1)
             continue
         
-        # Analiz modu aktifse overlay ekle
-        if is_analyzing:
+        # Sürekli muayene çalışıyorsa overlay ekle
+        if station.pipeline is not None and station.pipeline.running:
             # Merkez bölge göstergesi
             h, w = frame.shape[:2]
             cv2.rectangle(frame, (w//4, h//4), (3*w//4, 3*h//4), (0, 255, 255), 2)
@@ -820,125 +1819,678 @@ def generate_video_stream():
         
         # JPEG formatına çevir
         ret, buffer = cv2.imencode('.jpg', frame)
-        frame_bytes = buffer.tobytes()
-        
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+        yield buffer.tobytes()
         
-        time.sleep(0.033)
+        # Kamera karesi bekleme ile zaten senkron; simülasyonda ~30 FPS
+        if packet is None:
+            time.sleep(0.033)
 
-# ==================== API ENDPOINTS ====================
+# ==================== MJPEG YAYINI ====================
+# Kare bir kez üretilir, bir kez JPEG kodlanır ve tüm abonelere aynı baytlar dağıtılır.
+# Her abonede yalnızca en son kare bekler; yavaş istemci atlanır, diğerlerini bekletmez.
 
-@app.get("/")
-async def root():
-    return {
-        "system": "ColorQC - Aygün Cerrahi Aletler",
-        "description": "Hibrit Yapay Zeka Tabanlı Yüzey ve Renk Kalite Kontrol Sistemi",
-        "version": "1.0.0",
-        "problem": "Problem 2 - Yüzey Parlaklığı ve Eloksal Renk Uyumsuzluğu"
-    }
+def mjpeg_part(frame_bytes):
+    """multipart/x-mixed-replace akışı için tek JPEG parçası"""
+    return (b'--frame\r\n'
+            b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
 
-@app.get("/video_feed")
-async def video_feed():
-    """Canlı video stream"""
-    return StreamingResponse(
-        generate_video_stream(),
-        media_type="multipart/x-mixed-replace; boundary=frame"
-    )
+class StreamSubscription:
+    """Yayına abone tek bir istemci - olay döngüsündeki sınırlı kuyruk, doluysa en eski kare atılır"""
 
-@app.get("/heatmap_feed")
-async def heatmap_feed(color_code: str = "MAVI"):
-    """Canlı ısı haritası stream - Delta E görselleştirme"""
-    def generate_heatmap_stream():
-        global uploaded_frame, uploaded_color_code
-        last_sim_time = 0
-        sim_frame = None
-        
-        while True:
-            # Önce yüklenmiş görsel var mı kontrol et
-            if uploaded_frame is not None:
-                frame = uploaded_frame
-                color_code = uploaded_color_code
-            else:
-                frame = get_frame()
-                
-                # Kamera yoksa simülasyon
-                if frame is None:
-                    current_time = time.time()
-                    if sim_frame is None or (current_time - last_sim_time) > 2:
-                        product_code = np.random.choice(list(AYGUN_PRODUCTS.keys()))
-                        c_code = AYGUN_PRODUCTS[product_code]["expected_color"]
-                        sim_frame = create_simulated_image(product_code, c_code)
-                        last_sim_time = current_time
-                    frame = sim_frame
-            
-            if frame is None:
-                time.sleep(0.1)
-                continue
-            
-            # Isı haritası oluştur (şablon olmadan)
-            heatmap = generate_color_heatmap(frame, color_code)
-            
-            if heatmap is not None:
-                ret, buffer = cv2.imencode('.jpg', heatmap, [cv2.IMWRITE_JPEG_QUALITY, 80])
-                frame_bytes = buffer.tobytes()
-                
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            
-            time.sleep(0.1)  # 10 FPS için yeterli
-    
-    return StreamingResponse(
-        generate_heatmap_stream(),
-        media_type="multipart/x-mixed-replace; boundary=frame"
-    )
+    _ids = itertools.count(1)
 
-@app.post("/analyze/upload")
-async def analyze_uploaded_image(file: UploadFile = File(...), product_code: str = "AYG-STR-001"):
-    """Yüklenen görsel üzerinden analiz yap"""
-    global uploaded_frame, uploaded_color_code
-    start_time = time.time()
-    
-    # Görsel oku
-    contents = await file.read()
-    nparr = np.frombuffer(contents, np.uint8)
-    frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    
-    # Yüklenen görseli sakla
-    uploaded_frame = frame.copy() if frame is not None else None
-    
-    if frame is None:
-        raise HTTPException(status_code=400, detail="Görsel okunamadı")
-    
-    # Boyut kontrolü
-    if frame.shape[0] > 1080 or frame.shape[1] > 1920:
-        scale = min(1080 / frame.shape[0], 1920 / frame.shape[1])
-        frame = cv2.resize(frame, None, fx=scale, fy=scale)
+    def __init__(self, loop, max_pending=2):
+        self.id = next(self._ids)
+        self.connected_at = time.time()
+        self.sent = 0
+        self.dropped = 0
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=max_pending)
+
+    def offer(self, data):
+        """Yayın iş parçacığından yeni kare bırak (iş parçacığı güvenli)"""
+        try:
+            self._loop.call_soon_threadsafe(self._put, data)
+        except RuntimeError:
+            pass  # Olay döngüsü kapanmış
+
+    def _put(self, data):
+        # Geri basınç: kuyruk doluysa en eski kare atılır, yayıncı hiç beklemez
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(data)
+
+    async def get(self, timeout=1.0):
+        """Sıradaki kareyi bekle (zaman aşımında None)"""
+        try:
+            data = await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self.sent += 1
+        return data
+
+    def stats(self):
+        return {
+            "id": self.id,
+            "connected_s": round(time.time() - self.connected_at, 1),
+            "sent": self.sent,
+            "dropped": self.dropped
+        }
+
+class MJPEGBroadcaster:
+    """Abone olduğu sürece kaynak üreticiyi tek iş parçacığında çalıştıran ve JPEG baytlarını dağıtan yayıncı"""
+
+    def __init__(self, name, source):
+        self.name = name
+        self.source = source  # Çağrıldığında JPEG baytları üreten bir üreteç döndürür
+        self.frames_encoded = 0
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self, loop):
+        """Yeni abone ekle; ilk abonede yayın iş parçacığı başlar"""
+        subscription = StreamSubscription(loop)
+        with self._lock:
+            self._subscribers[subscription.id] = subscription
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f"colorqc-{self.name}", daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Aboneyi çıkar; abone kalmazsa yayın iş parçacığı kendiliğinden durur"""
+        with self._lock:
+            self._subscribers.pop(subscription.id, None)
+
+    def _run(self):
+        frames = self.source()
+        try:
+            for frame_bytes in frames:
+                with self._lock:
+                    subscribers = list(self._subscribers.values())
+                    if not subscribers:
+                        self._thread = None
+                        return
+                self.frames_encoded += 1
+                for subscription in subscribers:
+                    subscription.offer(frame_bytes)
+        finally:
+            frames.close()
+
+    def stats(self):
+        with self._lock:
+            subscribers = list(self._subscribers.values())
+            running = self._thread is not None and self._thread.is_alive()
+        return {
+            "name": self.name,
+            "running": running,
+            "frames_encoded": self.frames_encoded,
+            "subscribers": [s.stats() for s in subscribers]
+        }
+
+MAX_STREAMS = int(os.environ.get("COLORQC_MAX_STREAMS", 32))
+
+class StreamLimiter:
+    """Eşzamanlı açık akış sayısı sınırı (olay döngüsünde kullanılır)"""
+
+    def __init__(self, max_streams):
+        self.max_streams = max_streams
+        self.active = 0
+        self.rejected = 0
+
+    def acquire(self):
+        """Akış kapasitesi ayır; sınır doluysa 503"""
+        if self.active >= self.max_streams:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Eşzamanlı akış sınırına ulaşıldı",
+                                headers={"Retry-After": "5"})
+        self.active += 1
+
+    def release(self):
+        self.active = max(0, self.active - 1)
+
+stream_limiter = StreamLimiter(MAX_STREAMS)
+
+async def stream_subscription(broadcaster, request=None, target_fps=30):
+    """Yayıncıya abone olup hedef FPS ile multipart JPEG parçaları üreten asenkron istemci üreteci"""
+    loop = asyncio.get_running_loop()
+    subscription = broadcaster.subscribe(loop)
+    min_interval = 1.0 / target_fps if target_fps else 0
+    next_time = loop.time()
+    try:
+        while True:
+            # Kopma normalde StreamingResponse dinleyicisiyle akışı iptal eder; kare gelmediğinde
+            # (zaman aşımı başına en fazla bir kez) ayrıca kontrol edilir
+            frame_bytes = await subscription.get(timeout=1.0)
+            if frame_bytes is None:
+                if request is not None and await request.is_disconnected():
+                    break
+                continue
+            
+            # Hedef FPS: erken gelen karede beklenir, bu sürede gelenlerden en eskisi atılır
+            delay = next_time - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_time = max(next_time, loop.time() - min_interval) + min_interval
+            yield mjpeg_part(frame_bytes)
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+class LimitedStreamingResponse(StreamingResponse):
+    """stream_limiter.acquire() sonrası döndürülen akış - yanıt nasıl biterse bitsin kapasite geri verilir"""
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # Üreteç hiç başlamadan istemci ayrılmış olabilir; aboneliği de kapat
+            await self.body_iterator.aclose()
+            stream_limiter.release()
+
+def generate_video_stream(station, request=None, target_fps=30):
+    """Video stream generator - istasyonun tüm istemcileri tek kodlanmış yayını paylaşır"""
+    return stream_subscription(station.video, request, target_fps)
+
+# ==================== ISI HARİTASI YAYINI ====================
+# Isı haritası (kare sürümü, renk kodu) anahtarıyla bir kez hesaplanıp kodlanır; aynı renk koduna
+# abone tüm istemciler tek yayını paylaşır. Değişmeyen (yüklenmiş) görsel için tek hesaplama yapılır.
+
+class HeatmapCache:
+    """(kare sürümü, renk kodu) anahtarlı, JPEG kodlanmış ısı haritası LRU önbelleği"""
+
+    def __init__(self, max_entries=8):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._pending = {}  # key -> Future - aynı kare için eşzamanlı istemciler tek hesaplamayı bekler
+        self._lock = threading.Lock()  # Yalnızca sözlük okuma/yazma için tutulur
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, frame_key, frame, color_code):
+        """Önbellekteki ısı haritasını döndür; yoksa hesapla, kodla ve sakla"""
+        key = (frame_key, color_code)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                self.misses += 1
+                future = self._pending[key] = Future()
+            else:
+                self.hits += 1
+        if not owner:
+            return future.result()
+        
+        # Hesaplama ve JPEG kodlama kilit dışında: diğer istasyon/renk akışları beklemez
+        try:
+            heatmap = generate_color_heatmap(frame, color_code)
+            _, buffer = cv2.imencode('.jpg', heatmap, [cv2.IMWRITE_JPEG_QUALITY, 80])
+            frame_bytes = buffer.tobytes()
+        except Exception as exc:
+            with self._lock:
+                del self._pending[key]
+            future.set_exception(exc)
+            raise
+        with self._lock:
+            self._entries[key] = frame_bytes
+            del self._pending[key]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        future.set_result(frame_bytes)
+        return frame_bytes
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+class SimulatedFrameSource:
+    """Belirli aralıklarla yenilenen, sürüm numaralı paylaşılan simülasyon karesi"""
+
+    def __init__(self, interval=2.0):
+        self.interval = interval
+        self._version = 0
+        self._frame = None
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def current(self):
+        """(sürüm, kare) - süre dolduysa rastgele ürün için yeni kare üretilir"""
+        with self._lock:
+            if self._frame is None or time.time() - self._created > self.interval:
+                self._frame = synthetic_frames.next_any().frame
+                self._created = time.time()
+                self._version += 1
+            return self._version, self._frame
+
+heatmap_cache = HeatmapCache()
+heatmap_sim_frames = SimulatedFrameSource()
+
+def current_heatmap_source(color_code, station):
+    """Isı haritası için güncel kaynak: (sürüm anahtarı, kare, renk kodu)"""
+    # Önce bu istasyona yüklenmiş görsel var mı kontrol et
+    upload = station.upload
+    if upload is not None:
+        version, frame, upload_color_code = upload
+        return ("upload", version), frame, upload_color_code
+    
+    packet = station.capture.latest()
+    if packet is not None:
+        return ("camera", station.id, packet.seq), packet.frame, color_code
+    
+    # Kamera yoksa simülasyon
+    version, frame = heatmap_sim_frames.current()
+    return ("sim", version), frame, color_code
+
+def generate_heatmap_frames(color_code, station, interval=0.1, keepalive=1.0):
+    """Isı haritası kareleri (JPEG baytları) - yalnızca kare değişince yeniden hesaplanır"""
+    last_key = None
+    last_sent = 0
     
-    if product_code not in AYGUN_PRODUCTS:
+    while True:
+        frame_key, frame, effective_color = current_heatmap_source(color_code, station)
+        cache_key = (frame_key, effective_color)
+        now = time.time()
+        
+        # Değişmeyen kare yalnızca bağlantıyı canlı tutmak için seyrek tekrar gönderilir
+        if cache_key != last_key or now - last_sent >= keepalive:
+            yield heatmap_cache.get(frame_key, frame, effective_color)
+            last_key, last_sent = cache_key, now
+        
+        time.sleep(interval)  # 10 FPS için yeterli
+
+# ==================== KAMERA KAYIT DEFTERİ ====================
+# Her istasyon adlandırılmış bir kaynaktır (cihaz, video dosyası, kayıt, sentetik). İstasyonun kendi
+# çözünürlük/FPS ayarı, yakalama iş parçacığı, video/ısı haritası yayınları, kayıt iş parçacığı ve
+# varsayılan analiz ayarları (ürün, ROI, mod) vardır; sonuçlar camera_id ile etiketlenir ve SPC'de
+# "camera" kapsamında izlenir. Başlangıç istasyonları COLORQC_CAMERAS (JSON) ile verilir, ör.:
+#   {"hat1": {"source": "device", "index": 0, "fps": 15},
+#    "hat2": {"source": "replay", "recording": "vardiya1", "speed": 2, "product_code": "AYG-ORT-002"}}
+
+CAMERA_SOURCES = ("device", "file", "replay", "synthetic")
+DEFAULT_CAMERA_ID = "default"
+CAMERA_DEFAULTS = {"width": 1280, "height": 720, "fps": 30, "speed": 1.0, "loop": True}
+
+class FramePacer:
+    """Sabit aralıklı kare zamanlaması - gecikince beklemeden devam eder, gecikme birikmez"""
+
+    def __init__(self, fps):
+        self.interval = 1.0 / fps if fps and fps > 0 else 0
+        self._next = None
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.perf_counter()
+        if self._next is None or self._next < now - self.interval:
+            self._next = now
+        delay = self._next - now
+        if delay > 0:
+            time.sleep(delay)
+        self._next += self.interval
+
+class VideoFileCapture:
+    """Video dosyasını kamera gibi oynatır - dosyanın FPS değeri x speed (0: azami hız), sonunda başa döner"""
+
+    def __init__(self, path, speed=1.0, loop=True):
+        self._video = cv2.VideoCapture(path)
+        fps = self._video.get(cv2.CAP_PROP_FPS) or RECORDING_NOMINAL_FPS
+        self._pacer = FramePacer(fps * speed if speed > 0 else 0)
+        self.loop = loop
+
+    def isOpened(self):
+        return self._video.isOpened()
+
+    def read(self):
+        ret, frame = self._video.read()
+        if not ret and self.loop:
+            self._video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self._video.read()
+        if ret:
+            self._pacer.wait()
+        return ret, frame
+
+    def release(self):
+        self._video.release()
+
+class SyntheticCapture:
+    """Sentetik kare havuzundan istenen FPS ile kare veren kaynak (ürün verilmezse ürünler sırayla)"""
+
+    def __init__(self, frames, product_code=None, fps=30):
+        self.frames = frames
+        self.product_code = product_code
+        self._pacer = FramePacer(fps)
+        self._open = True
+
+    def isOpened(self):
+        return self._open
+
+    def read(self):
+        if not self._open:
+            return False, None
+        self._pacer.wait()
+        synthetic = self.frames.next_frame(self.product_code) if self.product_code else self.frames.next_any()
+        return True, synthetic.frame
+
+    def release(self):
+        self._open = False
+
+def camera_config(params):
+    """Kaynak ayarlarını doğrula ve varsayılanlarla tamamla (kayıt/dosya adı -> yol)"""
+    config = {**CAMERA_DEFAULTS, **{k: v for k, v in params.items() if v is not None}}
+    source = config.setdefault("source", "device")
+    if source not in CAMERA_SOURCES:
+        raise HTTPException(status_code=400, detail=f"Geçersiz kamera kaynağı: {source}")
+    for key in ("width", "height", "fps"):
+        config[key] = int(config[key])
+        if config[key] <= 0:
+            raise HTTPException(status_code=400, detail=f"Geçersiz {key}: {config[key]}")
+    config["speed"] = max(0.0, float(config["speed"]))
+    if config.get("product_code") is not None and config["product_code"] not in AYGUN_PRODUCTS:
         raise HTTPException(status_code=400, detail="Geçersiz ürün kodu")
+    parse_roi(config.get("roi"))  # Analiz varsayılanlarını doğrula
+    if config.get("mode") is not None and config["mode"] not in ANALYSIS_MODES:
+        raise HTTPException(status_code=400, detail=f"Geçersiz analiz modu: {config['mode']}")
+    if source == "device":
+        config["index"] = int(config.get("index", 0))
+    elif source in ("replay", "file") and "path" not in config:
+        if source == "replay":
+            config["path"] = recording_path(config.get("recording"))
+        else:
+            name = config.get("file") or ""
+            if name.startswith(".") or not is_safe_name(name.replace(".", "_")):
+                raise HTTPException(status_code=400, detail="Geçersiz dosya adı")
+            config["path"] = os.path.join(RECORDING_DIR, config["file"])
+    if "path" in config and not os.path.exists(config["path"]):
+        raise HTTPException(status_code=404, detail="Kaynak dosyası bulunamadı")
+    return config
+
+def camera_source_opener(config):
+    """Ayardan kaynak açan çağrılabilir (CameraCapture.open_source)"""
+    source = config["source"]
+    if source == "device":
+        return lambda: open_video_device(config["index"], config["width"], config["height"], config["fps"])
+    if source == "file":
+        return lambda: VideoFileCapture(config["path"], config["speed"], config["loop"])
+    if source == "replay":
+        return lambda: ReplayCapture(config["path"], config["speed"], config["loop"])
+    seed = config.get("seed", SYNTHETIC_SEED)
+    if (config["width"], config["height"], seed) == (synthetic_frames.width, synthetic_frames.height,
+                                                     synthetic_frames.seed):
+        frames = synthetic_frames  # Aynı çözünürlük ve tohum: paylaşılan havuz
+    else:
+        frames = SyntheticFrameSource(seed, width=config["width"], height=config["height"])
+    return lambda: SyntheticCapture(frames, config.get("product_code"), config["fps"])
+
+class CameraStation:
+    """Adlandırılmış kamera istasyonu: kaynak ayarı, yakalama, yayınlar, kayıt ve analiz varsayılanları"""
+
+    def __init__(self, camera_id, config):
+        self.id = camera_id
+        self.config = config
+        self.capture = CameraCapture(camera_source_opener(config))
+        self.video = MJPEGBroadcaster(f"video-{camera_id}", lambda: generate_video_frames(self))
+        self.recorder = None
+        self.pipeline = None  # Sürekli muayene hattı (/analyze/start)
+        self.upload = None  # (sürüm, kare, renk kodu) - istasyona yüklenen görsel, ısı haritasında önceliklidir
+        self._heatmaps = {}  # renk kodu -> yayıncı
+        self._lock = threading.Lock()
+
+    def configure(self, config):
+        """Kaynağı değiştir - çalışan hat ve yakalama durdurulur, yeniden başlatılması gerekir"""
+        if self.pipeline is not None:
+            self.pipeline.stop()
+        self.capture.stop()
+        self.config = config
+        self.capture.open_source = camera_source_opener(config)
+
+    def heatmap_broadcaster(self, color_code):
+        """Renk kodu başına paylaşılan ısı haritası yayıncısı"""
+        with self._lock:
+            if color_code not in self._heatmaps:
+                self._heatmaps[color_code] = MJPEGBroadcaster(
+                    f"heatmap-{self.id}-{color_code}", lambda: generate_heatmap_frames(color_code, self))
+            return self._heatmaps[color_code]
+
+    def feeds(self):
+        with self._lock:
+            heatmaps = list(self._heatmaps.values())
+        return [self.video.stats()] + [b.stats() for b in heatmaps]
+
+    def analysis_defaults(self):
+        """İstasyonun analiz varsayılanları (istek parametreleri önceliklidir)"""
+        return {key: self.config.get(key) for key in ("product_code", "roi", "mode")}
+
+    def info(self):
+        config = {k: v for k, v in self.config.items() if k != "path"}
+        return {"id": self.id, "config": config, **self.capture.stats(),
+                "analyzing": self.pipeline is not None and self.pipeline.running,
+                "recording": self.recorder.stats() if self.recorder is not None else None}
+
+class CameraRegistry:
+    """camera_id -> istasyon; bilinmeyen kimlik 404"""
+
+    def __init__(self):
+        self._stations = {}
+        self._lock = threading.Lock()
+
+    def get(self, camera_id):
+        station = self._stations.get(camera_id)
+        if station is None:
+            raise HTTPException(status_code=404, detail=f"Kamera bulunamadı: {camera_id}")
+        return station
+
+    def configure(self, camera_id, params):
+        """İstasyon ekle veya mevcut istasyonun kaynağını değiştir"""
+        if not is_safe_name(camera_id):
+            raise HTTPException(status_code=400, detail="Geçersiz kamera kimliği")
+        config = camera_config(params)
+        with self._lock:
+            station = self._stations.get(camera_id)
+            if station is None:
+                station = self._stations[camera_id] = CameraStation(camera_id, config)
+                return station
+        station.configure(config)
+        return station
+
+    def remove(self, camera_id):
+        """İstasyonu durdur ve kaldır (varsayılan istasyon kaldırılamaz)"""
+        if camera_id == DEFAULT_CAMERA_ID:
+            raise HTTPException(status_code=409, detail="Varsayılan kamera kaldırılamaz")
+        with self._lock:
+            station = self.get(camera_id)
+            del self._stations[camera_id]
+        if station.recorder is not None:
+            station.recorder.stop()
+        if station.pipeline is not None:
+            station.pipeline.stop()
+        station.capture.stop()
+
+    def stations(self):
+        with self._lock:
+            return list(self._stations.values())
+
+camera_registry = CameraRegistry()
+camera_registry.configure(DEFAULT_CAMERA_ID, {"source": "device", "index": 0})
+for _camera_id, _params in json.loads(os.environ.get("COLORQC_CAMERAS", "{}")).items():
+    try:
+        camera_registry.configure(_camera_id, _params)
+    except HTTPException as exc:
+        raise ValueError(f"COLORQC_CAMERAS[{_camera_id}]: {exc.detail}") from None
+
+def init_camera(camera_id=DEFAULT_CAMERA_ID):
+    """Kamerayı başlat"""
+    return camera_registry.get(camera_id).capture.start()
+
+def release_camera(camera_id=DEFAULT_CAMERA_ID):
+    """Kamerayı serbest bırak"""
+    camera_registry.get(camera_id).capture.stop()
+
+def get_frame(camera_id=DEFAULT_CAMERA_ID):
+    """Kameradan kare al (en son yakalanan karenin kopyası)"""
+    packet = camera_registry.get(camera_id).capture.latest()
+    return packet.frame.copy() if packet is not None else None
+
+# ==================== ANALİZ YÜRÜTÜCÜSÜ ====================
+# CPU yoğun analizler olay döngüsünü bloklamaması için sınırlı bir iş parçacığı havuzunda çalışır.
+# OpenCV/NumPy GIL'i bıraktığından bağımsız aşamalar ayrı bir havuzda eşzamanlı yürütülür.
+
+ANALYSIS_WORKERS = int(os.environ.get("COLORQC_ANALYSIS_WORKERS", os.cpu_count() or 4))
+ANALYSIS_QUEUE_DEPTH = int(os.environ.get("COLORQC_ANALYSIS_QUEUE_DEPTH", 16))
+STAGE_WORKERS = int(os.environ.get("COLORQC_STAGE_WORKERS", os.cpu_count() or 4))
+
+class AnalysisExecutor:
+    """Sınırlı analiz havuzu - çalışan + kuyruktaki iş sayısı kapasiteyi aşarsa yeni istekleri reddeder"""
+
+    def __init__(self, workers, queue_depth, stage_workers):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.capacity = workers + queue_depth
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="colorqc-analyze")
+        # Aşama havuzu ayrıdır: analiz işçileri aşamaları bekler, aşamalar yeni iş göndermez (kilitlenme yok)
+        self._stage_pool = (ThreadPoolExecutor(max_workers=stage_workers, thread_name_prefix="colorqc-stage")
+                            if stage_workers > 1 else None)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _release(self, _future):
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+
+    def submit(self, fn, *args, **kwargs):
+        """İşi havuza gönder (concurrent.futures.Future); kapasite doluysa 503 döndür"""
+        with self._lock:
+            if self.in_flight >= self.capacity:
+                self.rejected += 1
+                raise HTTPException(status_code=503, detail="Analiz kuyruğu dolu, lütfen tekrar deneyin",
+                                    headers={"Retry-After": "1"})
+            self.in_flight += 1
+        try:
+            future = self._pool.submit(fn, *args, **kwargs)
+        except Exception:
+            with self._lock:
+                self.in_flight -= 1
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        """İşi havuzda çalıştır ve sonucunu olay döngüsünü bloklamadan bekle"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def run_stages(self, stages):
+        """Bağımsız aşamaları eşzamanlı çalıştır: {ad: çağrılabilir} -> {ad: sonuç}"""
+        if self._stage_pool is None or len(stages) <= 1:
+            return {name: fn() for name, fn in stages.items()}
+        futures = {name: self._stage_pool.submit(fn) for name, fn in stages.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_depth": self.queue_depth,
+                "in_flight": self.in_flight,
+                "queued": max(0, self.in_flight - self.workers),
+                "completed": self.completed,
+                "rejected": self.rejected
+            }
+
+analysis_executor = AnalysisExecutor(ANALYSIS_WORKERS, ANALYSIS_QUEUE_DEPTH, STAGE_WORKERS)
+
+def encode_jpeg(img, quality=85):
+    """Görüntüyü JPEG baytlarına kodla"""
+    if img is None:
+        return None
+    _, buffer = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes()
+
+def timed(timings, name, fn):
+    """fn'i çalıştırıp süresini timings[name] (ms) olarak kaydeden sarmalayıcı"""
+    def run():
+        start = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            timings[name] = round((time.perf_counter() - start) * 1000, 2)
+    return run
+
+def get_tolerance(product, color_standard):
+    """Ürün kalite seviyesine göre ΔE toleransı"""
+    quality_level = product["quality_level"]
+    if quality_level == "premium":
+        return color_standard["tolerance_premium"]
+    elif quality_level == "standard":
+        return color_standard["tolerance_standard"]
+    return color_standard["tolerance_functional"]
+
+def run_analysis(frame, product_code, include_images=True, defer_images=False, roi=None, mode=None,
+                 timings=None):
+    """Tek bir kare için tam analiz (renk, parlaklık, kusur, yüzey, görseller) - senkron çalışır
+
+    include_images: True/False veya üretilecek görsel adları. defer_images ise üretilmeyen
+    görseller için durum saklanır ve sonuçta tembel üretim URL'leri döner.
+    roi: oransal analiz bölgesi (verilmezse ürünün "roi" ayarı); mode: "full" veya "pyramid".
+    timings: önceki adımların (ör. decode) süreleri; aşama süreleri de buraya eklenir (ms).
+    """
+    start_time = time.perf_counter()
+    timings = {} if timings is None else timings
+    # Çözme/yakalama gibi önceki adımlar da toplam süreye dahil edilir
+    prior_ms = sum(timings.values())
     
     product = AYGUN_PRODUCTS[product_code]
     color_code = product["expected_color"]
-    uploaded_color_code = color_code  # Renk kodunu sakla
     color_standard = AYGUN_COLOR_STANDARDS[color_code]
-    
-    original_frame = frame.copy()
-    
-    # Renk analizi
-    measured_lab = analyze_color_region(frame, color_code)
     reference_lab = color_standard["lab_reference"]
+    tolerance = get_tolerance(product, color_standard)
+    
+    if include_images is True:
+        include_images = IMAGE_RESULT_KEYS
+    include = set(include_images or ())
+    
+    # Kareden türetilen düzlemler tüm aşamalarda paylaşılır
+    ctx = FrameContext(frame)
+    session = RenderSession(ctx, color_code, product["name"])
+    
+    # Aşama görünümleri: önce ROI kırpılır, piramit seviyeleri kırpılmış bölgeden bir kez üretilir
+    mode = mode or ANALYSIS_MODE
+    levels = ANALYSIS_MODES[mode]
+    roi = roi or product.get("roi")
+    rect = roi_rect(roi, frame.shape) if roi else None
+    base = ctx.crop(rect) if rect else ctx
+    origin = rect[:2] if rect else (0, 0)
+    views = {stage: base.pyramid_level(level) for stage, level in levels.items()}
+    scales = {stage: 2 ** level for stage, level in levels.items()}
+    
+    # 1. grup: birbirinden bağımsız analiz ve görselleştirme aşamaları
+    stages = {
+        "measured_lab": timed(timings, "color", lambda: analyze_color_region(
+            views["color"], color_code, center_crop=rect is None)),
+        "gloss": timed(timings, "gloss", lambda: calculate_gloss(views["gloss"])),
+        "defects": timed(timings, "defects", lambda: detect_surface_defects(
+            views["defects"], scales["defects"], origin)),
+        "surface_quality": timed(timings, "surface", lambda: analyze_surface_quality(views["surface"])),
+        "color_consistency": timed(timings, "consistency", lambda: analyze_color_consistency(
+            views["consistency"], color_code, scales["consistency"], origin))
+    }
+    for name in ("color_heatmap", "gloss_map"):
+        if name in include:
+            stages[name] = functools.partial(session.render, name, timings)
+    results = analysis_executor.run_stages(stages)
+    measured_lab = results["measured_lab"]
+    gloss = results["gloss"]
+    defects = results["defects"]
+    
+    # Delta E ve tolerans kontrolü
     delta_e = calculate_delta_e_2000(measured_lab, reference_lab)
     
-    # Tolerans kontrolü
-    quality_level = product["quality_level"]
-    if quality_level == "premium":
-        tolerance = color_standard["tolerance_premium"]
-    elif quality_level == "standard":
-        tolerance = color_standard["tolerance_standard"]
-    else:
-        tolerance = color_standard["tolerance_functional"]
-    
     if delta_e <= tolerance:
         delta_e_status = "UYGUN"
         color_status = "GECTI"
@@ -949,12 +2501,12 @@ async def analyze_uploaded_image(file: UploadFile = File(...), product_code: str
         delta_e_status = "UYGUNSUZ"
         color_status = "KALDI"
     
-    # Parlaklık analizi
-    gloss = calculate_gloss(frame)
-    gloss_status = "GECTI" if product["gloss_min"] <= gloss <= product["gloss_max"] else "KALDI"
+    # Parlaklık kontrolü
+    if product["gloss_min"] <= gloss <= product["gloss_max"]:
+        gloss_status = "GECTI"
+    else:
+        gloss_status = "KALDI"
     
-    # Kusur tespiti
-    defects = detect_surface_defects(frame)
     critical_defects = [d for d in defects if d["severity"] == "critical"]
     
     # Genel karar
@@ -965,37 +2517,32 @@ async def analyze_uploaded_image(file: UploadFile = File(...), product_code: str
     else:
         overall_status = "ONAY"
     
-    processing_time = (time.time() - start_time) * 1000
-    
-    # Gelişmiş parametreleri hesapla
-    advanced_params = calculate_advanced_parameters(original_frame, defects, delta_e)
-    
-    # Problem 2: Yüzey kalitesi ve renk tutarlılığı analizi
-    surface_quality = analyze_surface_quality(original_frame)
-    color_consistency = analyze_color_consistency(original_frame, color_code)
+    # Öneri oluştur
+    recommendations = []
+    if delta_e > tolerance:
+        recommendations.append(f"Renk sapması yüksek (ΔE={delta_e}). Eloksal banyosu kontrol edilmeli.")
+    if gloss_status == "KALDI":
+        recommendations.append(f"Parlaklık değeri ({gloss} GU) tolerans dışı. Yüzey işlemi gözden geçirilmeli.")
+    if len(defects) > 0:
+        recommendations.append(f"{len(defects)} adet yüzey kusuru tespit edildi.")
     
-    # Görseller oluştur
-    annotated_image = draw_defects_on_image(original_frame, defects, color_status, product["name"])
-    color_heatmap = generate_color_heatmap(original_frame, color_code)
-    gloss_map = generate_gloss_map(original_frame)
-    defect_heatmap = generate_defect_heatmap(original_frame, defects)
+    recommendation = " | ".join(recommendations) if recommendations else "Ürün kalite standartlarına uygun."
     
-    # Base64'e çevir
-    def to_base64(img):
-        if img is None: return None
-        _, buffer = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 90])
-        return base64.b64encode(buffer).decode('utf-8')
+    # 2. grup: kusur listesine ve ΔE'ye bağlı aşamalar
+    session.defects = defects
+    session.color_status = color_status
+    stages = {"advanced_parameters": timed(timings, "advanced", lambda: calculate_advanced_parameters(
+        views["advanced"], defects, delta_e))}
+    for name in ("annotated_image", "defect_heatmap"):
+        if name in include:
+            stages[name] = functools.partial(session.render, name, timings)
+    results.update(analysis_executor.run_stages(stages))
     
-    return {
+    result = {
         "product_code": product_code,
         "product_name": product["name"],
         "expected_color": color_standard["name"],
         "timestamp": datetime.now().isoformat(),
-        "source": "upload",
-        "filename": file.filename,
-        "advanced_parameters": advanced_params,
-        "surface_quality": surface_quality,
-        "color_consistency": color_consistency,
         "measured_lab": {k: round(v, 2) for k, v in measured_lab.items()},
         "reference_lab": reference_lab,
         "delta_e": delta_e,
@@ -1009,13 +2556,1860 @@ async def analyze_uploaded_image(file: UploadFile = File(...), product_code: str
         "defect_count": len(defects),
         "overall_status": overall_status,
         "confidence": round(95 - delta_e * 2 - len(defects) * 2, 1),
-        "processing_time_ms": round(processing_time, 1),
-        "annotated_image": to_base64(annotated_image),
-        "color_heatmap": to_base64(color_heatmap),
-        "gloss_map": to_base64(gloss_map),
-        "defect_heatmap": to_base64(defect_heatmap)
+        "processing_time_ms": None,  # Aşağıda, tüm aşamalar bittikten sonra
+        "recommendation": recommendation,
+        "advanced_parameters": results["advanced_parameters"],
+        "surface_quality": results["surface_quality"],
+        "color_consistency": results["color_consistency"],
+        "gloss_zone_stats": summarize_gloss_field(views["gloss"].gloss_grid()),
+        "analysis_view": {
+            "mode": mode,
+            "roi": dict(zip(("x", "y", "w", "h"), rect)) if rect else None,
+            "levels": levels
+        },
+        "annotated_image": results.get("annotated_image"),
+        "color_heatmap": results.get("color_heatmap"),
+        "gloss_map": results.get("gloss_map"),
+        "defect_heatmap": results.get("defect_heatmap")
+    }
+    
+    deferred = [name for name in IMAGE_RESULT_KEYS if name not in include]
+    if defer_images and deferred:
+        # Oturumda yalnızca kare ve tam kare parlaklık grid'i (tam/ROI'siz modda hesaplandıysa) tutulur;
+        # Lab/gradyan düzlemleri ve yoğun harita bırakılır
+        session.ctx = ctx.retain("gloss_grid")
+        analysis_id = render_sessions.register(session)
+        result["analysis_id"] = analysis_id
+        for name in deferred:
+            result[name] = f"/analysis/{analysis_id}/artifacts/{name}"
+    
+    # Toplam süre: önceki adımlar + analiz + istenen görsellerin üretimi ve kodlanması
+    result["processing_time_ms"] = round(prior_ms + (time.perf_counter() - start_time) * 1000, 1)
+    result["stage_timings_ms"] = dict(timings)
+    return result
+
+def decode_upload(contents):
+    """Yüklenen dosya içeriğini BGR kareye çevir (okunamazsa None)"""
+    nparr = np.frombuffer(contents, np.uint8)
+    return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+def limit_frame_size(frame, max_height=1080, max_width=1920):
+    """Analiz için kareyi en fazla 1920x1080 boyutuna küçült"""
+    if frame.shape[0] > max_height or frame.shape[1] > max_width:
+        scale = min(max_height / frame.shape[0], max_width / frame.shape[1])
+        frame = cv2.resize(frame, None, fx=scale, fy=scale)
+    return frame
+
+def analyze_upload_contents(contents, product_code, **options):
+    """Yüklenen görseli çöz ve analiz et - (çözülen kare, sonuç) döndürür (seçenekler: run_analysis)"""
+    timings = {}
+    frame = timed(timings, "decode", lambda: decode_upload(contents))()
+    if frame is None:
+        raise HTTPException(status_code=400, detail="Görsel okunamadı")
+    return frame, run_analysis(limit_frame_size(frame), product_code, timings=timings, **options)
+
+def capture_and_analyze(product_code, camera_id=DEFAULT_CAMERA_ID, **options):
+    """İstasyon kamerasından kare al (yoksa simülasyon) ve analiz et"""
+    timings = {}
+    start = time.perf_counter()
+    frame = get_frame(camera_id)
+    
+    # Kamera yoksa sentetik havuzdan kare al (kopyasız, ölçüm doğrusu ile)
+    synthetic = None
+    if frame is None:
+        synthetic = synthetic_frames.next_frame(product_code)
+        frame = synthetic.frame
+    timings["capture"] = round((time.perf_counter() - start) * 1000, 2)
+    
+    result = run_analysis(frame, product_code, timings=timings, **options)
+    result["camera_id"] = camera_id
+    if synthetic is not None:
+        result["ground_truth"] = synthetic.truth
+    return result
+
+# ==================== ANALİZ ÇIKTILARI (ARTIFACT) ====================
+# Görseller JSON içinde base64 yerine içerik adresli (SHA-256) bir önbellekte tutulur ve
+# /artifacts/{id} üzerinden ham image/jpeg olarak sunulur. Bellek dolunca en eski
+# çıktılar diske taşınır; disk de sınırlıdır ve en eski dosyalar silinir.
+
+ARTIFACT_DIR = os.environ.get("COLORQC_ARTIFACT_DIR",
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), "artifacts"))
+ARTIFACT_MEMORY_BYTES = int(os.environ.get("COLORQC_ARTIFACT_MEMORY_MB", "64")) * 1024 * 1024
+ARTIFACT_DISK_BYTES = int(os.environ.get("COLORQC_ARTIFACT_DISK_MB", "512")) * 1024 * 1024
+ARTIFACT_ID_LENGTH = 32
+IMAGE_RESULT_KEYS = ["annotated_image", "color_heatmap", "gloss_map", "defect_heatmap"]
+
+class ArtifactStore:
+    """Boyutu sınırlı, içerik adresli bellek + disk önbelleği (LRU)"""
+
+    def __init__(self, memory_bytes, disk_bytes=0, directory=None):
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes if directory else 0
+        self.directory = directory
+        self._memory = OrderedDict()  # id -> bytes
+        self._memory_size = 0
+        self._disk = None  # id -> boyut, ilk taşımada dizin taranır
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def artifact_id(data):
+        return hashlib.sha256(data).hexdigest()[:ARTIFACT_ID_LENGTH]
+
+    def _path(self, artifact_id):
+        return os.path.join(self.directory, artifact_id + ".jpg")
+
+    def _disk_index(self):
+        """Disk dizinini (önceki çalıştırmalardan kalanlar dahil) eskiden yeniye indeksle"""
+        if self._disk is None:
+            self._disk = OrderedDict()
+            os.makedirs(self.directory, exist_ok=True)
+            entries = sorted((e for e in os.scandir(self.directory) if e.name.endswith(".jpg")),
+                             key=lambda e: e.stat().st_mtime)
+            for entry in entries:
+                size = entry.stat().st_size
+                self._disk[entry.name[:-4]] = size
+                self._disk_size += size
+        return self._disk
+
+    def _spill(self, artifact_id, data):
+        """Bellekten düşen çıktıyı diske yaz, disk sınırını koru"""
+        if not self.disk_bytes or len(data) > self.disk_bytes:
+            return
+        disk = self._disk_index()
+        if artifact_id in disk:
+            disk.move_to_end(artifact_id)
+            return
+        path = self._path(artifact_id)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        disk[artifact_id] = len(data)
+        self._disk_size += len(data)
+        while self._disk_size > self.disk_bytes:
+            old_id, size = disk.popitem(last=False)
+            self._disk_size -= size
+            try:
+                os.remove(self._path(old_id))
+            except OSError:
+                pass
+
+    def _remember(self, artifact_id, data):
+        if artifact_id in self._memory:
+            self._memory.move_to_end(artifact_id)
+            return
+        self._memory[artifact_id] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes and len(self._memory) > 1:
+            old_id, old_data = self._memory.popitem(last=False)
+            self._memory_size -= len(old_data)
+            self._spill(old_id, old_data)
+
+    def put(self, data):
+        """Çıktıyı sakla ve içerik kimliğini döndür (aynı içerik tek kez saklanır)"""
+        data = bytes(data)
+        artifact_id = self.artifact_id(data)
+        with self._lock:
+            self._remember(artifact_id, data)
+        return artifact_id
+
+    def get(self, artifact_id):
+        """Çıktı baytları - bellekte yoksa diskten okunup belleğe alınır; yoksa None"""
+        with self._lock:
+            data = self._memory.get(artifact_id)
+            if data is not None:
+                self._memory.move_to_end(artifact_id)
+                self.hits += 1
+                return data
+            if self.disk_bytes and artifact_id in self._disk_index():
+                try:
+                    with open(self._path(artifact_id), "rb") as f:
+                        data = f.read()
+                except OSError:
+                    self._disk_size -= self._disk.pop(artifact_id)
+                else:
+                    self.hits += 1
+                    self._remember(artifact_id, data)
+                    return data
+            self.misses += 1
+            return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "memory_items": len(self._memory),
+                "memory_bytes": self._memory_size,
+                "memory_limit_bytes": self.memory_bytes,
+                "disk_items": len(self._disk) if self._disk is not None else 0,
+                "disk_bytes": self._disk_size,
+                "disk_limit_bytes": self.disk_bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+artifact_store = ArtifactStore(ARTIFACT_MEMORY_BYTES, ARTIFACT_DISK_BYTES, ARTIFACT_DIR)
+
+def publish_artifacts(result):
+    """Sonuçtaki JPEG baytlarını önbelleğe al, yerlerine /artifacts URL'lerini koy"""
+    artifacts = {}
+    for key in IMAGE_RESULT_KEYS:
+        data = result.get(key)
+        if isinstance(data, (bytes, bytearray)):
+            artifacts[key] = artifact_store.put(data)
+            result[key] = f"/artifacts/{artifacts[key]}"
+    result["artifacts"] = artifacts
+    return result
+
+# Görseller istenmediğinde analiz durumu (kare + ara sonuçlar) bir oturumda tutulur;
+# /analysis/{id}/artifacts/{ad} ilk istendiğinde görsel analizi tekrarlamadan üretilir.
+
+RENDER_SESSION_CAPACITY = int(os.environ.get("COLORQC_RENDER_SESSIONS", "16"))
+
+# ad -> (görsel üretici, JPEG kalitesi)
+IMAGE_RENDERERS = {
+    "color_heatmap": (lambda s: generate_color_heatmap(s.ctx, s.color_code), 85),
+    "gloss_map": (lambda s: generate_gloss_map(s.ctx), 85),
+    "annotated_image": (lambda s: draw_defects_on_image(s.ctx, s.defects, s.color_status, s.product_name), 90),
+    "defect_heatmap": (lambda s: generate_defect_heatmap(s.ctx, s.defects), 85)
+}
+
+class RenderSession:
+    """Bir analizin görsellerini üretmek için gereken durum"""
+
+    def __init__(self, ctx, color_code, product_name):
+        self.ctx = ctx
+        self.color_code = color_code
+        self.product_name = product_name
+        self.defects = None
+        self.color_status = None
+        self.artifacts = {}  # ad -> artifact id
+        self._locks = {name: threading.Lock() for name in IMAGE_RENDERERS}
+
+    def render(self, name, timings=None):
+        """Görseli üret ve JPEG baytlarına kodla - render_/encode_ süreleri timings'e yazılır (ms)"""
+        generate, quality = IMAGE_RENDERERS[name]
+        start = time.perf_counter()
+        image = generate(self)
+        rendered = time.perf_counter()
+        data = encode_jpeg(image, quality)
+        if timings is not None:
+            timings[f"render_{name}"] = round((rendered - start) * 1000, 2)
+            timings[f"encode_{name}"] = round((time.perf_counter() - rendered) * 1000, 2)
+        return data
+
+    def artifact(self, name):
+        """Görseli (gerekirse üretip) önbelleğe al - (artifact id, baytlar)"""
+        with self._locks[name]:
+            artifact_id = self.artifacts.get(name)
+            data = artifact_store.get(artifact_id) if artifact_id else None
+            if data is None:
+                timings = {}
+                data = self.render(name, timings)
+                observe_stage_timings(timings)
+                artifact_id = artifact_store.put(data)
+                self.artifacts[name] = artifact_id
+            return artifact_id, data
+
+class RenderSessionCache:
+    """Son analizlerin görselleştirme oturumları (LRU, sınırlı)"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, session):
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._sessions[session_id] = session
+            while len(self._sessions) > self.capacity:
+                self._sessions.popitem(last=False)
+        return session_id
+
+    def get(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def __len__(self):
+        return len(self._sessions)
+
+render_sessions = RenderSessionCache(RENDER_SESSION_CAPACITY)
+
+def parse_include(include):
+    """include= parametresi: "all", "none" veya virgülle ayrılmış görsel adları"""
+    if include is None or include.strip() in ("", "none"):
+        return set()
+    if include.strip() == "all":
+        return set(IMAGE_RESULT_KEYS)
+    names = {name.strip() for name in include.split(",") if name.strip()}
+    unknown = names - set(IMAGE_RESULT_KEYS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Geçersiz görsel adı: {', '.join(sorted(unknown))}")
+    return names
+
+def parse_analysis_options(include, roi, mode):
+    """Analiz uç noktalarının ortak sorgu parametreleri -> run_analysis seçenekleri"""
+    if mode is not None and mode not in ANALYSIS_MODES:
+        raise HTTPException(status_code=400, detail=f"Geçersiz analiz modu: {mode}")
+    return {"include_images": parse_include(include), "defer_images": True,
+            "roi": parse_roi(roi), "mode": mode}
+
+def artifact_response(artifact_id, data, request):
+    """Ham JPEG yanıtı - ETag eşleşirse 304"""
+    etag = f'"{artifact_id}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type="image/jpeg", headers=headers)
+
+# ==================== TOPLU ANALİZ (SÜREÇ HAVUZU) ====================
+# Toplu analizler GIL'den bağımsız olarak ayrı süreçlerde çalışır. Kamera ana süreçtedir;
+# kareler ana süreçte alınıp işçilere gönderilir, kamera yoksa işçi simülasyon üretir.
+
+BATCH_WORKERS = int(os.environ.get("COLORQC_BATCH_WORKERS", os.cpu_count() or 4))
+
+batch_pool = None
+batch_pool_lock = threading.Lock()
+
+def _init_batch_worker():
+    """İşçi süreç başlangıcı - süreçler zaten paralel, aşamalar sıralı çalışır"""
+    global analysis_executor
+    analysis_executor = AnalysisExecutor(1, 0, 1)
+
+def _batch_worker(frame, product_code, include_images, pool_index):
+    """İşçi süreçte tek bir toplu analiz öğesi - kare yoksa ana süreçte seçilen havuz karesi kullanılır"""
+    timings = {}
+    synthetic = None
+    if frame is None:
+        synthetic = timed(timings, "capture", lambda: synthetic_frames.frame_at(product_code, pool_index))()
+        frame = synthetic.frame
+    result = run_analysis(frame, product_code, include_images=include_images, timings=timings)
+    if synthetic is not None:
+        result["ground_truth"] = synthetic.truth
+    return result
+
+def _upload_worker(contents, product_code, options):
+    """İşçi süreçte yüklenen tek bir görseli çöz ve analiz et"""
+    timings = {}
+    frame = timed(timings, "decode", lambda: decode_upload(contents))()
+    if frame is None:
+        return {"product_code": product_code, "error": "Görsel okunamadı"}
+    return run_analysis(limit_frame_size(frame), product_code, timings=timings, **options)
+
+# Toplu analiz işçilerini işaretler. Ortam değişkeni spawn ile başlayan işçilere devredilir ve modül
+# işçide yeniden içe aktarılırken okunur (initializer içe aktarmadan sonra çalıştığı için geç kalır).
+# uvicorn --workers/--reload süreçleri bu havuzdan başlamadığından işaretlenmez.
+BATCH_WORKER_ENV = "COLORQC_BATCH_WORKER"
+IS_BATCH_WORKER = os.environ.get(BATCH_WORKER_ENV) == "1"
+
+def get_batch_pool():
+    """Toplu analiz süreç havuzunu ilk kullanımda oluştur"""
+    global batch_pool
+    with batch_pool_lock:
+        if batch_pool is None:
+            os.environ[BATCH_WORKER_ENV] = "1"  # Ana süreç modülü zaten yükledi; yalnızca işçiler etkilenir
+            # fork yerine spawn: ana süreçteki iş parçacığı havuzları işçilere kopyalanmaz
+            batch_pool = ProcessPoolExecutor(max_workers=BATCH_WORKERS,
+                                             mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_init_batch_worker)
+        return batch_pool
+
+BATCH_POOL_BROKEN = "Toplu analiz süreç havuzu beklenmedik şekilde kapandı"
+
+def reset_batch_pool():
+    """Bozulan süreç havuzunu at (bir sonraki kullanımda yeniden oluşturulur)"""
+    global batch_pool
+    with batch_pool_lock:
+        if batch_pool is not None:
+            batch_pool.shutdown(wait=False, cancel_futures=True)
+            batch_pool = None
+
+async def iter_pool_results(jobs, workers):
+    """(anahtar, fonksiyon, argümanlar) işlerini süreç havuzuna dağıt, (anahtar, sonuç) çiftlerini
+    tamamlanma sırasıyla üret. İşler async yineleyiciden ihtiyaç oldukça çekilir; aynı anda en
+    fazla 'workers' iş bellekte/işçilerde bulunur. Havuz çökerse sıfırlanır ve BrokenProcessPool
+    çağırana iletilir (akış başladıysa HTTP durum kodu artık değiştirilemez)."""
+    pool = get_batch_pool()
+    workers = max(1, min(workers, BATCH_WORKERS))
+    jobs = jobs.__aiter__()
+    pending = {}
+    exhausted = False
+    
+    while not exhausted or pending:
+        while not exhausted and len(pending) < workers:
+            try:
+                key, fn, args = await jobs.__anext__()
+            except StopAsyncIteration:
+                exhausted = True
+                break
+            pending[asyncio.wrap_future(pool.submit(fn, *args))] = key
+        if not pending:
+            break
+        
+        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            key = pending.pop(future)
+            try:
+                yield key, future.result()
+            except BrokenProcessPool:
+                reset_batch_pool()
+                raise
+            except Exception as exc:
+                yield key, {"error": str(exc)}
+
+BATCH_FRAME_TIMEOUT = 1.0  # Kamera çalışırken her iş için yeni kare bekleme süresi (sn)
+
+async def iter_batch_results(product_codes, workers, include_images):
+    """Simülasyon/kamera toplu analizi - sonuçları tamamlanma sırasıyla üret
+
+    Kamera çalışıyorsa her iş bir öncekinden yeni bir kareyi analiz eder (aynı kare iki kez
+    gönderilmez); kamera yoksa veya yeni kare zamanında gelmezse işçi simülasyon havuzundan kare alır.
+    Havuz indeksi ana süreçte seçilir: her işçinin kendi imleci olsaydı işçiler aynı kareleri analiz ederdi.
+    """
+    capture = camera_registry.get(DEFAULT_CAMERA_ID).capture
+    
+    async def jobs():
+        last_seq = 0
+        for index, code in enumerate(product_codes):
+            frame = None
+            if capture.running:
+                packet = await asyncio.to_thread(capture.wait_for_frame, last_seq, BATCH_FRAME_TIMEOUT)
+                if packet is not None:
+                    last_seq = packet.seq
+                    frame = packet.frame
+            pool_index = synthetic_frames.next_index(code) if frame is None else None
+            yield (index, code), _batch_worker, (frame, code, include_images, pool_index)
+    
+    async for (index, code), result in iter_pool_results(jobs(), workers):
+        if "error" in result:
+            result = {"product_code": code, **result}
+        yield index, result
+
+def ndjson_line(obj):
+    """Tek satırlık JSON (NDJSON akışları için)"""
+    return json.dumps(jsonable_encoder(obj), ensure_ascii=False) + "\n"
+
+class BatchSummary:
+    """Toplu analiz özeti ve verim (öğe/sn) - sonuçlar saklanmadan artımlı güncellenir"""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.count = 0
+        self.completed = 0
+        self.status_counts = {"ONAY": 0, "INCELEME": 0, "RED": 0}
+
+    def add(self, result):
+        self.count += 1
+        if "error" not in result:
+            self.completed += 1
+            self.status_counts[result["overall_status"]] = self.status_counts.get(result["overall_status"], 0) + 1
+
+    def as_dict(self, elapsed):
+        return {
+            "count": self.count,
+            "completed": self.completed,
+            "failed": self.count - self.completed,
+            "workers": self.workers,
+            "elapsed_s": round(elapsed, 3),
+            "throughput_items_per_s": round(self.completed / elapsed, 2) if elapsed > 0 else 0.0,
+            "status_counts": dict(self.status_counts)
+        }
+
+# ==================== TOPLU GÖRSEL YÜKLEME ====================
+# Çok sayıda dosya veya zip/tar arşivi tek istekte analiz edilir. Dosyalar (arşiv üyeleri dahil)
+# teker teker okunur ve sıkıştırılmış halleriyle işçilere gönderilir; bellekte en fazla
+# 'workers' görsel bulunur. İstasyonlara yüklenen tekil görsel (CameraStation.upload) değiştirilmez.
+
+UPLOAD_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+UPLOAD_MAX_IMAGE_BYTES = int(os.environ.get("COLORQC_UPLOAD_MAX_IMAGE_MB", "50")) * 1024 * 1024
+
+def iter_upload_images(files):
+    """Yüklenen dosyalardan (ad, içerik veya hata) üret - zip/tar arşivleri üye üye açılır"""
+    for upload in files:
+        name = upload.filename or "upload"
+        lower = name.lower()
+        if lower.endswith(".zip"):
+            try:
+                archive = zipfile.ZipFile(upload.file)
+            except zipfile.BadZipFile:
+                yield name, None, "Arşiv okunamadı"
+                continue
+            with archive:
+                for info in archive.infolist():
+                    if info.is_dir() or not info.filename.lower().endswith(UPLOAD_IMAGE_EXTENSIONS):
+                        continue
+                    if info.file_size > UPLOAD_MAX_IMAGE_BYTES:
+                        yield f"{name}/{info.filename}", None, "Görsel boyut sınırını aşıyor"
+                        continue
+                    yield f"{name}/{info.filename}", archive.read(info), None
+        elif lower.endswith((".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")):
+            try:
+                archive = tarfile.open(fileobj=upload.file, mode="r|*")
+            except tarfile.TarError:
+                yield name, None, "Arşiv okunamadı"
+                continue
+            with archive:
+                # Akış kipi: üyeler arşiv baştan sona bir kez okunarak sırayla açılır
+                for member in archive:
+                    if not member.isfile() or not member.name.lower().endswith(UPLOAD_IMAGE_EXTENSIONS):
+                        continue
+                    if member.size > UPLOAD_MAX_IMAGE_BYTES:
+                        yield f"{name}/{member.name}", None, "Görsel boyut sınırını aşıyor"
+                        continue
+                    yield f"{name}/{member.name}", archive.extractfile(member).read(), None
+        else:
+            contents = upload.file.read(UPLOAD_MAX_IMAGE_BYTES + 1)
+            if len(contents) > UPLOAD_MAX_IMAGE_BYTES:
+                yield name, None, "Görsel boyut sınırını aşıyor"
+            else:
+                yield name, contents, None
+
+async def iter_upload_results(files, product_code, workers, options):
+    """Yüklenen görselleri işçilere dağıt, (sıra, dosya adı, sonuç) üçlülerini tamamlanma sırasıyla üret"""
+    images = iter_upload_images(files)
+    index = itertools.count()
+    failures = deque()
+    
+    async def jobs():
+        while True:
+            # Dosya/arşiv okuma engelleyici G/Ç'dir; olay döngüsünün dışında yapılır
+            item = await asyncio.to_thread(next, images, None)
+            if item is None:
+                return
+            name, contents, error = item
+            if error is not None:
+                failures.append((next(index), name, error))
+                continue
+            yield (next(index), name), _upload_worker, (contents, product_code, options)
+    
+    async for (i, name), result in iter_pool_results(jobs(), workers):
+        while failures:
+            j, failed_name, error = failures.popleft()
+            yield j, failed_name, {"product_code": product_code, "error": error}
+        if "error" in result:
+            result = {"product_code": product_code, **result}
+        yield i, name, result
+    while failures:
+        j, failed_name, error = failures.popleft()
+        yield j, failed_name, {"product_code": product_code, "error": error}
+
+# ==================== KALICI ÖLÇÜM GEÇMİŞİ ====================
+# ISO 13485 izlenebilirliği için tüm muayeneler yalnızca-ekleme yapılan SQLite (WAL) deposunda tutulur.
+# Yazmalar istek yolundan ayrılmış bir iş parçacığında toplu olarak işlenir.
+
+HISTORY_DB_PATH = os.environ.get("COLORQC_DB_PATH",
+                                 os.path.join(os.path.dirname(os.path.abspath(__file__)), "colorqc_history.db"))
+
+class HistoryStore:
+    """SQLite (WAL) tabanlı, indeksli ve yalnızca-ekleme yapılan muayene deposu"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS inspections (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            product_code TEXT NOT NULL,
+            expected_color TEXT,
+            overall_status TEXT NOT NULL,
+            delta_e REAL,
+            gloss_value REAL,
+            defect_count INTEGER,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_inspections_timestamp ON inspections(timestamp);
+        CREATE INDEX IF NOT EXISTS idx_inspections_product ON inspections(product_code, id);
+        CREATE INDEX IF NOT EXISTS idx_inspections_color ON inspections(expected_color, id);
+        CREATE INDEX IF NOT EXISTS idx_inspections_status ON inspections(overall_status, id);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    """
+
+    def __init__(self, path, batch_size=200, flush_interval=0.5):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._local = threading.local()
+        self._schema_ready = False
+        self.written = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if not self._schema_ready:
+            conn.executescript(self.SCHEMA)
+            self._schema_ready = True
+        return conn
+
+    def _reader(self):
+        """İş parçacığı başına okuma bağlantısı"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def backlog(self):
+        """Yazılmayı bekleyen kayıt sayısı"""
+        return self._queue.qsize()
+
+    def append(self, entry):
+        """Muayene kaydını yazma kuyruğuna ekle (istek yolunu bloklamaz)"""
+        with self._writer_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_loop, name="colorqc-history", daemon=True)
+                self._writer.start()
+        self._queue.put(entry)
+
+    def _write_loop(self):
+        conn = self._connect()
+        try:
+            while True:
+                entry = self._queue.get()
+                if entry is None:
+                    return
+                batch = [entry]
+                # Kısa süre içinde gelen kayıtlar tek işlemde yazılır
+                deadline = time.time() + self.flush_interval
+                stop = False
+                while len(batch) < self.batch_size:
+                    try:
+                        item = self._queue.get(timeout=max(0, deadline - time.time()))
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+                self._write_batch(conn, batch)
+                if stop:
+                    # Durdurma işaretinden sonra kuyruğa girmiş kayıtlar da yazılır
+                    remaining = []
+                    while True:
+                        try:
+                            item = self._queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        if item is not None:
+                            remaining.append(item)
+                    if remaining:
+                        self._write_batch(conn, remaining)
+                    return
+        finally:
+            conn.close()
+
+    def _write_batch(self, conn, batch):
+        rows = [(
+            e.get("timestamp"), e.get("product_code"), e.get("expected_color"), e.get("overall_status"),
+            e.get("delta_e"), e.get("gloss_value"), e.get("defect_count"),
+            json.dumps(jsonable_encoder(e), ensure_ascii=False)
+        ) for e in batch]
+        with conn:
+            conn.executemany(
+                "INSERT INTO inspections (timestamp, product_code, expected_color, overall_status, "
+                "delta_e, gloss_value, defect_count, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self.written += len(rows)
+
+    def close(self, timeout=30):
+        """Bekleyen yazmaları bitir ve yazıcıyı durdur"""
+        with self._writer_lock:
+            writer = self._writer
+            if writer is None or not writer.is_alive():
+                return
+            self._queue.put(None)
+        writer.join(timeout)
+
+    def query(self, limit=50, before_id=None, offset=0, product_code=None, expected_color=None,
+              overall_status=None, since=None, until=None):
+        """Filtreli, sayfalı sorgu (en yeni önce). Derin sayfalar için before_id (keyset) önerilir"""
+        clauses, params = [], []
+        for column, value in (("product_code", product_code), ("expected_color", expected_color),
+                              ("overall_status", overall_status)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("timestamp < ?")
+            params.append(until)
+        if before_id is not None:
+            clauses.append("id < ?")
+            params.append(before_id)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._reader().execute(
+            f"SELECT id, data FROM inspections {where} ORDER BY id DESC LIMIT ? OFFSET ?",
+            params + [limit, offset]).fetchall()
+        return [{"id": row["id"], **json.loads(row["data"])} for row in rows]
+
+    def count(self):
+        """Toplam kayıt sayısı"""
+        return self._reader().execute("SELECT COUNT(*) FROM inspections").fetchone()[0]
+
+    def status_counts(self, since=None):
+        """(ürün kodu, renk, durum, adet) - pano sayaçlarını tek toplama sorgusuyla yeniden kurmak için"""
+        where, params = ("WHERE timestamp >= ?", [since]) if since is not None else ("", [])
+        return self._reader().execute(
+            f"SELECT product_code, expected_color, overall_status, COUNT(*) FROM inspections {where} "
+            "GROUP BY product_code, expected_color, overall_status", params).fetchall()
+
+    def get_meta(self, key, default=None):
+        row = self._reader().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else default
+
+    def set_meta(self, key, value):
+        conn = self._reader()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+history_store = HistoryStore(HISTORY_DB_PATH)
+atexit.register(history_store.close)
+
+def restore_recent_history(store, history, since=None):
+    """Yeniden başlatmada bellek içi son ölçüm listesini (en yeni önce) kalıcı depodan doldur"""
+    history.clear()
+    for entry in store.query(limit=history.maxlen, since=since):
+        entry.pop("id", None)
+        history.append(entry)
+
+def resolve_color_name(color):
+    """Renk kodunu (MAVI) veya standart adını geçmişte tutulan standart adına çevir"""
+    if color in AYGUN_COLOR_STANDARDS:
+        return AYGUN_COLOR_STANDARDS[color]["name"]
+    return color
+
+# ==================== PANO TOPLAMLARI ====================
+# Pano istatistikleri her kayıt eklenirken güncellenir; /dashboard okuması geçmiş boyutundan bağımsızdır.
+
+class RollingStats:
+    """Son N değer üzerinde O(1) güncellenen ortalama ve varyans"""
+
+    def __init__(self, size):
+        self.values = deque(maxlen=size)
+        self.total = 0.0
+        self.total_sq = 0.0
+        self._adds = 0
+
+    def add(self, value):
+        value = float(value)
+        if len(self.values) == self.values.maxlen:
+            old = self.values[0]
+            self.total -= old
+            self.total_sq -= old * old
+        self.values.append(value)
+        self.total += value
+        self.total_sq += value * value
+        # Kayan nokta birikimini önlemek için toplamlar ara sıra yeniden hesaplanır (amorti O(1))
+        self._adds += 1
+        if self._adds % (self.values.maxlen * 64) == 0:
+            self.total = sum(self.values)
+            self.total_sq = sum(v * v for v in self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def mean(self, default=0.0):
+        return self.total / len(self.values) if self.values else default
+
+    def std(self):
+        if not self.values:
+            return 0.0
+        mean = self.mean()
+        return math.sqrt(max(0.0, self.total_sq / len(self.values) - mean * mean))
+
+class DashboardAggregates:
+    """Durum/renk sayaçları, kayan pencereler ve ürün bazlı kırılımlar - ekleme anında güncellenir"""
+
+    def __init__(self, window=20, trend_window=50):
+        self.window = window
+        self.trend_window = trend_window
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.total = 0
+            self.status_counts = {"ONAY": 0, "INCELEME": 0, "RED": 0}
+            self.color_counts = {}
+            self.delta_e = RollingStats(self.window)
+            self.gloss = RollingStats(self.window)
+            self.defects = RollingStats(self.window)
+            self.recent = deque(maxlen=self.window)  # En yeni önce
+            self.products = {}
+            self.trend_delta_e = RollingStats(self.trend_window)
+            self.trend_gloss = RollingStats(self.trend_window)
+            self.trend_rejected = RollingStats(self.trend_window)
+
+    def add(self, entry):
+        """Yeni muayene kaydını toplamlara işle - O(1)"""
+        with self._lock:
+            self._count(entry["product_code"], entry.get("expected_color", "Bilinmiyor"), entry["overall_status"])
+            self._roll(entry)
+            self._roll_product(entry)
+
+    def load(self, store, since=None):
+        """Toplamları kalıcı depodan yeniden kur - sayaçlar tüm kayıtlardan (since sonrası) tek toplama
+        sorgusuyla, kayan pencereler son kayıtlardan"""
+        counts = store.status_counts(since)
+        recent = store.query(limit=max(self.window, self.trend_window), since=since)
+        by_product = {code: store.query(limit=self.window, product_code=code, since=since)
+                      for code in {row[0] for row in counts}}
+        self.reset()
+        with self._lock:
+            for product_code, color, status, n in counts:
+                self._count(product_code, color or "Bilinmiyor", status, n)
+            # Sorgular en yeni önce döner; pencereler eskiden yeniye doldurulur
+            for entry in reversed(recent):
+                self._roll(entry)
+            for rows in by_product.values():
+                for entry in reversed(rows):
+                    self._roll_product(entry)
+
+    def _product(self, product_code):
+        product = self.products.get(product_code)
+        if product is None:
+            product = {"total": 0, "status_counts": {"ONAY": 0, "INCELEME": 0, "RED": 0},
+                       "delta_e": RollingStats(self.window), "gloss": RollingStats(self.window)}
+            self.products[product_code] = product
+        return product
+
+    def _count(self, product_code, color, status, n=1):
+        self.total += n
+        self.status_counts[status] = self.status_counts.get(status, 0) + n
+        self.color_counts[color] = self.color_counts.get(color, 0) + n
+        product = self._product(product_code)
+        product["total"] += n
+        product["status_counts"][status] = product["status_counts"].get(status, 0) + n
+
+    def _roll(self, entry):
+        self.delta_e.add(entry["delta_e"])
+        self.gloss.add(entry.get("gloss_value", 50))
+        self.defects.add(entry.get("defect_count", 0))
+        self.recent.appendleft({k: v for k, v in entry.items() if k != "id"})
+        self.trend_delta_e.add(entry["delta_e"])
+        self.trend_gloss.add(entry.get("gloss_value", 50))
+        self.trend_rejected.add(1 if entry["overall_status"] == "RED" else 0)
+
+    def _roll_product(self, entry):
+        product = self._product(entry["product_code"])
+        product["delta_e"].add(entry["delta_e"])
+        product["gloss"].add(entry.get("gloss_value", 50))
+
+    def snapshot(self):
+        """Pano için anlık görüntü - geçmiş boyutundan bağımsız"""
+        with self._lock:
+            total = self.total
+            approved = self.status_counts.get("ONAY", 0)
+            review = self.status_counts.get("INCELEME", 0)
+            rejected = self.status_counts.get("RED", 0)
+            products = {
+                code: {
+                    "total": p["total"],
+                    "status_counts": dict(p["status_counts"]),
+                    "avg_delta_e": round(p["delta_e"].mean(), 2),
+                    "std_delta_e": round(p["delta_e"].std(), 2),
+                    "avg_gloss": round(p["gloss"].mean(50), 1)
+                }
+                for code, p in self.products.items()
+            }
+            snapshot = {
+                "total_inspections": total,
+                "approved": approved,
+                "review": review,
+                "rejected": rejected,
+                "approval_rate": round(approved / total * 100, 1) if total > 0 else 0,
+                "quality_rate": round((approved + review * 0.5) / total * 100, 1) if total > 0 else 100,
+                "avg_delta_e": round(self.delta_e.mean(), 2),
+                "std_delta_e": round(self.delta_e.std(), 2),
+                "avg_gloss": round(self.gloss.mean(50), 1),
+                "std_gloss": round(self.gloss.std(), 1),
+                "avg_defects": round(self.defects.mean(), 2),
+                "color_distribution": dict(self.color_counts),
+                "product_breakdown": products,
+                "recent_inspections": list(self.recent)
+            }
+        return snapshot
+
+    def trend_stats(self):
+        """Son trend_window ölçümün özet istatistikleri"""
+        with self._lock:
+            return {
+                "delta_e_mean": round(self.trend_delta_e.mean(), 2),
+                "delta_e_std": round(self.trend_delta_e.std(), 2),
+                "gloss_mean": round(self.trend_gloss.mean(50), 1),
+                "rejection_rate": round(self.trend_rejected.mean() * 100, 1)
+            }
+
+dashboard_aggregates = DashboardAggregates()
+
+HISTORY_CLEARED_KEY = "history_cleared_at"  # DELETE /history anı - pano bu andan sonraki kayıtlardan kurulur
+
+# Toplu analiz işçi süreçleri modülü yeniden içe aktarır; depo yalnızca istek sunan süreçlerde okunur
+if not IS_BATCH_WORKER:
+    _cleared_at = history_store.get_meta(HISTORY_CLEARED_KEY)
+    restore_recent_history(history_store, measurement_history, since=_cleared_at)
+    dashboard_aggregates.load(history_store, since=_cleared_at)
+
+# ==================== İSTATİSTİKSEL PROSES KONTROLÜ ====================
+# Her muayene; genel, ürün bazlı ve renk bazlı kontrol kartlarını O(1) günceller.
+# İlk SPC_BASELINE_SIZE ölçüm merkez çizgisi ve sigma tahmini (Faz I) için kullanılır,
+# sonrasında Shewhart, EWMA, CUSUM ve Western Electric kuralları sabit limitlerle izlenir (Faz II).
+
+SPC_BASELINE_SIZE = int(os.environ.get("COLORQC_SPC_BASELINE", "20"))
+SPC_METRICS = ("delta_e", "gloss_value")
+SPC_METRIC_LABELS = {"delta_e": "ΔE", "gloss_value": "Parlaklık"}
+SPC_RULE_LABELS = {
+    "shewhart": "Shewhart 3σ limit aşımı",
+    "we2": "3 ölçümden 2'si 2σ ötesinde",
+    "we3": "5 ölçümden 4'ü 1σ ötesinde",
+    "we4": "8 ardışık ölçüm merkez çizgisinin aynı tarafında",
+    "ewma": "EWMA kontrol limiti aşımı",
+    "cusum": "CUSUM karar aralığı aşımı"
+}
+
+class ControlChart:
+    """Tek bir ölçüm akışı için Shewhart (I-MR), EWMA ve CUSUM kartı"""
+
+    def __init__(self, baseline_size=SPC_BASELINE_SIZE, ewma_lambda=0.2, ewma_l=3.0,
+                 cusum_k=0.5, cusum_h=5.0):
+        self.baseline_size = max(2, baseline_size)
+        self.ewma_lambda = ewma_lambda
+        self.ewma_l = ewma_l
+        self.cusum_k = cusum_k
+        self.cusum_h = cusum_h
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.last = None
+        self._sum = 0.0
+        self._mr_sum = 0.0
+        self.center = None
+        self.sigma = None
+        self.ewma = None
+        self._ewma_decay = 1.0  # (1-λ)^(2i)
+        self.cusum_upper = 0.0
+        self.cusum_lower = 0.0
+        self._zones = deque(maxlen=8)
+        self.active = {}  # kural -> yön
+
+    @property
+    def phase(self):
+        return "baseline" if self.sigma is None else "monitoring"
+
+    def ewma_limits(self):
+        width = self.ewma_l * self.sigma * math.sqrt(
+            self.ewma_lambda / (2 - self.ewma_lambda) * (1 - self._ewma_decay))
+        return self.center - width, self.center + width
+
+    def _check_rules(self, z):
+        """Western Electric kuralları - son 8 z-skoru üzerinden sabit maliyet"""
+        zones = self._zones
+        rules = {}
+        if abs(z) > 3:
+            rules["shewhart"] = z
+        last3 = list(itertools.islice(reversed(zones), 3))
+        last5 = list(itertools.islice(reversed(zones), 5))
+        for sign in (1, -1):
+            if len(last3) == 3 and sum(1 for v in last3 if v * sign > 2) >= 2:
+                rules["we2"] = sign
+            if len(last5) == 5 and sum(1 for v in last5 if v * sign > 1) >= 4:
+                rules["we3"] = sign
+            if len(zones) == zones.maxlen and all(v * sign > 0 for v in zones):
+                rules["we4"] = sign
+        return {rule: ("up" if value > 0 else "down") for rule, value in rules.items()}
+
+    def update(self, value):
+        """Yeni ölçümü işle; yeni tetiklenen alarmları [(kural, yön)] olarak döndür"""
+        value = float(value)
+        previous = self.last
+        self.last = value
+        self.n += 1
+        
+        if self.sigma is None:
+            # Faz I: merkez çizgisi ve hareketli aralık (MR̄/d2) ile sigma tahmini
+            self._sum += value
+            if previous is not None:
+                self._mr_sum += abs(value - previous)
+            if self.n >= self.baseline_size:
+                self.center = self._sum / self.n
+                self.sigma = max(self._mr_sum / (self.n - 1) / 1.128, 1e-3)
+                self.ewma = self.center
+            return []
+        
+        z = (value - self.center) / self.sigma
+        self._zones.append(z)
+        
+        lam = self.ewma_lambda
+        self.ewma = lam * value + (1 - lam) * self.ewma
+        self._ewma_decay *= (1 - lam) ** 2
+        
+        k = self.cusum_k * self.sigma
+        self.cusum_upper = max(0.0, self.cusum_upper + value - self.center - k)
+        self.cusum_lower = max(0.0, self.cusum_lower + self.center - value - k)
+        
+        current = self._check_rules(z)
+        ewma_lcl, ewma_ucl = self.ewma_limits()
+        if self.ewma > ewma_ucl:
+            current["ewma"] = "up"
+        elif self.ewma < ewma_lcl:
+            current["ewma"] = "down"
+        
+        fired = []
+        h = self.cusum_h * self.sigma
+        # CUSUM sinyal sonrası sıfırlanır; her yeni sinyal ayrı bir alarmdır
+        if self.cusum_upper > h:
+            fired.append(("cusum", "up"))
+            self.cusum_upper = 0.0
+        if self.cusum_lower > h:
+            fired.append(("cusum", "down"))
+            self.cusum_lower = 0.0
+        # Diğer kurallar yalnızca ihlalin başladığı ölçümde alarm üretir
+        for rule, direction in current.items():
+            if rule == "shewhart" or self.active.get(rule) != direction:
+                fired.append((rule, direction))
+        self.active = current
+        return fired
+
+    def state(self):
+        state = {
+            "phase": self.phase,
+            "n": self.n,
+            "baseline_size": self.baseline_size,
+            "last_value": round(self.last, 3) if self.last is not None else None
+        }
+        if self.sigma is None:
+            return state
+        ewma_lcl, ewma_ucl = self.ewma_limits()
+        h = self.cusum_h * self.sigma
+        state.update({
+            "center": round(self.center, 3),
+            "sigma": round(self.sigma, 4),
+            "shewhart": {"ucl": round(self.center + 3 * self.sigma, 3),
+                         "lcl": round(self.center - 3 * self.sigma, 3)},
+            "ewma": {"value": round(self.ewma, 3), "ucl": round(ewma_ucl, 3),
+                     "lcl": round(ewma_lcl, 3), "lambda": self.ewma_lambda},
+            "cusum": {"upper": round(self.cusum_upper, 3), "lower": round(self.cusum_lower, 3),
+                      "h": round(h, 3), "k": round(self.cusum_k * self.sigma, 4)},
+            "violations": dict(self.active),
+            "in_control": not self.active
+        })
+        return state
+
+class SPCEngine:
+    """Genel, ürün, renk ve kamera kapsamlı kontrol kartları ile alarm kaydı"""
+
+    def __init__(self, metrics=SPC_METRICS, max_alarms=500, **chart_options):
+        self.metrics = metrics
+        self.chart_options = chart_options
+        self.charts = {}  # (kapsam, anahtar) -> {metrik: ControlChart}
+        self.alarms = deque(maxlen=max_alarms)  # En yeni önce
+        self._alarm_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _scopes(self, entry):
+        product_code = entry.get("product_code")
+        color_code = AYGUN_PRODUCTS.get(product_code, {}).get("expected_color")
+        scopes = [("all", "*"), ("product", product_code)]
+        if color_code:
+            scopes.append(("color", color_code))
+        if entry.get("camera_id"):
+            scopes.append(("camera", entry["camera_id"]))
+        return scopes
+
+    def update(self, entry):
+        """Muayene kaydını tüm kapsamlardaki kartlara işle - O(1)"""
+        fired = []
+        with self._lock:
+            for scope in self._scopes(entry):
+                charts = self.charts.get(scope)
+                if charts is None:
+                    charts = {m: ControlChart(**self.chart_options) for m in self.metrics}
+                    self.charts[scope] = charts
+                for metric, chart in charts.items():
+                    if entry.get(metric) is None:
+                        continue
+                    for rule, direction in chart.update(entry[metric]):
+                        alarm = {
+                            "id": next(self._alarm_ids),
+                            "timestamp": entry.get("timestamp"),
+                            "scope": scope[0],
+                            "key": scope[1],
+                            "metric": metric,
+                            "rule": rule,
+                            "direction": direction,
+                            "value": round(chart.last, 3),
+                            "center": round(chart.center, 3),
+                            "message": f"{SPC_METRIC_LABELS.get(metric, metric)} - {SPC_RULE_LABELS[rule]} ({'yukarı' if direction == 'up' else 'aşağı'})"
+                        }
+                        self.alarms.appendleft(alarm)
+                        fired.append(alarm)
+        return fired
+
+    def reset(self, scope=None, key=None):
+        """Kartları yeni referans dönemi için sıfırla (ör. banyo ayarı sonrası)"""
+        with self._lock:
+            for (s, k), charts in self.charts.items():
+                if (scope is None or s == scope) and (key is None or k == key):
+                    for chart in charts.values():
+                        chart.reset()
+
+    def state(self, scope=None, key=None):
+        with self._lock:
+            result = {}
+            for (s, k), charts in self.charts.items():
+                if (scope is None or s == scope) and (key is None or k == key):
+                    result.setdefault(s, {})[k] = {m: c.state() for m, c in charts.items()}
+            return result
+
+    def recent_alarms(self, limit=50, scope=None, key=None, metric=None):
+        with self._lock:
+            alarms = [a for a in self.alarms
+                      if (scope is None or a["scope"] == scope) and (key is None or a["key"] == key)
+                      and (metric is None or a["metric"] == metric)]
+        return alarms[:limit]
+
+    def trend_warning(self):
+        """Genel ΔE kartında yukarı yönlü aktif ihlal varsa pano uyarısı"""
+        with self._lock:
+            chart = self.charts.get(("all", "*"), {}).get("delta_e")
+            if chart is None or chart.sigma is None:
+                return None
+            rules = [rule for rule, direction in chart.active.items() if direction == "up"]
+            if chart.cusum_upper > chart.cusum_h * chart.sigma / 2:
+                rules.append("cusum")
+            if not rules:
+                return None
+            ewma, center = chart.ewma, chart.center
+        labels = ", ".join(SPC_RULE_LABELS[r] for r in rules)
+        return f"⚠️ ΔE kontrol kartında yukarı yönlü kayma tespit edildi ({center:.2f} → EWMA {ewma:.2f}; {labels}). Eloksal banyosu parametrelerini kontrol ediniz."
+
+spc_engine = SPCEngine()
+
+# ==================== METRİKLER ====================
+# Prometheus metin biçimi (/metrics). Ek bağımlılık gerektirmez: histogram ve sayaçlar
+# süreç içinde tutulur, kuyruk/yayın göstergeleri okuma anında ilgili nesnelerden toplanır.
+# Toplu analiz işçilerindeki aşama süreleri sonuçtaki stage_timings_ms üzerinden ana süreçte işlenir.
+
+METRIC_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _metric_labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+def _metric_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+class Counter:
+    """Yalnızca artan sayaç"""
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0, **labels):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self.labelnames, key, value) for key, value in self._values.items()]
+
+class Histogram:
+    """Sabit kovalı (bucket) gecikme histogramı"""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=METRIC_LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # etiketler -> [kova sayıları, toplam, adet]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        bucket_labels = self.labelnames + ("le",)
+        samples = []
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append((self.name + "_bucket", bucket_labels, key + (_metric_value(bound),), cumulative))
+            samples.append((self.name + "_bucket", bucket_labels, key + ("+Inf",), count))
+            samples.append((self.name + "_sum", self.labelnames, key, total))
+            samples.append((self.name + "_count", self.labelnames, key, count))
+        return samples
+
+class CallbackMetric:
+    """Değeri okuma anında çağrılan fonksiyondan gelen gösterge/sayaç.
+
+    callback tek bir sayı veya {etiket değerleri demeti: sayı} sözlüğü döndürür.
+    """
+
+    def __init__(self, name, documentation, callback, labelnames=(), type="gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+        self.type = type
+
+    def samples(self):
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(self.name, self.labelnames, tuple(str(v) for v in key), value) for key, value in values.items()]
+
+class MetricsRegistry:
+    """Metrikleri Prometheus metin biçiminde dışa aktaran kayıt"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = metric.samples()
+            except Exception:
+                continue  # Bir göstergenin hatası tüm çıktıyı bozmamalı
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labelnames, labelvalues, value in samples:
+                lines.append(f"{name}{_metric_labels(labelnames, labelvalues)} {_metric_value(value)}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+stage_duration_metric = metrics.register(Histogram(
+    "colorqc_stage_duration_seconds", "Analiz aşaması süresi (decode, color, gloss, defects, render_*, encode_* ...)",
+    ("stage",)))
+analysis_duration_metric = metrics.register(Histogram(
+    "colorqc_analysis_duration_seconds", "Uçtan uca analiz süresi (processing_time_ms)", ("source",)))
+analyses_metric = metrics.register(Counter(
+    "colorqc_analyses_total", "Tamamlanan analizler", ("source", "product_code", "status")))
+analysis_errors_metric = metrics.register(Counter(
+    "colorqc_analysis_errors_total", "Hatayla sonuçlanan analizler", ("source",)))
+
+def observe_stage_timings(timings):
+    """Aşama sürelerini (ms) histograma işle"""
+    for stage, elapsed_ms in timings.items():
+        stage_duration_metric.observe(elapsed_ms / 1000, stage=stage)
+
+def observe_analysis(result, source):
+    """Tamamlanan analiz sonucunu metriklere işle"""
+    if "error" in result:
+        analysis_errors_metric.inc(source=source)
+        return
+    observe_stage_timings(result.get("stage_timings_ms", {}))
+    analysis_duration_metric.observe(result["processing_time_ms"] / 1000, source=source)
+    analyses_metric.inc(source=source, product_code=result["product_code"], status=result["overall_status"])
+
+def _stream_feeds():
+    return [feed for station in camera_registry.stations() for feed in station.feeds()]
+
+for _name, _doc, _key, _type in (
+    ("colorqc_analysis_in_flight", "Yürütücüde çalışan veya bekleyen analizler", "in_flight", "gauge"),
+    ("colorqc_analysis_queued", "Yürütücü kuyruğunda bekleyen analizler", "queued", "gauge"),
+    ("colorqc_analysis_workers", "Analiz iş parçacığı sayısı", "workers", "gauge"),
+    ("colorqc_analysis_queue_depth", "Analiz kuyruğu kapasitesi", "queue_depth", "gauge"),
+    ("colorqc_analysis_executor_completed_total", "Yürütücüde tamamlanan işler", "completed", "counter"),
+    ("colorqc_analysis_rejected_total", "Kapasite dolu olduğu için reddedilen (503) işler", "rejected", "counter"),
+):
+    metrics.register(CallbackMetric(_name, _doc, functools.partial(lambda key: analysis_executor.stats()[key], _key),
+                                    type=_type))
+
+metrics.register(CallbackMetric("colorqc_streams_active", "Açık MJPEG akışları", lambda: stream_limiter.active))
+metrics.register(CallbackMetric("colorqc_streams_max", "Eşzamanlı akış sınırı", lambda: stream_limiter.max_streams))
+metrics.register(CallbackMetric(
+    "colorqc_stream_subscribers", "Yayın başına abone sayısı",
+    lambda: {(f["name"],): len(f["subscribers"]) for f in _stream_feeds()}, ("feed",)))
+metrics.register(CallbackMetric(
+    "colorqc_stream_frames_encoded_total", "Yayın başına kodlanan kareler",
+    lambda: {(f["name"],): f["frames_encoded"] for f in _stream_feeds()}, ("feed",), type="counter"))
+metrics.register(CallbackMetric(
+    "colorqc_stream_frames_dropped_total", "Yavaş istemciler için atlanan kareler",
+    lambda: {(f["name"],): sum(s["dropped"] for s in f["subscribers"]) for f in _stream_feeds()}, ("feed",),
+    type="counter"))
+
+def _camera_stats(key):
+    return {(station.id,): station.capture.stats()[key] for station in camera_registry.stations()}
+
+metrics.register(CallbackMetric("colorqc_camera_running", "Kamera yakalama iş parçacığı çalışıyor",
+                                lambda: {k: int(v) for k, v in _camera_stats("running").items()}, ("camera",)))
+metrics.register(CallbackMetric("colorqc_camera_capture_fps", "Ölçülen yakalama hızı",
+                                lambda: _camera_stats("capture_fps"), ("camera",)))
+metrics.register(CallbackMetric("colorqc_camera_dropped_reads_total", "Başarısız kamera okumaları",
+                                lambda: _camera_stats("dropped_reads"), ("camera",), type="counter"))
+metrics.register(CallbackMetric(
+    "colorqc_artifact_cache_bytes", "Çıktı önbelleği doluluğu",
+    lambda: {("memory",): artifact_store.stats()["memory_bytes"], ("disk",): artifact_store.stats()["disk_bytes"]},
+    ("tier",)))
+metrics.register(CallbackMetric("colorqc_render_sessions", "Bekleyen görselleştirme oturumları",
+                                lambda: len(render_sessions)))
+metrics.register(CallbackMetric("colorqc_history_write_backlog", "Kalıcı depoya yazılmayı bekleyen kayıtlar",
+                                lambda: history_store.backlog()))
+metrics.register(CallbackMetric("colorqc_history_written_total", "Kalıcı depoya yazılan kayıtlar",
+                                lambda: history_store.written, type="counter"))
+
+def add_to_history(result):
+    """Analiz sonucunu geçmişe ekle (görüntüler olmadan) - kalıcı depoya da yazılır"""
+    history_entry = {k: v for k, v in result.items() if k not in IMAGE_RESULT_KEYS and k not in ("artifacts", "analysis_id")}
+    history_store.append(history_entry)
+    dashboard_aggregates.add(history_entry)
+    spc_engine.update(history_entry)
+    measurement_history.appendleft(history_entry)
+
+# ==================== SÜREKLİ MUAYENE HATTI ====================
+# /analyze/start ile istasyon kamerasının her karesi aşamalı bir hattan geçer:
+#   capture -> preprocess -> analyze -> render -> persist
+# Aşamalar arasında sınırlı kuyruklar vardır. Kare yalnızca hat girişinde (capture -> preprocess) drop
+# politikasıyla atılır; iç kuyruklar doluysa üst aşama bekler (geri basınç), yarım kalmış iş atılmaz.
+# persist tek işçidir ve sonuçları hatta giriş sırasıyla geçmişe/SPC'ye yazar.
+
+PIPELINE_STAGES = ("capture", "preprocess", "analyze", "render", "persist")
+PIPELINE_DROP_POLICIES = ("drop_oldest", "drop_newest", "block")
+PIPELINE_RENDER_POLICIES = ("none", "rejected", "all")  # Hangi muayenelerde işaretli görsel üretilir
+PIPELINE_QUEUE_SIZE = int(os.environ.get("COLORQC_PIPELINE_QUEUE", 4))
+PIPELINE_DROP_POLICY = os.environ.get("COLORQC_PIPELINE_DROP_POLICY", "drop_oldest")
+PIPELINE_MAX_STAGE_WORKERS = 32
+
+def parse_stage_workers(value):
+    """"analyze=4,render=2" -> {aşama: işçi sayısı}; capture ve persist her zaman tek işçidir"""
+    workers = {}
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        name, _, count = item.partition("=")
+        name = name.strip()
+        if name not in ("preprocess", "analyze", "render") or not count.strip().isdigit():
+            raise HTTPException(status_code=400, detail=f"Geçersiz aşama işçi ayarı: {item}")
+        workers[name] = min(PIPELINE_MAX_STAGE_WORKERS, max(1, int(count)))
+    return workers
+
+PIPELINE_WORKERS = {"preprocess": 1, "analyze": max(1, (os.cpu_count() or 4) // 2), "render": 1,
+                    **parse_stage_workers(os.environ.get("COLORQC_PIPELINE_WORKERS"))}
+
+pipeline_stage_metric = metrics.register(Histogram(
+    "colorqc_pipeline_stage_seconds", "Sürekli muayene hattı aşama süreleri", ("camera", "stage")))
+
+class StageQueue:
+    """Aşamalar arası sınırlı kuyruk - doluysa politika: block (bekle), drop_oldest, drop_newest"""
+
+    def __init__(self, maxsize, policy="block"):
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.dropped = 0
+        self.in_flight = 0  # get() ile alınıp task_done() çağrılmamış öğeler
+        self._items = deque()
+        self._cond = threading.Condition()
+
+    def put(self, item, stop):
+        """Öğeyi ekle; atıldıysa veya hat durduysa False"""
+        with self._cond:
+            while len(self._items) >= self.maxsize:
+                if self.policy == "drop_newest":
+                    self.dropped += 1
+                    return False
+                if self.policy == "drop_oldest":
+                    self._items.popleft()
+                    self.dropped += 1
+                    break
+                if stop.is_set():
+                    return False
+                self._cond.wait(0.2)
+            self._items.append(item)
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout=0.2):
+        """Sıradaki öğe (zaman aşımında None) - alınan öğe task_done() çağrılana kadar işlemde sayılır"""
+        with self._cond:
+            if not self._items:
+                self._cond.wait(timeout)
+                if not self._items:
+                    return None
+            item = self._items.popleft()
+            self.in_flight += 1
+            self._cond.notify_all()
+            return item
+
+    def task_done(self):
+        with self._cond:
+            self.in_flight -= 1
+
+    def idle(self):
+        """Kuyrukta bekleyen veya işlenen öğe yok mu"""
+        with self._cond:
+            return not self._items and self.in_flight == 0
+
+    def __len__(self):
+        return len(self._items)
+
+def latency_summary(latencies):
+    """Gecikme örneklerinden (sn) p50/p95/maks (ms)"""
+    if not latencies:
+        return {"p50_ms": None, "p95_ms": None, "max_ms": None}
+    values = np.asarray(latencies) * 1000
+    return {"p50_ms": round(float(np.percentile(values, 50)), 2),
+            "p95_ms": round(float(np.percentile(values, 95)), 2),
+            "max_ms": round(float(values.max()), 2)}
+
+class StageStats:
+    """Aşama başına işlenen/hatalı öğe, son gecikmeler, verim ve doluluk"""
+
+    def __init__(self, workers, window=256):
+        self.workers = workers
+        self.processed = 0
+        self.errors = 0
+        self.busy_s = 0.0
+        self._recent = deque(maxlen=window)  # (bitiş zamanı, süre)
+        self._lock = threading.Lock()
+
+    def record(self, duration, ok=True):
+        with self._lock:
+            self.processed += 1
+            self.errors += 0 if ok else 1
+            self.busy_s += duration
+            self._recent.append((time.perf_counter(), duration))
+
+    def snapshot(self, elapsed):
+        with self._lock:
+            recent = list(self._recent)
+            processed, errors, busy_s = self.processed, self.errors, self.busy_s
+        # Verim son pencereden ölçülür (başlangıçtaki ısınma ortalamayı bozmaz)
+        throughput = 0.0
+        if len(recent) >= 2 and recent[-1][0] > recent[0][0]:
+            throughput = (len(recent) - 1) / (recent[-1][0] - recent[0][0])
+        return {
+            "workers": self.workers,
+            "processed": processed,
+            "errors": errors,
+            "throughput_per_s": round(throughput, 2),
+            "utilization": round(busy_s / (elapsed * self.workers), 3) if elapsed > 0 else 0.0,
+            **latency_summary([duration for _, duration in recent])
+        }
+
+class InspectionPipeline:
+    """Bir istasyon için capture -> preprocess -> analyze -> render -> persist hattı"""
+
+    def __init__(self, station, product_code, roi=None, mode=None, workers=None,
+                 queue_size=PIPELINE_QUEUE_SIZE, drop_policy=PIPELINE_DROP_POLICY, render="rejected"):
+        self.station = station
+        self.capture = station.capture
+        self.simulated = False  # Kamera cihazı açılamadı, hat kendi sentetik kaynağında çalışıyor
+        self.product_code = product_code
+        self.roi = roi
+        self.mode = mode
+        self.render = render
+        self.drop_policy = drop_policy
+        self.workers = {**PIPELINE_WORKERS, **(workers or {}), "capture": 1, "persist": 1}
+        # Aşamanın giriş kuyruğu: yalnızca hat girişi kare atar, iç kuyruklar geri basınç uygular
+        self.queues = {stage: StageQueue(queue_size, drop_policy if stage == "preprocess" else "block")
+                       for stage in PIPELINE_STAGES[1:]}
+        self.stage_stats = {stage: StageStats(self.workers[stage]) for stage in PIPELINE_STAGES}
+        self.missed_frames = 0  # Hat almadan kamera tamponunda üzerine yazılan kareler
+        self.inspected = 0
+        self.last_result = None
+        self.error = None
+        self.started_at = None
+        self.stopped_at = None
+        self._end_to_end = deque(maxlen=256)
+        self._index = itertools.count()
+        self._pending = {}  # persist sıralama tamponu: giriş sırası -> öğe
+        self._next_index = 0
+        self._capture_stop = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    @property
+    def running(self):
+        return self.started_at is not None and not self._stop.is_set()
+
+    def start(self):
+        """Kamerayı (gerekirse) başlat ve aşama iş parçacıklarını çalıştır; kaynak açılamazsa False
+
+        Kamera cihazı açılamazsa hat, istasyon ayarlarıyla sentetik kaynakta (simülasyon modu) çalışır.
+        """
+        if not self.capture.start():
+            if self.station.config["source"] != "device":
+                return False
+            self.capture = CameraCapture(camera_source_opener(
+                {**self.station.config, "source": "synthetic", "product_code": self.product_code}))
+            self.simulated = True
+            if not self.capture.start():
+                return False
+        self.started_at = time.perf_counter()
+        handlers = {"preprocess": self._preprocess, "analyze": self._analyze, "render": self._render,
+                    "persist": self._persist}
+        self._threads.append(threading.Thread(target=self._capture_loop, daemon=True,
+                                              name=f"colorqc-pipeline-{self.station.id}-capture"))
+        for stage, handler in handlers.items():
+            for n in range(self.workers[stage]):
+                self._threads.append(threading.Thread(target=self._worker, args=(stage, handler), daemon=True,
+                                                      name=f"colorqc-pipeline-{self.station.id}-{stage}-{n}"))
+        for thread in self._threads:
+            thread.start()
+        return True
+
+    def stop(self, drain_timeout=5.0):
+        """Girişi kapat, hattaki kareleri bitir (zaman aşımına kadar) ve iş parçacıklarını durdur"""
+        self._capture_stop.set()
+        self._drain(drain_timeout)
+        self._stop.set()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=2.0)
+        if self.simulated:
+            self.capture.stop()
+        self.stopped_at = self.stopped_at or time.perf_counter()
+        return self.stats()
+
+    def _drain(self, timeout):
+        deadline = time.perf_counter() + timeout
+        # Önce yakalama döngüsünün bitmesi beklenir (elindeki kare kuyruğa girmiş olur)
+        capture_thread = self._threads[0] if self._threads else None
+        if capture_thread is not None and capture_thread is not threading.current_thread():
+            capture_thread.join(timeout=max(0, deadline - time.perf_counter()))
+        while time.perf_counter() < deadline and not self._stop.is_set():
+            # Öğe bir sonraki kuyruğa girdikten sonra task_done() ile bırakılır; kuyruklar hat
+            # sırasıyla denetlendiği için ilerleyen öğe hiçbir anda gözden kaçmaz
+            if all(self.queues[stage].idle() for stage in PIPELINE_STAGES[1:]):
+                return
+            time.sleep(0.01)
+
+    def _capture_loop(self):
+        capture = self.capture
+        stats = self.stage_stats["capture"]
+        latest = capture.latest()
+        last_seq = latest.seq - 1 if latest is not None else 0  # Tampondaki en son kare de muayene edilir
+        while not self._capture_stop.is_set():
+            packet = capture.wait_for_frame(last_seq, timeout=0.5)
+            if packet is None:
+                if not capture.running:
+                    # Kaynak bitti/koptu (ör. döngüsüz kayıt): hattaki kareler bitirilip durulur
+                    self.error = "Kamera yakalaması durdu"
+                    threading.Thread(target=self.stop, daemon=True).start()
+                    return
+                continue
+            start = time.perf_counter()
+            if last_seq:
+                self.missed_frames += max(0, packet.seq - last_seq - 1)
+            last_seq = packet.seq
+            item = {"seq": packet.seq, "captured_at": packet.timestamp, "frame": packet.frame}
+            self.queues["preprocess"].put(item, self._stop)
+            duration = time.perf_counter() - start
+            stats.record(duration)
+            pipeline_stage_metric.observe(duration, camera=self.station.id, stage="capture")
+
+    def _worker(self, stage, handler):
+        queue = self.queues[stage]
+        stats = self.stage_stats[stage]
+        next_queue = self.queues.get(PIPELINE_STAGES[PIPELINE_STAGES.index(stage) + 1]) if stage != "persist" else None
+        while not self._stop.is_set():
+            item = queue.get()
+            if item is None:
+                continue
+            try:
+                # Hatalı öğe işlenmeden iletilir; persist sırası boşluk bırakmadan ilerler
+                if "error" not in item or stage == "persist":
+                    start = time.perf_counter()
+                    ok = True
+                    try:
+                        handler(item)
+                    except Exception as exc:
+                        # Görsel hatası kararı geçersiz kılmaz: sonuç yine de kaydedilir
+                        item["render_error" if stage == "render" else "error"] = str(exc)
+                        ok = False
+                    duration = time.perf_counter() - start
+                    stats.record(duration, ok)
+                    pipeline_stage_metric.observe(duration, camera=self.station.id, stage=stage)
+                if next_queue is not None:
+                    next_queue.put(item, self._stop)
+            finally:
+                queue.task_done()
+
+    def _preprocess(self, item):
+        item["index"] = next(self._index)
+        item["frame"] = limit_frame_size(item["frame"])
+
+    def _analyze(self, item):
+        # Görsel ertelenmez: paylaşılan render_sessions LRU'su etkileşimli istekler için ayrılmıştır
+        timings = {}
+        result = run_analysis(item["frame"], self.product_code, include_images=False, defer_images=False,
+                              roi=self.roi, mode=self.mode, timings=timings)
+        result["camera_id"] = self.station.id
+        result["frame_seq"] = item["seq"]
+        item["result"] = result
+
+    def _render(self, item):
+        result = publish_artifacts(item["result"])
+        frame = item.pop("frame")
+        if self.render == "none" or (self.render == "rejected" and result["overall_status"] != "RED"):
+            return
+        # Yalnızca politikanın seçtiği karede işaretli görsel üretilir
+        product = AYGUN_PRODUCTS[self.product_code]
+        session = RenderSession(FrameContext(frame), product["expected_color"], product["name"])
+        session.defects = result["defects_detected"]
+        session.color_status = result["color_status"]
+        artifact_id, _ = session.artifact("annotated_image")
+        result["annotated_image"] = f"/artifacts/{artifact_id}"
+        result["artifacts"]["annotated_image"] = artifact_id
+
+    def _persist(self, item):
+        # Birden fazla analiz işçisi sırayı bozar; sonuçlar hatta giriş sırasıyla yazılır
+        self._pending[item["index"]] = item
+        while self._next_index in self._pending:
+            ready = self._pending.pop(self._next_index)
+            self._next_index += 1
+            if "error" in ready:
+                observe_analysis(ready, "inline")
+                continue
+            result = ready["result"]
+            if "render_error" in ready:
+                result["render_error"] = ready["render_error"]
+            add_to_history(result)
+            observe_analysis(result, "inline")
+            self._end_to_end.append(time.time() - ready["captured_at"])
+            self.inspected += 1
+            self.last_result = result
+
+    def stats(self):
+        elapsed = ((self.stopped_at or time.perf_counter()) - self.started_at) if self.started_at else 0.0
+        stages = {}
+        for stage in PIPELINE_STAGES:
+            stages[stage] = self.stage_stats[stage].snapshot(elapsed)
+            queue = self.queues.get(stage)
+            if queue is not None:
+                stages[stage].update(queue_depth=len(queue), queue_capacity=queue.maxsize, queue_dropped=queue.dropped)
+        last = self.last_result
+        return {
+            "camera_id": self.station.id,
+            "running": self.running,
+            "product_code": self.product_code,
+            "render": self.render,
+            "drop_policy": self.drop_policy,
+            "simulated": self.simulated,
+            "uptime_s": round(elapsed, 1),
+            "inspected": self.inspected,
+            "inspections_per_s": round(self.inspected / elapsed, 2) if elapsed > 0 else 0.0,
+            "dropped_frames": self.queues["preprocess"].dropped,
+            "missed_frames": self.missed_frames,
+            "end_to_end": latency_summary(list(self._end_to_end)),
+            "stages": stages,
+            "last_result": {key: last[key] for key in ("timestamp", "frame_seq", "overall_status", "delta_e",
+                                                       "gloss_value", "defect_count")} if last else None,
+            "error": self.error
+        }
+
+def start_pipeline(station, **options):
+    """İstasyonda sürekli muayeneyi başlat (çalışıyorsa mevcut hat döner)"""
+    with station._lock:
+        pipeline = station.pipeline
+        if pipeline is not None and pipeline.running:
+            return pipeline
+        pipeline = InspectionPipeline(station, **options)
+        if not pipeline.start():
+            raise HTTPException(status_code=409, detail="Kamera başlatılamadı")
+        station.pipeline = pipeline
+        return pipeline
+
+def stop_pipeline(station):
+    """Sürekli muayeneyi durdur - son istatistikler (çalışmıyorsa None)"""
+    pipeline = station.pipeline
+    if pipeline is None:
+        return None
+    return pipeline.stop()
+
+def _pipeline_stats():
+    return [station.pipeline.stats() for station in camera_registry.stations() if station.pipeline is not None]
+
+metrics.register(CallbackMetric("colorqc_pipeline_running", "Sürekli muayene hattı çalışıyor",
+                                lambda: {(p["camera_id"],): int(p["running"]) for p in _pipeline_stats()}, ("camera",)))
+metrics.register(CallbackMetric(
+    "colorqc_pipeline_queue_depth", "Hat aşamalarının giriş kuyruğu doluluğu",
+    lambda: {(p["camera_id"], stage): s["queue_depth"] for p in _pipeline_stats()
+             for stage, s in p["stages"].items() if "queue_depth" in s}, ("camera", "stage")))
+metrics.register(CallbackMetric("colorqc_pipeline_inspected_total", "Hatta muayene edilen kareler",
+                                lambda: {(p["camera_id"],): p["inspected"] for p in _pipeline_stats()}, ("camera",),
+                                type="counter"))
+metrics.register(CallbackMetric(
+    "colorqc_pipeline_frames_dropped_total", "Hat girişinde atılan veya kaçırılan kareler",
+    lambda: {(p["camera_id"], reason): p[f"{reason}_frames"] for p in _pipeline_stats()
+             for reason in ("dropped", "missed")}, ("camera", "reason"), type="counter"))
+
+# ==================== API ENDPOINTS ====================
+
+@app.get("/")
+async def root():
+    return {
+        "system": "ColorQC - Aygün Cerrahi Aletler",
+        "description": "Hibrit Yapay Zeka Tabanlı Yüzey ve Renk Kalite Kontrol Sistemi",
+        "version": "1.0.0",
+        "problem": "Problem 2 - Yüzey Parlaklığı ve Eloksal Renk Uyumsuzluğu"
     }
 
+@app.get("/video_feed")
+async def video_feed(request: Request, fps: int = 30, camera_id: str = DEFAULT_CAMERA_ID):
+    """Canlı video stream"""
+    station = camera_registry.get(camera_id)
+    stream_limiter.acquire()
+    return LimitedStreamingResponse(
+        generate_video_stream(station, request, min(60, max(1, fps))),
+        media_type="multipart/x-mixed-replace; boundary=frame"
+    )
+
+@app.get("/video_feed/stats")
+async def video_feed_stats(camera_id: str = DEFAULT_CAMERA_ID):
+    """Video yayını durumu - istemci başına gönderilen/atlanan kare sayıları"""
+    return {**camera_registry.get(camera_id).video.stats(), "active_streams": stream_limiter.active, "max_streams": stream_limiter.max_streams}
+
+@app.get("/heatmap_feed")
+async def heatmap_feed(request: Request, color_code: str = "MAVI", fps: int = 10,
+                       camera_id: str = DEFAULT_CAMERA_ID):
+    """Canlı ısı haritası stream - Delta E görselleştirme"""
+    if color_code not in AYGUN_COLOR_STANDARDS:
+        raise HTTPException(status_code=400, detail="Geçersiz renk kodu")
+    station = camera_registry.get(camera_id)
+    
+    stream_limiter.acquire()
+    return LimitedStreamingResponse(
+        stream_subscription(station.heatmap_broadcaster(color_code), request, min(30, max(1, fps))),
+        media_type="multipart/x-mixed-replace; boundary=frame"
+    )
+
+@app.get("/heatmap_feed/stats")
+async def heatmap_feed_stats():
+    """Isı haritası yayınları ve önbellek durumu"""
+    feeds = [feed for feed in _stream_feeds() if feed["name"].startswith("heatmap-")]
+    return {"cache": heatmap_cache.stats(), "feeds": feeds}
+
+@app.post("/analyze/upload")
+async def analyze_uploaded_image(file: UploadFile = File(...), product_code: str = "AYG-STR-001",
+                                 include: Optional[str] = None, roi: Optional[str] = None,
+                                 mode: Optional[str] = None, camera_id: str = DEFAULT_CAMERA_ID):
+    """Yüklenen görsel üzerinden analiz yap - include= ile istenmeyen görseller ilk istekte üretilir
+
+    Görsel camera_id istasyonunun ısı haritasında kameranın yerine gösterilir.
+    """
+    station = camera_registry.get(camera_id)
+    if product_code not in AYGUN_PRODUCTS:
+        raise HTTPException(status_code=400, detail="Geçersiz ürün kodu")
+    
+    # Görsel oku - çözme ve analiz iş parçacığı havuzunda
+    options = parse_analysis_options(include, roi, mode)
+    contents = await file.read()
+    frame, result = await analysis_executor.run(analyze_upload_contents, contents, product_code, **options)
+    publish_artifacts(result)
+    observe_analysis(result, "upload")
+    
+    # Yüklenen görseli ve renk kodunu istasyonda sakla
+    station.upload = (next(uploaded_image_versions), frame, AYGUN_PRODUCTS[product_code]["expected_color"])
+    
+    return {**result, "source": "upload", "filename": file.filename}
+
+@app.get("/artifacts/stats")
+async def get_artifact_stats():
+    """Çıktı önbelleği doluluk ve isabet istatistikleri"""
+    return {**artifact_store.stats(), "render_sessions": len(render_sessions),
+            "render_session_capacity": render_sessions.capacity}
+
+@app.get("/artifacts/{artifact_id}")
+async def get_artifact(artifact_id: str, request: Request):
+    """Analiz görselini ham JPEG olarak sun - içerik adresli olduğu için süresiz önbelleklenebilir"""
+    if len(artifact_id) != ARTIFACT_ID_LENGTH or any(c not in "0123456789abcdef" for c in artifact_id):
+        raise HTTPException(status_code=404, detail="Çıktı bulunamadı")
+    if request.headers.get("if-none-match") == f'"{artifact_id}"':
+        return artifact_response(artifact_id, None, request)
+    data = await asyncio.to_thread(artifact_store.get, artifact_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Çıktı bulunamadı veya önbellekten düştü")
+    return artifact_response(artifact_id, data, request)
+
+@app.get("/analysis/{analysis_id}/artifacts/{name}")
+async def get_analysis_artifact(analysis_id: str, name: str, request: Request):
+    """Ertelenmiş görseli ilk istekte üret (analiz tekrarlanmaz), sonrasında önbellekten sun"""
+    session = render_sessions.get(analysis_id)
+    if session is None or name not in IMAGE_RENDERERS:
+        raise HTTPException(status_code=404, detail="Analiz oturumu bulunamadı veya süresi doldu")
+    artifact_id = session.artifacts.get(name)
+    if artifact_id and request.headers.get("if-none-match") == f'"{artifact_id}"':
+        return artifact_response(artifact_id, None, request)
+    artifact_id, data = await analysis_executor.run(session.artifact, name)
+    return artifact_response(artifact_id, data, request)
+
+@app.post("/analyze/upload/batch")
+async def analyze_uploaded_batch(files: List[UploadFile] = File(...), product_code: str = "AYG-STR-001",
+                                 workers: int = BATCH_WORKERS, include: Optional[str] = None,
+                                 roi: Optional[str] = None, mode: Optional[str] = None):
+    """Çoklu görsel veya zip/tar arşivi analizi - her görsel tamamlandıkça bir NDJSON satırı, sonda özet
+
+    Tekli /analyze/upload gibi hat geçmişine, SPC kartlarına ve panoya yazılmaz: çevrimdışı laboratuvar
+    görselleri hattın süreç kontrolünü (Western Electric alarmları) etkilememelidir.
+    """
+    if product_code not in AYGUN_PRODUCTS:
+        raise HTTPException(status_code=400, detail="Geçersiz ürün kodu")
+    options = parse_analysis_options(include, roi, mode)
+    # Binlerce görselde tembel oturumlar tutulmaz; istenen görseller işçide üretilir
+    options["defer_images"] = False
+    options["include_images"] = sorted(options["include_images"])
+    workers = max(1, min(workers, BATCH_WORKERS))
+    
+    async def generate_ndjson():
+        start_time = time.time()
+        summary = BatchSummary(workers)
+        try:
+            async for index, filename, result in iter_upload_results(files, product_code, workers, options):
+                if "error" not in result:
+                    publish_artifacts(result)
+                observe_analysis(result, "upload_batch")
+                summary.add(result)
+                yield ndjson_line({**result, "index": index, "filename": filename, "source": "upload"})
+        except BrokenProcessPool:
+            # Yanıt başladı: hata ve o ana kadarki özet son satır olarak gönderilir
+            yield ndjson_line({"error": BATCH_POOL_BROKEN, "summary": summary.as_dict(time.time() - start_time)})
+            return
+        yield ndjson_line({"summary": summary.as_dict(time.time() - start_time)})
+    
+    return StreamingResponse(generate_ndjson(), media_type="application/x-ndjson")
+
 @app.get("/color-standards")
 async def get_color_standards():
     """Aygün renk standartlarını getir"""
@@ -1026,263 +4420,216 @@ async def get_products():
     """Aygün ürün kataloğunu getir"""
     return [{"code": k, **v} for k, v in AYGUN_PRODUCTS.items()]
 
+@app.get("/cameras")
+async def get_cameras():
+    """Kayıtlı kamera istasyonları - kaynak ayarı ve yakalama durumu"""
+    return [station.info() for station in camera_registry.stations()]
+
+@app.post("/cameras/{camera_id}")
+async def configure_camera(camera_id: str, source: str = "device", index: Optional[int] = None,
+                           recording: Optional[str] = None, file: Optional[str] = None,
+                           width: Optional[int] = None, height: Optional[int] = None, fps: Optional[int] = None,
+                           speed: Optional[float] = None, loop: Optional[bool] = None,
+                           product_code: Optional[str] = None, roi: Optional[str] = None,
+                           mode: Optional[str] = None, start: bool = True):
+    """Kamera istasyonu ekle veya kaynağını değiştir (device / file / replay / synthetic)"""
+    params = {"source": source, "index": index, "recording": recording, "file": file, "width": width,
+              "height": height, "fps": fps, "speed": speed, "loop": loop, "product_code": product_code,
+              "roi": roi, "mode": mode}
+    station = await asyncio.to_thread(camera_registry.configure, camera_id, params)
+    if start:
+        await asyncio.to_thread(station.capture.start)
+    return station.info()
+
+@app.delete("/cameras/{camera_id}")
+async def remove_camera(camera_id: str):
+    """Kamera istasyonunu durdur ve kaldır"""
+    await asyncio.to_thread(camera_registry.remove, camera_id)
+    return {"success": True}
+
 @app.post("/camera/init")
-async def camera_init():
-    """Kamerayı başlat"""
-    success = init_camera()
+async def camera_init(camera_id: str = DEFAULT_CAMERA_ID, source: Optional[str] = None,
+                      recording: Optional[str] = None, speed: float = 1.0, loop: bool = True):
+    """Kamerayı başlat - source=replay&recording=ad ile kayıt oynatılır (speed: 1 orijinal, 0 azami hız)"""
+    station = camera_registry.get(camera_id)
+    if source is not None:
+        # Kaynağa özgü olmayan ayarlar (çözünürlük, FPS, analiz varsayılanları) korunur
+        params = {k: v for k, v in station.config.items() if k not in ("path", "recording", "file", "index")}
+        params.update(source=source, recording=recording, speed=speed, loop=loop)
+        await asyncio.to_thread(camera_registry.configure, camera_id, params)
+    success = await asyncio.to_thread(station.capture.start)
     return {"success": success}
 
+@app.post("/camera/record/start")
+async def camera_record_start(name: str, max_frames: int = 900, camera_id: str = DEFAULT_CAMERA_ID):
+    """Çalışan kameradan kayıt başlat (ham kareler; 720p'de kare başına ~2,7 MB)"""
+    station = camera_registry.get(camera_id)
+    path = recording_path(name)
+    if not station.capture.running:
+        raise HTTPException(status_code=409, detail="Kamera çalışmıyor")
+    if station.recorder is not None and station.recorder.running:
+        raise HTTPException(status_code=409, detail="Kayıt zaten devam ediyor")
+    station.recorder = CameraRecorder(station.capture, path, max(1, max_frames)).start()
+    return {"recording": True, "name": name, "camera_id": camera_id}
+
+@app.post("/camera/record/stop")
+async def camera_record_stop(camera_id: str = DEFAULT_CAMERA_ID):
+    """Kaydı durdur ve dosyayı tamamla"""
+    station = camera_registry.get(camera_id)
+    if station.recorder is None:
+        raise HTTPException(status_code=409, detail="Aktif kayıt yok")
+    return await asyncio.to_thread(station.recorder.stop)
+
+@app.get("/recordings")
+async def get_recordings():
+    """Kayıtlı hat görüntüleri"""
+    return await asyncio.to_thread(list_recordings)
+
 @app.post("/camera/release")
-async def camera_release():
+async def camera_release(camera_id: str = DEFAULT_CAMERA_ID):
     """Kamerayı serbest bırak"""
-    release_camera()
+    await asyncio.to_thread(release_camera, camera_id)
     return {"success": True}
 
 @app.post("/analyze/start")
-async def start_analysis():
-    """Analiz modunu başlat"""
-    global is_analyzing
-    is_analyzing = True
-    return {"analyzing": True}
+async def start_analysis(camera_id: str = DEFAULT_CAMERA_ID, product_code: Optional[str] = None,
+                         roi: Optional[str] = None, mode: Optional[str] = None, render: str = "rejected",
+                         workers: Optional[str] = None, queue_size: int = PIPELINE_QUEUE_SIZE,
+                         drop_policy: str = PIPELINE_DROP_POLICY):
+    """Sürekli muayeneyi başlat - istasyon kamerasının her karesi hattan geçer
+
+    workers: "analyze=4,render=2" gibi aşama işçi sayıları; drop_policy: drop_oldest / drop_newest /
+    block (giriş kuyruğu doluyken); render: none / rejected / all (işaretli görsel üretilecek muayeneler).
+    """
+    station = camera_registry.get(camera_id)
+    defaults = station.analysis_defaults()
+    product_code = product_code or defaults["product_code"] or "AYG-STR-001"
+    if product_code not in AYGUN_PRODUCTS:
+        raise HTTPException(status_code=400, detail="Geçersiz ürün kodu")
+    if render not in PIPELINE_RENDER_POLICIES:
+        raise HTTPException(status_code=400, detail=f"Geçersiz render politikası: {render}")
+    if drop_policy not in PIPELINE_DROP_POLICIES:
+        raise HTTPException(status_code=400, detail=f"Geçersiz drop politikası: {drop_policy}")
+    options = parse_analysis_options(None, roi or defaults["roi"], mode or defaults["mode"])
+    pipeline = await asyncio.to_thread(
+        start_pipeline, station, product_code=product_code, roi=options["roi"], mode=options["mode"],
+        workers=parse_stage_workers(workers), queue_size=queue_size, drop_policy=drop_policy, render=render)
+    return {"analyzing": True, **pipeline.stats()}
 
 @app.post("/analyze/stop")
-async def stop_analysis():
-    """Analiz modunu durdur"""
-    global is_analyzing
-    is_analyzing = False
-    return {"analyzing": False}
+async def stop_analysis(camera_id: str = DEFAULT_CAMERA_ID):
+    """Sürekli muayeneyi durdur - hattaki kareler bitirilir, son istatistikler döner"""
+    stats = await asyncio.to_thread(stop_pipeline, camera_registry.get(camera_id))
+    return {"analyzing": False, **(stats or {})}
+
+@app.get("/analyze/pipeline")
+async def get_pipeline_stats(camera_id: str = DEFAULT_CAMERA_ID):
+    """Sürekli muayene hattı - aşama başına verim, gecikme, kuyruk doluluğu ve atılan kareler"""
+    station = camera_registry.get(camera_id)
+    if station.pipeline is None:
+        return {"analyzing": False}
+    stats = station.pipeline.stats()
+    return {"analyzing": stats["running"], **stats}
 
 @app.post("/analyze")
-async def analyze_product(product_code: str = "AYG-STR-001"):
-    """Ürün analizi yap - Fotoğraf çeker ve kusurları işaretler"""
-    start_time = time.time()
-    
+async def analyze_product(product_code: Optional[str] = None, include: Optional[str] = None,
+                          roi: Optional[str] = None, mode: Optional[str] = None,
+                          camera_id: str = DEFAULT_CAMERA_ID):
+    """Ürün analizi yap - Fotoğraf çeker ve kusurları işaretler
+
+    include: "all", "none" (varsayılan) veya görsel adları; istenmeyen görseller
+    sonuçtaki URL ilk istendiğinde üretilir. roi: "x,y,w,h" oranları; mode: full / pyramid.
+    Verilmeyen ürün kodu, ROI ve mod camera_id istasyonunun ayarlarından alınır.
+    """
+    defaults = camera_registry.get(camera_id).analysis_defaults()
+    product_code = product_code or defaults["product_code"] or "AYG-STR-001"
     if product_code not in AYGUN_PRODUCTS:
         raise HTTPException(status_code=400, detail="Geçersiz ürün kodu")
+    options = parse_analysis_options(include, roi or defaults["roi"], mode or defaults["mode"])
     
-    product = AYGUN_PRODUCTS[product_code]
-    color_code = product["expected_color"]
-    color_standard = AYGUN_COLOR_STANDARDS[color_code]
-    
-    # Kameradan görüntü al (yoksa simülasyon)
-    frame = get_frame()
-    
-    # Kamera yoksa simülasyon görüntüsü oluştur
-    if frame is None:
-        frame = create_simulated_image(product_code, color_code)
-    
-    original_frame = frame.copy() if frame is not None else None
-    
-    # Renk analizi
-    measured_lab = analyze_color_region(frame, color_code)
-    reference_lab = color_standard["lab_reference"]
-    
-    # Delta E hesapla
-    delta_e = calculate_delta_e_2000(measured_lab, reference_lab)
-    
-    # Tolerans kontrolü
-    quality_level = product["quality_level"]
-    if quality_level == "premium":
-        tolerance = color_standard["tolerance_premium"]
-    elif quality_level == "standard":
-        tolerance = color_standard["tolerance_standard"]
-    else:
-        tolerance = color_standard["tolerance_functional"]
-    
-    if delta_e <= tolerance:
-        delta_e_status = "UYGUN"
-        color_status = "GECTI"
-    elif delta_e <= tolerance * 1.5:
-        delta_e_status = "SINIRDA"
-        color_status = "UYARI"
-    else:
-        delta_e_status = "UYGUNSUZ"
-        color_status = "KALDI"
-    
-    # Parlaklık analizi
-    gloss = calculate_gloss(frame)
-    if product["gloss_min"] <= gloss <= product["gloss_max"]:
-        gloss_status = "GECTI"
-    else:
-        gloss_status = "KALDI"
-    
-    # Kusur tespiti
-    defects = detect_surface_defects(frame)
-    critical_defects = [d for d in defects if d["severity"] == "critical"]
-    
-    # Genel karar
-    if color_status == "KALDI" or gloss_status == "KALDI" or len(critical_defects) > 0:
-        overall_status = "RED"
-    elif color_status == "UYARI" or len(defects) > 2:
-        overall_status = "INCELEME"
-    else:
-        overall_status = "ONAY"
-    
-    # Öneri oluştur
-    recommendations = []
-    if delta_e > tolerance:
-        recommendations.append(f"Renk sapması yüksek (ΔE={delta_e}). Eloksal banyosu kontrol edilmeli.")
-    if gloss_status == "KALDI":
-        recommendations.append(f"Parlaklık değeri ({gloss} GU) tolerans dışı. Yüzey işlemi gözden geçirilmeli.")
-    if len(defects) > 0:
-        recommendations.append(f"{len(defects)} adet yüzey kusuru tespit edildi.")
-    
-    recommendation = " | ".join(recommendations) if recommendations else "Ürün kalite standartlarına uygun."
-    
-    processing_time = (time.time() - start_time) * 1000
+    # Kare alma ve analiz iş parçacığı havuzunda (olay döngüsü serbest kalır)
+    result = await analysis_executor.run(capture_and_analyze, product_code, camera_id, **options)
+    publish_artifacts(result)
+    observe_analysis(result, "camera")
     
-    # Gelişmiş parametreleri hesapla
-    advanced_params = calculate_advanced_parameters(original_frame, defects, delta_e)
-    
-    # Problem 2: Yüzey kalitesi ve renk tutarlılığı analizi
-    surface_quality = analyze_surface_quality(original_frame)
-    color_consistency = analyze_color_consistency(original_frame, color_code)
-    
-    # Kusurları görüntü üzerine çiz
-    annotated_image = None
-    image_base64 = None
-    color_heatmap_base64 = None
-    gloss_map_base64 = None
-    defect_heatmap_base64 = None
-    
-    if original_frame is not None:
-        annotated_image = draw_defects_on_image(original_frame, defects, color_status, product["name"])
-        
-        # Base64'e çevir
-        if annotated_image is not None:
-            _, buffer = cv2.imencode('.jpg', annotated_image, [cv2.IMWRITE_JPEG_QUALITY, 90])
-            image_base64 = base64.b64encode(buffer).decode('utf-8')
-        
-        # Renk haritası
-        color_heatmap = generate_color_heatmap(original_frame, color_code)
-        if color_heatmap is not None:
-            _, buffer = cv2.imencode('.jpg', color_heatmap, [cv2.IMWRITE_JPEG_QUALITY, 85])
-            color_heatmap_base64 = base64.b64encode(buffer).decode('utf-8')
-        
-        # Parlaklık haritası
-        gloss_map = generate_gloss_map(original_frame)
-        if gloss_map is not None:
-            _, buffer = cv2.imencode('.jpg', gloss_map, [cv2.IMWRITE_JPEG_QUALITY, 85])
-            gloss_map_base64 = base64.b64encode(buffer).decode('utf-8')
-        
-        # Kusur yoğunluk haritası
-        defect_heatmap = generate_defect_heatmap(original_frame, defects)
-        if defect_heatmap is not None:
-            _, buffer = cv2.imencode('.jpg', defect_heatmap, [cv2.IMWRITE_JPEG_QUALITY, 85])
-            defect_heatmap_base64 = base64.b64encode(buffer).decode('utf-8')
-    
-    result = {
-        "product_code": product_code,
-        "product_name": product["name"],
-        "expected_color": color_standard["name"],
-        "timestamp": datetime.now().isoformat(),
-        "measured_lab": {k: round(v, 2) for k, v in measured_lab.items()},
-        "reference_lab": reference_lab,
-        "delta_e": delta_e,
-        "delta_e_tolerance": tolerance,
-        "delta_e_status": delta_e_status,
-        "color_status": color_status,
-        "gloss_value": gloss,
-        "gloss_range": f"{product['gloss_min']}-{product['gloss_max']} GU",
-        "gloss_status": gloss_status,
-        "defects_detected": defects,
-        "defect_count": len(defects),
-        "overall_status": overall_status,
-        "confidence": round(95 - delta_e * 2 - len(defects) * 2, 1),
-        "processing_time_ms": round(processing_time, 1),
-        "recommendation": recommendation,
-        "advanced_parameters": advanced_params,
-        "surface_quality": surface_quality,
-        "color_consistency": color_consistency,
-        "annotated_image": image_base64,
-        "color_heatmap": color_heatmap_base64,
-        "gloss_map": gloss_map_base64,
-        "defect_heatmap": defect_heatmap_base64
-    }
-    
-    # Geçmişe ekle (görüntüler olmadan)
-    history_entry = {k: v for k, v in result.items() if k not in ["annotated_image", "color_heatmap", "gloss_map", "defect_heatmap"]}
-    measurement_history.insert(0, history_entry)
-    if len(measurement_history) > 100:
-        measurement_history.pop()
+    add_to_history(result)
     
     return result
 
 @app.post("/analyze/batch")
-async def batch_analyze(count: int = 20):
-    """Toplu analiz simülasyonu"""
-    results = []
-    product_codes = list(AYGUN_PRODUCTS.keys())
+async def batch_analyze(count: int = 20, workers: int = BATCH_WORKERS, include_images: bool = True,
+                        stream: bool = False):
+    """Toplu analiz simülasyonu - süreç havuzunda paralel; stream=true ise NDJSON olarak akıtılır"""
+    product_codes = [str(code) for code in np.random.choice(list(AYGUN_PRODUCTS.keys()), max(0, count))]
+    workers = max(1, min(workers, BATCH_WORKERS))
     
-    for _ in range(count):
-        code = np.random.choice(product_codes)
-        result = await analyze_product(code)
-        results.append(result)
+    start_time = time.time()
+    summary = BatchSummary(workers)
+    
+    async def run():
+        async for _, result in iter_batch_results(product_codes, workers, include_images):
+            if "error" not in result:
+                publish_artifacts(result)
+                add_to_history(result)
+            observe_analysis(result, "batch")
+            summary.add(result)
+            yield result, None
+        yield None, summary.as_dict(time.time() - start_time)
+    
+    if stream:
+        async def generate_ndjson():
+            try:
+                async for result, totals in run():
+                    yield ndjson_line(result if totals is None else {"summary": totals})
+            except BrokenProcessPool:
+                # Yanıt başladı: hata ve o ana kadarki özet son satır olarak gönderilir
+                yield ndjson_line({"error": BATCH_POOL_BROKEN, "summary": summary.as_dict(time.time() - start_time)})
+        return StreamingResponse(generate_ndjson(), media_type="application/x-ndjson")
     
-    return {"count": len(results), "results": results}
+    results = []
+    try:
+        async for result, totals in run():
+            if totals is None:
+                results.append(result)
+    except BrokenProcessPool:
+        raise HTTPException(status_code=503, detail=BATCH_POOL_BROKEN)
+    return {**totals, "results": results}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metin biçiminde metrikler - aşama gecikme histogramları, sayaçlar, kuyruk göstergeleri"""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 @app.get("/dashboard")
 async def get_dashboard():
-    """Dashboard istatistikleri"""
-    total = len(measurement_history)
-    approved = sum(1 for m in measurement_history if m["overall_status"] == "ONAY")
-    review = sum(1 for m in measurement_history if m["overall_status"] == "INCELEME")
-    rejected = sum(1 for m in measurement_history if m["overall_status"] == "RED")
-    
-    # Delta E trend
-    delta_e_values = [m["delta_e"] for m in measurement_history[:20]]
-    avg_delta_e = np.mean(delta_e_values) if delta_e_values else 0
-    
-    # Renk dağılımı
-    color_dist = {}
-    for m in measurement_history:
-        color = m.get("expected_color", "Bilinmiyor")
-        color_dist[color] = color_dist.get(color, 0) + 1
-    
-    # Trend uyarısı
-    trend_warning = None
-    if len(delta_e_values) >= 10:
-        recent_avg = np.mean(delta_e_values[:5])
-        older_avg = np.mean(delta_e_values[5:10])
-        if recent_avg > older_avg * 1.3:
-            trend_warning = f"⚠️ Son kontrollerde ΔE artış trendi tespit edildi ({older_avg:.2f} → {recent_avg:.2f}). Eloksal banyosu parametrelerini kontrol ediniz."
-    
-    # Kalite skoru hesapla
-    quality_rate = round((approved + review * 0.5) / total * 100, 1) if total > 0 else 100
-    
-    # Parlaklık istatistikleri
-    gloss_values = [m.get("gloss_value", 50) for m in measurement_history[:20]]
-    avg_gloss = round(np.mean(gloss_values), 1) if gloss_values else 50
-    
-    # Kusur istatistikleri
-    defect_counts = [m.get("defect_count", 0) for m in measurement_history[:20]]
-    avg_defects = round(np.mean(defect_counts), 2) if defect_counts else 0
-    
-    return {
-        "total_inspections": total,
-        "approved": approved,
-        "review": review,
-        "rejected": rejected,
-        "approval_rate": round(approved / total * 100, 1) if total > 0 else 0,
-        "quality_rate": quality_rate,
-        "avg_delta_e": round(avg_delta_e, 2),
-        "avg_gloss": avg_gloss,
-        "avg_defects": avg_defects,
-        "color_distribution": color_dist,
-        "trend_warning": trend_warning,
-        "recent_inspections": measurement_history[:20]
-    }
+    """Dashboard istatistikleri - ekleme anında güncellenen toplamlardan"""
+    snapshot = dashboard_aggregates.snapshot()
+    snapshot["trend_warning"] = spc_engine.trend_warning()
+    return snapshot
 
 @app.get("/history")
-async def get_history(limit: int = 50):
-    """Ölçüm geçmişi"""
-    return measurement_history[:limit]
+async def get_history(limit: int = 50, before_id: Optional[int] = None, offset: int = 0,
+                      product_code: Optional[str] = None, expected_color: Optional[str] = None,
+                      overall_status: Optional[str] = None, since: Optional[str] = None,
+                      until: Optional[str] = None):
+    """Ölçüm geçmişi - kalıcı depodan filtreli ve sayfalı (sonraki sayfa: before_id = son kaydın id'si)"""
+    return await asyncio.to_thread(
+        history_store.query, min(max(1, limit), 1000), before_id, max(0, offset), product_code,
+        resolve_color_name(expected_color) if expected_color else None, overall_status, since, until)
 
 @app.delete("/history")
 async def clear_history():
-    """Geçmişi temizle"""
+    """Pano geçmişini temizle - kalıcı tablo SİLİNMEZ
+
+    Bellek içi son ölçümler ve pano/trend toplamları sıfırlanır. Kalıcı kayıtlar izlenebilirlik için
+    korunur ve /history'de görünmeye devam eder; temizleme anı depoya yazılır, yeniden başlatmada
+    pano yalnızca bu andan sonraki kayıtlardan kurulur.
+    """
+    cleared_at = datetime.now().isoformat()
+    await asyncio.to_thread(history_store.set_meta, HISTORY_CLEARED_KEY, cleared_at)
     measurement_history.clear()
-    return {"success": True}
+    dashboard_aggregates.reset()
+    return {"success": True, "cleared_at": cleared_at, "persisted_records_kept": True}
 
 @app.get("/trend-analysis")
 async def get_trend_analysis():
@@ -1292,7 +4639,7 @@ async def get_trend_analysis():
     
     # Son 50 ölçümün trend analizi
     trends = []
-    for i, m in enumerate(measurement_history[:50]):
+    for i, m in enumerate(itertools.islice(measurement_history, 50)):
         trends.append({
             "index": i,
             "timestamp": m["timestamp"],
@@ -1303,14 +4650,32 @@ async def get_trend_analysis():
     
     return {
         "data": trends,
-        "stats": {
-            "delta_e_mean": round(np.mean([t["delta_e"] for t in trends]), 2),
-            "delta_e_std": round(np.std([t["delta_e"] for t in trends]), 2),
-            "gloss_mean": round(np.mean([t["gloss"] for t in trends]), 1),
-            "rejection_rate": round(sum(1 for t in trends if t["status"] == "RED") / len(trends) * 100, 1)
-        }
+        "stats": dashboard_aggregates.trend_stats(),
+        "spc": spc_engine.state(scope="all").get("all", {}).get("*", {}),
+        "alarms": spc_engine.recent_alarms(limit=10),
+        "trend_warning": spc_engine.trend_warning()
     }
 
+@app.get("/spc")
+async def get_spc_state(scope: Optional[str] = None, key: Optional[str] = None):
+    """Kontrol kartlarının güncel durumu - kapsam: all / product / color / camera"""
+    if scope is not None and scope not in ("all", "product", "color", "camera"):
+        raise HTTPException(status_code=400, detail="Geçersiz kapsam")
+    return {"charts": spc_engine.state(scope, key), "baseline_size": SPC_BASELINE_SIZE}
+
+@app.get("/spc/alarms")
+async def get_spc_alarms(limit: int = 50, scope: Optional[str] = None, key: Optional[str] = None,
+                         metric: Optional[str] = None):
+    """Son SPC alarmları (en yeni önce)"""
+    limit = max(1, min(limit, spc_engine.alarms.maxlen))
+    return {"alarms": spc_engine.recent_alarms(limit, scope, key, metric)}
+
+@app.post("/spc/reset")
+async def reset_spc(scope: Optional[str] = None, key: Optional[str] = None):
+    """Kontrol kartlarını sıfırla - yeni referans dönemi başlatır (ör. banyo ayarı sonrası)"""
+    spc_engine.reset(scope, key)
+    return {"success": True}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
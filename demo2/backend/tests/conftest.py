@@ -0,0 +1,12 @@
+"""ColorQC testleri - modül içe aktarılmadan önce kalıcı dosyalar geçici dizine yönlendirilir"""
+import os
+import sys
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="colorqc-test-")
+os.environ["COLORQC_DB_PATH"] = os.path.join(_tmp, "history.db")
+os.environ["COLORQC_ARTIFACT_DIR"] = os.path.join(_tmp, "artifacts")
+os.environ["COLORQC_RECORDING_DIR"] = os.path.join(_tmp, "recordings")
+os.environ.pop("COLORQC_CAMERAS", None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,52 @@
+"""İntegral görüntü tabanlı blok istatistikleri - döngü karşılığıyla"""
+import numpy as np
+import pytest
+
+import color_qc as qc
+
+def naive_block_stats(image, block_size):
+    h, w = image.shape[:2]
+    origins_y = range(0, h - block_size, block_size)
+    origins_x = range(0, w - block_size, block_size)
+    shape = (len(origins_y), len(origins_x)) + image.shape[2:]
+    mean, std = np.zeros(shape), np.zeros(shape)
+    for r, y in enumerate(origins_y):
+        for c, x in enumerate(origins_x):
+            block = image[y:y + block_size, x:x + block_size].astype(np.float64)
+            mean[r, c] = block.mean(axis=(0, 1))
+            std[r, c] = block.std(axis=(0, 1))
+    return mean, std
+
+@pytest.fixture(scope="module")
+def frame():
+    rng = np.random.RandomState(7)
+    # Tek biçimli gürültü yerine farklı renkli düzgün bölgeler: blok ortalama ve std'leri değişken
+    base = rng.randint(0, 256, (13, 17, 3)).astype(np.uint8)
+    image = np.kron(base, np.ones((8, 8, 1), dtype=np.uint8))[:97, :130]
+    return np.clip(image.astype(np.int16) + rng.randint(-20, 21, image.shape), 0, 255).astype(np.uint8)
+
+@pytest.mark.parametrize("block_size", [4, 8, 16, 32])
+def test_block_stats_bgr_matches_loop(frame, block_size):
+    stats = qc.compute_block_stats(frame, block_size)
+    mean, std = naive_block_stats(frame, block_size)
+    assert (stats["rows"], stats["cols"]) == mean.shape[:2]
+    np.testing.assert_allclose(stats["mean"], mean, atol=1e-9)
+    np.testing.assert_allclose(stats["std"], std, atol=1e-6)
+
+def test_block_stats_gray_and_delta_e(frame):
+    gray = frame[..., 1].copy()
+    stats = qc.compute_block_stats(gray, 16)
+    mean, std = naive_block_stats(gray, 16)
+    np.testing.assert_allclose(stats["mean"], mean, atol=1e-9)
+    np.testing.assert_allclose(stats["std"], std, atol=1e-6)
+    
+    ref_lab = {"L": 50.0, "a": 10.0, "b": -20.0}
+    stats = qc.compute_block_stats(frame, 16, ref_lab)
+    mean, _ = naive_block_stats(frame, 16)
+    expected = qc.delta_e_2000_array(qc.bgr_to_lab_array(mean), ref_lab)
+    np.testing.assert_allclose(stats["delta_e"], expected, atol=1e-4)
+
+def test_block_stats_smaller_than_block(frame):
+    stats = qc.compute_block_stats(frame[:10, :10], 16)
+    assert (stats["rows"], stats["cols"]) == (0, 0)
+    assert stats["mean"].shape == (0, 0, 3)
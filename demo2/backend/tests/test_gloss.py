@@ -0,0 +1,39 @@
+"""Vektörleştirilmiş parlaklık alanı - özgün kayan pencere döngüsüyle"""
+import numpy as np
+import pytest
+
+import color_qc as qc
+
+def naive_gloss_field(gray, window, stride):
+    """Özgün generate_gloss_map döngüsü - pencereler sırayla üst üste yazılır"""
+    h, w = gray.shape
+    dense = np.zeros((h, w), dtype=np.float32)
+    for y in range(0, h - window, stride):
+        for x in range(0, w - window, stride):
+            block = gray[y:y + window, x:x + window]
+            high_vals = np.sum(block > 200) / (window * window)
+            dense[y:y + window, x:x + window] = min(100, (high_vals * 100 + np.std(block) / 2.55) / 2)
+    return dense
+
+@pytest.fixture(scope="module")
+def gray():
+    rng = np.random.RandomState(11)
+    image = np.kron(rng.randint(0, 256, (13, 17)), np.ones((8, 8)))[:97, :130]
+    image = np.clip(image + rng.randint(-20, 21, image.shape), 0, 255).astype(np.uint8)
+    image[40:60, 30:90] = 230  # Parlak bölge: highlight oranı sıfırdan farklı
+    return image
+
+@pytest.mark.parametrize("window,stride", [(32, 16), (16, 16), (20, 7), (16, 32), (8, 20), (10, 23)])
+def test_gloss_field_matches_loop(gray, window, stride):
+    field = qc.compute_gloss_field(gray, window, stride)
+    np.testing.assert_allclose(field["map"], naive_gloss_field(gray, window, stride), atol=1e-3)
+
+def test_gloss_field_gaps_stay_zero_when_stride_exceeds_window():
+    bright = np.full((96, 128), 240, dtype=np.uint8)
+    dense = qc.compute_gloss_field(bright, window=8, stride=20)["map"]
+    # Pencere başlangıçları 0, 20, 40...; her pencereden sonraki 12 piksel hiçbir pencerede değil
+    assert dense[0, 0] > 0 and dense[0, 8:20].max() == 0 and dense[8:20, 0].max() == 0
+
+def test_gloss_grid_matches_field_grid(gray):
+    np.testing.assert_array_equal(qc.compute_gloss_grid(gray, 20, 7)["grid"],
+                                  qc.compute_gloss_field(gray, 20, 7)["grid"])
@@ -0,0 +1,57 @@
+"""ControlChart - Western Electric kuralları, oluşturulmuş serilerle"""
+import pytest
+
+import color_qc as qc
+
+CENTER = 10.0
+BASELINE = [9.0, 11.0] * 10  # Merkez 10, MR̄ = 2 -> sigma = 2 / 1.128
+
+def monitoring_chart():
+    chart = qc.ControlChart(baseline_size=len(BASELINE))
+    for value in BASELINE:
+        assert chart.update(value) == []
+    assert chart.phase == "monitoring"
+    assert chart.center == pytest.approx(CENTER)
+    assert chart.sigma == pytest.approx(2 / 1.128)
+    return chart
+
+def feed(chart, z_scores):
+    """z-skorlarını sırayla işle; her ölçümde tetiklenen kuralların listesi"""
+    return [{rule: direction for rule, direction in chart.update(CENTER + z * chart.sigma)}
+            for z in z_scores]
+
+def test_baseline_phase_raises_no_alarms():
+    chart = qc.ControlChart(baseline_size=len(BASELINE))
+    assert all(chart.update(value) == [] for value in BASELINE[:-1])
+    assert chart.phase == "baseline"
+
+def test_shewhart_single_point_beyond_three_sigma():
+    fired = feed(monitoring_chart(), [0.2, 3.5])
+    assert "shewhart" not in fired[0]
+    assert fired[1]["shewhart"] == "up"
+
+def test_we2_two_of_three_beyond_two_sigma():
+    fired = feed(monitoring_chart(), [-2.5, 0.0, -2.5])
+    assert "we2" not in fired[0] and "we2" not in fired[1]
+    assert fired[2]["we2"] == "down"
+    assert "shewhart" not in fired[2]
+
+def test_we3_four_of_five_beyond_one_sigma():
+    fired = feed(monitoring_chart(), [1.5, 1.5, 0.0, 1.5, 1.5])
+    assert all("we3" not in f for f in fired[:4])
+    assert fired[4]["we3"] == "up"
+    assert all("we2" not in f for f in fired)
+
+def test_we4_eight_in_a_row_on_one_side():
+    fired = feed(monitoring_chart(), [0.5] * 8)
+    assert all("we4" not in f for f in fired[:7])
+    assert fired[7]["we4"] == "up"
+    assert all("we3" not in f and "we2" not in f for f in fired)
+
+def test_rule_fires_once_per_violation():
+    fired = feed(monitoring_chart(), [0.5] * 10)
+    assert [i for i, f in enumerate(fired) if "we4" in f] == [7]
+
+def test_in_control_series_raises_no_zone_alarms():
+    fired = feed(monitoring_chart(), [0.5, -0.5] * 20)
+    assert not any(rule in f for f in fired for rule in ("shewhart", "we2", "we3", "we4", "cusum"))